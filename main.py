@@ -1,15 +1,22 @@
 import sys
+import signal
 from spanky.streamwrap import StreamWrap
 # Wrap things early
 sys.stdout = StreamWrap(sys.stdout, "stdout")
 sys.stderr = StreamWrap(sys.stderr, "stderr")
 
 from spanky.bot import Bot
+from spanky.hook2 import storage
+
+# restart and docker stop send SIGTERM, exit through the finally below instead of dying on the spot
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
 bot = Bot("nextcord")
-bot.loop.run_until_complete(bot.start())
 
 try:
+    bot.loop.run_until_complete(bot.start())
     bot.loop.run_forever()
 finally:
+    # Write the storage changes the flusher hasn't written yet
+    storage.flush_all()
     bot.loop.close()
@@ -73,15 +73,22 @@ def find_event_by_text_match(storage, text, str_to_id):
     if not "on_join" in storage:
         return events
 
-    for item in storage["on_join"]:
-        if item["type"] == "message":
-            if text == item["message"]:
-                events.append(item)
-        elif item["type"] == "role":
-            if str_to_id(text) == item["role"]:
-                events.append(item)
-
-    return events
+    messages = [
+        item
+        for item in storage.index("on_join", key="message").get(text)
+        if item["type"] == "message"
+    ]
+    roles = [
+        item
+        for item in storage.index("on_join", key="role").get(str_to_id(text))
+        if item["type"] == "role"
+    ]
+
+    # Each index lists its matches in list order, keep that order when both kinds matched
+    if messages and roles:
+        order = {id(item): pos for pos, item in enumerate(storage["on_join"])}
+        return sorted(messages + roles, key=lambda item: order[id(item)])
+    return messages + roles
 
 
 @hook.command(permissions=Permission.admin)
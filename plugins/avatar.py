@@ -36,10 +36,10 @@ async def set_avatar(event, async_set_avatar):
     Set bot avatar
     """
     try:
-        for img in event.image:
+        img = await event.async_image()
+        if img:
             img.fetch_url()
             await async_set_avatar(img._raw[0])
-            return
     except:
         import traceback
 
@@ -1,17 +1,64 @@
+import datetime
 import os
 from spanky.plugin import hook
 from spanky.plugin.permissions import Permission
+from spanky.hook2 import snapshots
 
 
 @hook.periodic(3600 * 12)
 def backup_data():
+    stats = snapshots.store.take()
+    print(
+        "Storage snapshot: %d documents, %d changed"
+        % (stats["documents"], stats["changed"])
+    )
+
+    # Offsite copy, the snapshots themselves stay on this host
     os.system(
-        'cd storage_data && \
-            git add -A && \
-            git commit -m "Update data" && \
-            git push'
+        "cd storage_data && "
+        "git add -A -- . ':!.snapshots' && "
+        "git commit -m 'Update data' && "
+        "git push"
     )
 
-@hook.command(permission=Permission.bot_owner)
+
+@hook.command(permissions=Permission.bot_owner)
 def force_backup_data():
     backup_data()
+
+
+def fmt_time(when):
+    return datetime.datetime.fromtimestamp(when).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@hook.command(permissions=Permission.bot_owner)
+def list_backups():
+    """
+    List storage snapshots
+    """
+    times = snapshots.store.list()
+    if not times:
+        return "No snapshots"
+    return "Snapshots:\n" + "\n".join(fmt_time(when) for when in times[-30:])
+
+
+@hook.command(permissions=Permission.bot_owner)
+def restore_backup(text):
+    """
+    <server ID> <plugin storage name> [YYYY-MM-DD HH:MM] - restore a plugin's storage for a server, as it was at the given time (latest snapshot by default)
+    """
+    args = text.split(maxsplit=2)
+    if len(args) < 2:
+        return "Usage: <server ID> <plugin storage name> [YYYY-MM-DD HH:MM]"
+
+    when = None
+    if len(args) == 3:
+        try:
+            when = datetime.datetime.fromisoformat(args[2]).timestamp()
+        except ValueError:
+            return "Could not parse %s as a date" % args[2]
+
+    restored = snapshots.store.restore(args[0], args[1], when)
+    if restored is None:
+        return "No snapshot found"
+    return "Restored from the snapshot taken at %s" % fmt_time(restored)
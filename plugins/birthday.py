@@ -141,6 +141,7 @@ def debug_msg(debug_srv, send_message, msg):
         server=debug_srv,
         target="869130692490059816",
         check_old=False,
+        priority="bulk",
     )
 
 
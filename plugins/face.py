@@ -94,14 +94,15 @@ def get_overlay(name, location):
 
 
 @hook.command(params="string:name=random")
-def glasses(event, send_file, send_message, cmd_args):
+async def glasses(event, send_file, send_message, cmd_args):
     valid, overlay = get_overlay(cmd_args["name"], "face_res/glasses/")
 
     if not valid:
         return overlay
 
-    for img in event.image:
-        img.proc_each_pil_frame(
+    img = await event.async_image()
+    if img:
+        await img.async_proc_each_pil_frame(
             add_glasses, send_file, send_message, {"glasses_img": overlay}
         )
 
@@ -171,14 +172,15 @@ def add_glasses(image, glasses_img, debug=False):
 
 
 @hook.command(params="string:name=random")
-def moustache(event, send_file, send_message, cmd_args):
+async def moustache(event, send_file, send_message, cmd_args):
     valid, overlay = get_overlay(cmd_args["name"], "face_res/moustache/")
 
     if not valid:
         return overlay
 
-    for img in event.image:
-        img.proc_each_pil_frame(
+    img = await event.async_image()
+    if img:
+        await img.async_proc_each_pil_frame(
             add_moustache, send_file, send_message, {"moustache_img": overlay}
         )
 
@@ -252,14 +254,17 @@ def add_moustache(image, moustache_img, debug=False):
 
 
 @hook.command(params="string:name=random")
-def hat(event, send_file, send_message, cmd_args):
+async def hat(event, send_file, send_message, cmd_args):
     valid, overlay = get_overlay(cmd_args["name"], "face_res/hat/")
 
     if not valid:
         return overlay
 
-    for img in event.image:
-        img.proc_each_pil_frame(add_hat, send_file, send_message, {"hat_img": overlay})
+    img = await event.async_image()
+    if img:
+        await img.async_proc_each_pil_frame(
+            add_hat, send_file, send_message, {"hat_img": overlay}
+        )
 
 
 def add_hat(image, hat_img, debug=False):
@@ -329,14 +334,15 @@ def add_hat(image, hat_img, debug=False):
 
 
 @hook.command(params="string:name=random")
-def eyes(event, send_file, send_message, cmd_args):
+async def eyes(event, send_file, send_message, cmd_args):
     valid, overlay = get_overlay(cmd_args["name"], "face_res/eyes/")
 
     if not valid:
         return overlay
 
-    for img in event.image:
-        img.proc_each_pil_frame(
+    img = await event.async_image()
+    if img:
+        await img.async_proc_each_pil_frame(
             add_eyes, send_file, send_message, {"eyes_img": overlay}
         )
 
@@ -61,10 +61,9 @@ async def grab(text, channel, storage, reply, event):
     if not storage["grabs"]:
         storage["grabs"] = []
 
-    for elem in storage["grabs"]:
-        if elem["id"] == to_grab.id:
-            reply("Message already grabbed")
-            return
+    if storage.index("grabs", key="id").get(to_grab.id):
+        reply("Message already grabbed")
+        return
 
     grab_data = {}
     grab_data["text"] = to_grab.clean_content
@@ -73,7 +72,7 @@ async def grab(text, channel, storage, reply, event):
     grab_data["author_name"] = to_grab.author.name
 
     storage["grabs"].append(grab_data)
-    storage.sync()
+    await storage.async_sync()
 
     reply("Done.")
 
@@ -115,10 +114,7 @@ def grabu(text, storage, str_to_id):
     """
 
     user = str_to_id(text)
-    content = []
-    for msg in storage["grabs"]:
-        if msg["author_id"] == user:
-            content.append(msg["text"])
+    content = [msg["text"] for msg in storage.index("grabs", key="author_id").get(user)]
 
     if len(content) == 0:
         return "Nothing here."
@@ -133,7 +129,10 @@ async def grabl(event, storage, async_send_message, str_to_id, user_id_to_name,
     """
     text = str_to_id(text)
     if text != "":
-        content = get_data(lambda m: m["author_id"] == text, storage)
+        content = [
+            "<%s> %s" % (msg["author_name"], msg["text"])
+            for msg in storage.index("grabs", key="author_id").get(text)
+        ]
         description = "Grabs for %s:" % user_id_to_name(text)
     else:
         content = get_data(None, storage)
@@ -3,12 +3,22 @@ import markovify
 from plugins.log import get_msgs_for_user_in_chan, get_msgs_in_chan
 from spanky.utils.discord_utils import str_to_id, get_channel_by_id
 from spanky.plugin import hook
+from spanky.hook2 import executors
 
 MSG_LIMIT = 10000
 
 
+def make_sentence(msg_list):
+    # Runs in the process pool, keep it free of bot objects
+    text_model = markovify.NewlineText("\n".join(msg_list), retain_original=False)
+
+    return text_model.make_short_sentence(
+        min_chars=50, max_chars=300, tries=10000, DEFAULT_MAX_OVERLAP_RATIO=0.4
+    )
+
+
 @hook.command()
-def markov(server, text, event):
+async def markov(server, text, event):
     """
     <user channel> - Generate sentence using a markov chain for a user using data from the given channel.
     If no user is specified, a sentence will be generated using all user messages.
@@ -41,9 +51,11 @@ def markov(server, text, event):
     # Get data
     msg_list = []
     if user == "":
-        msg_list = get_msgs_in_chan(chan.id, MSG_LIMIT)
+        msg_list = await executors.run("thread", get_msgs_in_chan, chan.id, MSG_LIMIT)
     else:
-        msg_list = get_msgs_for_user_in_chan(user, chan.id, MSG_LIMIT)
+        msg_list = await executors.run(
+            "thread", get_msgs_for_user_in_chan, user, chan.id, MSG_LIMIT
+        )
 
     msg_list = list(set(msg_list))
     if len(msg_list) == 0:
@@ -57,8 +69,6 @@ def markov(server, text, event):
             msg_list.pop(idx)
 
     print("Inputting %d messages" % len(msg_list))
-    text_model = markovify.NewlineText("\n".join(msg_list), retain_original=False)
+    sentence = await executors.run("process", make_sentence, msg_list)
 
-    return "```%s```" % text_model.make_short_sentence(
-        min_chars=50, max_chars=300, tries=10000, DEFAULT_MAX_OVERLAP_RATIO=0.4
-    )
+    return "```%s```" % sentence
@@ -192,7 +192,8 @@ async def poll_create(text, event, storage, async_send_message, server):
     await poll.do_send(event)  # , cache_it=False)
 
     # Sync all polls
-    sync_polls(storage, server)
+    async with storage.batch():
+        sync_polls(storage, server)
 
 @poll_cmd.subcommand(name="list")
 async def poll_list(async_send_message, storage, server):
@@ -235,7 +236,8 @@ async def poll_close(text, storage, async_send_message, server):
 
         if text == poll.get_link():
             poll.is_active = False
-            sync_polls(storage, server)
+            async with storage.batch():
+                sync_polls(storage, server)
             await poll.get_results(async_send_message)
             return
 
@@ -41,24 +41,23 @@ def remind_check_server(server, storage, send_pm):
     if "remind" not in storage:
         return
 
-    # Parse list
-    for elem in storage["remind"]:
-        # Check if expired
-        if elem["deadline"] < time_utils.tnow():
-            # Remove it from list
-            storage["remind"].remove(elem)
-            storage.sync()
-
-            # Get target user
-            target_user = dutils.get_user_by_id(server, elem["author"])
-            if not target_user:
-                print("invalid user")
-                continue
-
-            send_pm(
-                "You set a reminder with the message:\n%s" % elem["message"],
-                target_user,
-            )
+    # Expired reminders
+    expired = storage.index("remind", key="deadline").range(high=time_utils.tnow())
+    for elem in expired:
+        # Remove it from list
+        storage["remind"].remove(elem)
+        storage.sync()
+
+        # Get target user
+        target_user = dutils.get_user_by_id(server, elem["author"])
+        if not target_user:
+            print("invalid user")
+            continue
+
+        send_pm(
+            "You set a reminder with the message:\n%s" % elem["message"],
+            target_user,
+        )
 
 
 @hook.periodic(1)
@@ -46,16 +46,10 @@ selector_revlookup: dict[Type[carousel.Selector], str] = {
 
 selector_managers: dict[str, SelectorManager] = {}
 
-scan_running = False
+# The periodic scheduler never runs a scan while the previous one is still going
 @hook.periodic(60)
 async def scan_selectors(bot):
-    global scan_running
-    if scan_running:
-        #print("scan running, laterz!")
-        return
-
     try:
-        scan_running = True
         print("Scanning permanent selectors")
         for selector in carousel.Selector._permanent_selectors.values():
             await selector.scan_reacts(bot, selector.msg, force_update=False)
@@ -66,8 +60,6 @@ async def scan_selectors(bot):
     except:
         import traceback
         traceback.print_exc()
-    finally:
-        scan_running = False
 
 @hook.command(permissions=Permission.bot_owner)
 async def force_scan_selectors(bot):
@@ -190,7 +182,7 @@ def list_permanent_selectors(text, storage):
 
 
 @hook.command(permissions=Permission.admin)
-def del_permanent_selector(text, storage, event):
+def del_permanent_selector(text, storage, event, bot):
     """
     Remove a permanent selector.
     """
@@ -217,6 +209,7 @@ def del_permanent_selector(text, storage, event):
             break
 
     hook.root.del_msg_react(msg_id)
+    bot.backend.release_msg_from_cache(msg_id)
 
     return "Done"
 
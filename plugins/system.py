@@ -178,6 +178,124 @@ def list_bot_servers(send_message, bot, event):
 
 @hook.command(permissions=Permission.bot_owner)
 def list_storage_cache(bot):
-    from spanky.hook2.storage import _server_cache
+    """
+    Show storage cache usage and the largest cached documents.
+    """
+    from spanky.hook2.storage import _server_cache, _flusher
+
+    stats = _server_cache.stats()
+    flusher = _flusher.stats()
+    msg = (
+        f"{stats['entries']}/{stats['max_entries']} documents, "
+        f"{stats['bytes'] / 1024:.1f}/{stats['max_bytes'] / 1024:.0f} KiB\n"
+        f"hits: {stats['hits']}, misses: {stats['misses']} "
+        f"({stats['hit_rate'] * 100:.1f}% hit rate), evictions: {stats['evictions']}\n"
+        f"dirty: {flusher['dirty']}, flush lag: {flusher['lag']:.2f}s "
+        f"(last {flusher['last_flush_lag']:.2f}s, max {flusher['max_flush_lag']:.2f}s)\n"
+    )
+    for (server_id, hook_id), size in _server_cache.largest():
+        msg += f"{server_id}/{hook_id}: {size / 1024:.1f} KiB\n"
+
+    return "```\n" + msg + "```"
+
+
+@hook.command(permissions=Permission.bot_owner)
+def executor_stats():
+    """
+    Show hooklet execution pool usage.
+    """
+    from spanky.hook2 import executors
+
+    msg = ""
+    for name, st in executors.stats().items():
+        msg += (
+            "%s: workers %d, pending %d, submitted %d, completed %d, failed %d, rejected %d, "
+            "busy %.2fs, waited %.2fs\n"
+            % (
+                name,
+                st["workers"],
+                st["pending"],
+                st["submitted"],
+                st["completed"],
+                st["failed"],
+                st["rejected"],
+                st["busy_time"],
+                st["wait_time"],
+            )
+        )
+    return msg
+
+
+@hook.command(permissions=Permission.bot_owner)
+def hooklet_stats(text):
+    """
+    <count> - Show the hooklets that spent the most time handling actions.
+    """
+    from spanky.hook2 import metrics
 
-    return str(_server_cache)
+    try:
+        count = int(text)
+    except ValueError:
+        count = 10
+
+    top = sorted(
+        metrics.all_metrics(),
+        key=lambda hm: hm.handler.sum + hm.middleware.sum,
+        reverse=True,
+    )[:count]
+
+    msg = ""
+    for hm in top:
+        msg += (
+            "%s: %d calls (%.2f/s), %d errors, handler avg %.1fms p95 <%.1fms, "
+            "middleware avg %.1fms, queue avg %.1fms\n"
+            % (
+                hm.hooklet_id,
+                hm.invocations,
+                hm.rate,
+                hm.errors,
+                hm.handler.mean * 1000,
+                hm.handler.quantile(0.95) * 1000,
+                hm.middleware.mean * 1000,
+                hm.queue_wait.mean * 1000,
+            )
+        )
+    if msg == "":
+        return "No hooklet has run yet."
+    return "```%s```" % msg
+
+
+@hook.command(permissions=Permission.bot_owner)
+def list_periodics(bot):
+    """
+    Show the scheduled periodics and how many ticks they missed or skipped.
+    """
+    msg = ""
+    for row in sorted(bot.periodic_scheduler.stats(), key=lambda r: r["hooklet_id"]):
+        msg += "%s: every %ss, running %s, missed %d, overlaps skipped %d\n" % (
+            row["hooklet_id"],
+            row["interval"],
+            row["running"],
+            row["missed_ticks"],
+            row["overlaps_skipped"],
+        )
+    if msg == "":
+        return "No periodics scheduled."
+    return "```%s```" % msg
+
+
+@hook.command(permissions=Permission.bot_owner)
+def dispatch_stats():
+    """
+    Show dispatch queue depths and how many events were shed or coalesced.
+    """
+    from spanky.hook2 import dispatch
+
+    msg = ""
+    for name, values in dispatch.limiter.stats().items():
+        top = sorted(values.items(), key=lambda item: item[1], reverse=True)[:10]
+        msg += "%s: %s\n" % (
+            name,
+            ", ".join("%s=%d" % (key, count) for key, count in top) or "-",
+        )
+    return "```%s```" % msg
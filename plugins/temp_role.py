@@ -29,7 +29,13 @@ def log_action(storage, ret_val, send_embed, title):
             log_text += "**%s:** %s\n" % (k, v)
 
         # Send it as embed
-        send_embed(title, "", {"Details": log_text}, target=storage["modlog_chan"])
+        send_embed(
+            title,
+            "",
+            {"Details": log_text},
+            target=storage["modlog_chan"],
+            priority="moderation",
+        )
 
 
 def register_cmd(cmd, server):
@@ -333,7 +339,8 @@ def give_toggled_role(text, server, command_name, storage, event):
                     storage["cmds"][command_name]["role_name"],
                     reason,
                     event.author.name,
-                )
+                ),
+                priority="moderation",
             )
 
             return "Given role"
@@ -345,7 +352,8 @@ def give_toggled_role(text, server, command_name, storage, event):
                     storage["cmds"][command_name]["role_name"],
                     reason,
                     event.author.name,
-                )
+                ),
+                priority="moderation",
             )
             return "Removed the role"
 
@@ -417,33 +425,34 @@ def give_temp_role(text, server, command_name, storage, event):
 
     # Check if it's extra time
     if not extra:
-        # Create a new user entry
-        reason_entry = create_user_reason(
-            storage,
-            user,
-            event.author,
-            reason,
-            "https://discordapp.com/channels/%s/%s/%s"
-            % (server.id, event.channel.id, event.msg.id),
-            texp,
-            command_name,
-        )
+        # All the entries or none of them
+        with storage.transaction():
+            # Create a new user entry
+            reason_entry = create_user_reason(
+                storage,
+                user,
+                event.author,
+                reason,
+                "https://discordapp.com/channels/%s/%s/%s"
+                % (server.id, event.channel.id, event.msg.id),
+                texp,
+                command_name,
+            )
 
-        # Create command entry
-        new_entry = {}
-        new_entry["user_id"] = str(user.id)
-        new_entry["user_name"] = user.name
-        new_entry["expire"] = texp
-        new_entry["crt_roles"] = crt_roles
-        new_entry["reason_id"] = reason_entry["Case ID"]
+            # Create command entry
+            new_entry = {}
+            new_entry["user_id"] = str(user.id)
+            new_entry["user_name"] = user.name
+            new_entry["expire"] = texp
+            new_entry["crt_roles"] = crt_roles
+            new_entry["reason_id"] = reason_entry["Case ID"]
 
-        storage["temp_roles"][command_name].append(new_entry)
+            storage["temp_roles"][command_name].append(new_entry)
+            storage.sync()
 
         # Replace user roles
         user.replace_roles([role])
 
-        storage.sync()
-
         user.send_pm(
             "You have been given the `%s` role. It will last for %s.\nReason: %s\nAuthor: %s"
             % (
@@ -451,7 +460,8 @@ def give_temp_role(text, server, command_name, storage, event):
                 text[1],
                 reason,
                 event.author.name,
-            )
+            ),
+            priority="moderation",
         )
 
         return reason_entry
@@ -581,7 +591,9 @@ def kick(
     if reason:
         details += "\nReason: %s" % reason
     send_pm(
-        text="You have been kicked from %s.\n%s" % (server.name, details), user=user
+        text="You have been kicked from %s.\n%s" % (server.name, details),
+        user=user,
+        priority="moderation",
     )
 
     user.kick()
@@ -660,12 +672,14 @@ def ban(
             text="You have temporarily banned from %s. The ban will last for %s.\n%s"
             % (server.name, text[1], details),
             user=user,
+            priority="moderation",
         )
     else:
         send_pm(
             text="You have been permanently banned from %s.\n%s"
             % (server.name, details),
             user=user,
+            priority="moderation",
         )
     storage.sync()
 
@@ -678,7 +692,7 @@ def check_expired_roles(server, storage):
     # Go through each command
     for cmd_name, cmd_list in storage["temp_roles"].items():
         # Go through each element in the command
-        for cmd_element in cmd_list:
+        for cmd_element in list(cmd_list):
             to_del = []
             # If timeout has expired
             if cmd_element["expire"] < tnow:
@@ -698,8 +712,10 @@ def check_expired_roles(server, storage):
                 if member:
                     member.replace_roles(new_roles)
 
-                storage["temp_roles"][cmd_name].remove(elem)
-                storage.sync()
+                # One entry at a time, a failure doesn't bring back the entries already expired
+                with storage.transaction():
+                    storage["temp_roles"][cmd_name].remove(elem)
+                    storage.sync()
 
 
 async def check_expired_bans(server, storage):
@@ -893,20 +909,22 @@ def assign_temp_role(rstorage, server, bot, role, text, command_name, str_to_id,
             break
 
     if not extra:
-        reason_entry = add_reason(
-            rstorage, event, member, reason, server, texp, brole.name
-        )
+        # All the entries or none of them
+        with rstorage.transaction():
+            reason_entry = add_reason(
+                rstorage, event, member, reason, server, texp, brole.name
+            )
 
-        new_entry = {}
-        new_entry["user"] = user
-        new_entry["expire"] = texp
-        new_entry["crt_roles"] = crt_roles
-        new_entry["reason_id"] = reason_entry["Case ID"]
+            new_entry = {}
+            new_entry["user"] = user
+            new_entry["expire"] = texp
+            new_entry["crt_roles"] = crt_roles
+            new_entry["reason_id"] = reason_entry["Case ID"]
 
-        rstorage[command_name].append(new_entry)
-        member.replace_roles([brole])
+            rstorage[command_name].append(new_entry)
+            rstorage.sync()
 
-        rstorage.sync()
+        member.replace_roles([brole])
         return (
             "Gave <@%s> %s seconds %s time" % (user, str(total_seconds), command_name),
             reason_entry,
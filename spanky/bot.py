@@ -4,11 +4,18 @@ import importlib
 import time
 import asyncio
 import sys
+from collections import Counter
 
 from spanky.database.db import db_data
 from spanky.hook2 import hook2
+from spanky.hook2 import executors
+from spanky.hook2 import metrics
+from spanky.hook2 import dispatch
+from spanky.hook2 import storage
+from spanky.hook2 import snapshots
 from spanky.hook2.event import EventType
 from spanky.hook2.hook_manager import HookManager
+from spanky.hook2.scheduler import PeriodicScheduler
 from spanky.hook2.actions import (
     Action,
     ActionCommand,
@@ -18,7 +25,7 @@ from spanky.hook2.actions import (
 
 from .streamwrap import StreamWrap
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 if TYPE_CHECKING:
     from spanky.inputs.nextcord import Init
@@ -34,6 +41,75 @@ fh = logging.FileHandler("audit.log")
 fh.setLevel(logging.DEBUG)
 audit.addHandler(fh)
 
+
+class EventCoalescer:
+    """
+    Merges bursts of updates to the same entity (e.g. a member getting several roles at once) into one event.
+    The first update for an entity opens a window, updates arriving inside it only replace the "after" state,
+    and when the window closes a single event is dispatched with the first "before" and the last "after" state.
+    Windows are set per event type in the optional "coalesce" section of bot_config.json, in seconds, e.g.
+    "coalesce": {"member_update": 0.5, "message_edit": 1}
+    Event types without a window are dispatched right away.
+    """
+
+    def __init__(self, config: Optional[dict] = None):
+        self.windows: dict[EventType, float] = {}
+        for name, window in (config or {}).items():
+            if name not in EventType.__members__:
+                logger.error(
+                    f"Unknown event type {name} in the coalesce config, ignoring it"
+                )
+                continue
+            if window > 0:
+                self.windows[EventType[name]] = window
+
+        # (event type, entity key) -> [first before, last after]
+        self._pending: dict[tuple, list] = {}
+        # Dispatches of merged events, kept until they finish
+        self._tasks: set[asyncio.Task] = set()
+        self.merged: Counter[str] = Counter()
+
+    def add(self, event_type: EventType, key, before, after, flush) -> bool:
+        """
+        Queues an update. Returns False if the event type isn't coalesced and the caller should dispatch it.
+        flush(before, after) is awaited when the window closes.
+        """
+        window = self.windows.get(event_type)
+        if window is None:
+            return False
+
+        pending_key = (event_type, key)
+        if pending_key in self._pending:
+            self._pending[pending_key][1] = after
+            self.merged[event_type.name] += 1
+            return True
+
+        self._pending[pending_key] = [before, after]
+        asyncio.get_running_loop().call_later(window, self._flush, pending_key, flush)
+        return True
+
+    def _flush(self, pending_key: tuple, flush):
+        before, after = self._pending.pop(pending_key)
+        task = asyncio.create_task(flush(before, after))
+        self._tasks.add(task)
+        task.add_done_callback(self._flushed)
+
+    def _flushed(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "Dispatching a coalesced event failed", exc_info=task.exception()
+            )
+
+    def _prometheus(self) -> str:
+        lines = ["# TYPE spanky_coalesced_events counter"]
+        for event_type, count in self.merged.items():
+            lines.append(f'spanky_coalesced_events{{event_type="{event_type}"}} {count}')
+        lines.append("# TYPE spanky_coalescing_pending gauge")
+        lines.append(f"spanky_coalescing_pending {len(self._pending)}")
+        return "\n".join(lines) + "\n"
+
+
 class Bot:
     def __init__(self, input_type):
         self.stream_wraps = StreamWrap.wraps
@@ -42,11 +118,22 @@ class Bot:
         self.is_ready = False
         self.loop = asyncio.get_event_loop()
         self.hook2 = hook2.Hook("bot_hook")
+        self.periodic_scheduler = PeriodicScheduler(self, self.hook2)
 
         # Open the bot config file
         with open("bot_config.json") as data_file:
             self.config = json.load(data_file)
 
+        # Size the hooklet execution pools and dispatch queues
+        executors.configure(self.config)
+        dispatch.configure(self.config)
+        storage.configure(self.config)
+        snapshots.configure(self.config)
+
+        # Merge bursts of same-entity update events
+        self.coalescer = EventCoalescer(self.config.get("coalesce", {}))
+        metrics.add_collector(self.coalescer._prometheus)
+
         db_path = self.config.get("database", "sqlite:///cloudbot.db")
         self.logger = logger
 
@@ -74,6 +161,14 @@ class Bot:
     async def start(self):
         # Initialize the backend module
         self.backend: "Init" = self.input.Init(self)
+
+        # Optional Prometheus endpoint for hooklet metrics
+        if "metrics_port" in self.config:
+            await metrics.start_exporter(
+                self.config["metrics_port"],
+                self.config.get("metrics_host", "127.0.0.1"),
+            )
+
         await self.hook_manager.load()
         await self.backend.do_init()
 
@@ -110,6 +205,7 @@ class Bot:
         await self.run_on_ready_work()
 
         self.is_ready = True
+        self.periodic_scheduler.start()
 
     def get_servers(self):
         return self.backend.get_servers()
@@ -136,7 +232,7 @@ class Bot:
         pass
 
     async def on_server_leave(self, server):
-        pass
+        storage.invalidate_server_cache(str(server.id))
 
     # ----------------
     # Message events
@@ -158,6 +254,14 @@ class Bot:
 
     async def on_message_edit(self, before, after):
         """On message edit external hook"""
+        if self.coalescer.add(
+            EventType.message_edit, after.id, before, after, self.do_message_edit
+        ):
+            return
+
+        await self.do_message_edit(before, after)
+
+    async def do_message_edit(self, before, after):
         evt = self.input.EventMessage(EventType.message_edit, after, before)
 
         await self.do_text_event(evt)
@@ -172,6 +276,18 @@ class Bot:
     # Member events
     # ----------------
     async def on_member_update(self, before, after):
+        if self.coalescer.add(
+            EventType.member_update,
+            (after.guild.id, after.id),
+            before,
+            after,
+            self.do_member_update,
+        ):
+            return
+
+        await self.do_member_update(before, after)
+
+    async def do_member_update(self, before, after):
         evt = self.input.EventMember(
             EventType.member_update, member=before, member_after=after
         )
@@ -296,16 +412,3 @@ class Bot:
                     event.text,
                 )
             )
-
-    async def on_periodic(self):
-        if not self.is_ready:
-            return
-        tasks = []
-
-        for hooklet in self.hook2.all_periodics.values():
-            if time.time() - hooklet.last_time > hooklet.interval:
-                hooklet.last_time = time.time()
-                action = ActionPeriodic(self, hooklet.hooklet_id)
-                tasks.append(asyncio.create_task(self.dispatch_action(action)))
-
-        await asyncio.gather(*tasks)
@@ -1,7 +1,7 @@
 import os
 from PIL import Image
 from PIL import ImageFont
-import json
+from spanky.utils import codec
 
 base_dir = "resources/"
 
@@ -16,8 +16,7 @@ def get_path(category: str, name: str) -> str:
 
 def load_json(name: str, category: str = "data") -> dict[str, any]:
     name = name.removesuffix(".json")
-    with open(get_path(category, name + ".json"), "r") as f:
-        return json.load(f)
+    return codec.load_file(get_path(category, name + ".json"))
 
 
 def font(name: str = "default", size: int = 10) -> ImageFont.ImageFont:
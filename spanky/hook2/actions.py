@@ -56,9 +56,11 @@ class ActionCommand(Action):
 
 
 class ActionPeriodic(Action):
-    def __init__(self, bot, target):
+    def __init__(self, bot, target, hooklet=None):
         super().__init__(EventType.periodic, bot, EventPeriodic())
         self.target = target
+        # The Periodic being run, when the sender already knows it (saves looking it up in the tree)
+        self.hooklet = hooklet
 
 
 class ActionEvent(Action):
@@ -0,0 +1,221 @@
+# Admission control for Hook.dispatch_action.
+# Every gateway event or command holds a slot in its server's dispatch queue until all its hooklets finish,
+# and every hooklet run holds a slot in its hook's queue. When a queue is full, new work is shed instead of
+# piling up tasks:
+# - low priority events (message_edit, member_update by default) are dropped once a server queue is half full;
+# - low priority events for an entity that is already being dispatched are coalesced: the ones waiting are
+#   merged into one, with the first "before" and the last "after" state, and dispatched once the current one
+#   finishes. Event types the bot already merges in time windows (see EventCoalescer in spanky/bot.py) aren't
+#   coalesced a second time here;
+# - anything else is dropped once the server or hook queue is full.
+# Limits come from the optional "dispatch" section of bot_config.json.
+from __future__ import annotations
+
+from collections import Counter
+from typing import TYPE_CHECKING, Optional
+
+from .event import EventType
+from spanky.hook2 import metrics
+
+if TYPE_CHECKING:
+    from .actions import Action
+
+
+# Bot events (on_start, periodic, ...) are never shed
+def _sheddable(action: Action) -> bool:
+    return action.event_type.value < 100 or action.event_type is EventType.command
+
+
+def _entity_key(action: Action) -> Optional[tuple]:
+    """
+    Returns what a low priority event is about (a message or a member), so duplicates can be coalesced.
+    """
+    raw = action._raw
+    for attr in ("member", "msg"):
+        entity = getattr(raw, attr, None)
+        if entity is not None and getattr(entity, "id", None) is not None:
+            return (action.event_type, action.server_id, attr, entity.id)
+    return None
+
+
+# Attributes of a coalesced event's raw event that hold its "before" state (EventMember.member is the member
+# before the update)
+_BEFORE_ATTRS = {
+    EventType.member_update: ("before", "member"),
+    EventType.message_edit: ("before",),
+}
+
+
+def _merge(earlier: Action, later: Action) -> Action:
+    """
+    Merges two events about the same entity: the result goes from the earlier's "before" state to the later's
+    "after" state, so that hooklets comparing them see every change.
+    """
+    for attr in _BEFORE_ATTRS.get(later.event_type, ()):
+        before = getattr(earlier._raw, attr, None)
+        if before is not None:
+            setattr(later._raw, attr, before)
+    return later
+
+
+LOW_PRIORITY = ("message_edit", "member_update")
+
+
+class DispatchLimiter:
+    def __init__(
+        self,
+        server_limit: int = 500,
+        hook_limit: int = 200,
+        low_priority: tuple[str, ...] = LOW_PRIORITY,
+        low_priority_ratio: float = 0.5,
+        coalesce: Optional[tuple[str, ...]] = None,
+    ):
+        self.server_limit: int = server_limit
+        self.hook_limit: int = hook_limit
+        self.low_priority: set[EventType] = {EventType[name] for name in low_priority}
+        self.low_priority_limit: int = int(server_limit * low_priority_ratio)
+        # Low priority event types coalesced while in flight, all of them by default
+        self.coalesce: set[EventType] = (
+            set(self.low_priority)
+            if coalesce is None
+            else {EventType[name] for name in coalesce}
+        )
+
+        # Queue depths
+        self.server_depth: Counter[str] = Counter()
+        self.hook_depth: Counter[str] = Counter()
+
+        # Low priority entity key -> newest action waiting for the in-flight one to finish (None if nothing waits)
+        self._coalescing: dict[tuple, Optional[Action]] = {}
+
+        # Shedding counters
+        self.dropped_low_priority: Counter[str] = Counter()
+        self.dropped_server: Counter[str] = Counter()
+        self.dropped_hook: Counter[str] = Counter()
+        self.coalesced: Counter[str] = Counter()
+
+    def admit(self, action: Action) -> bool:
+        """
+        Takes a server queue slot for the action. Returns False if the action was shed or coalesced.
+        """
+        if not _sheddable(action):
+            return True
+
+        server = action.server_id or "pm"
+        depth = self.server_depth[server]
+        low_priority = action.event_type in self.low_priority
+
+        if low_priority:
+            key = _entity_key(action) if action.event_type in self.coalesce else None
+            if key is not None:
+                if key in self._coalescing:
+                    # Merged into the one waiting, dispatched when the current one is done
+                    waiting = self._coalescing[key]
+                    if waiting is not None:
+                        action = _merge(waiting, action)
+                    self._coalescing[key] = action
+                    self.coalesced[action.event_type.name] += 1
+                    return False
+            if depth >= self.low_priority_limit:
+                self.dropped_low_priority[action.event_type.name] += 1
+                return False
+            if key is not None:
+                self._coalescing[key] = None
+        elif depth >= self.server_limit:
+            self.dropped_server[server] += 1
+            return False
+
+        self.server_depth[server] += 1
+        return True
+
+    def release(self, action: Action) -> Optional[Action]:
+        """
+        Frees the action's server queue slot. Returns a coalesced action that should be dispatched next, if any.
+        """
+        if not _sheddable(action):
+            return None
+
+        server = action.server_id or "pm"
+        self.server_depth[server] -= 1
+        if self.server_depth[server] <= 0:
+            del self.server_depth[server]
+
+        if action.event_type in self.coalesce:
+            key = _entity_key(action)
+            if key is not None:
+                return self._coalescing.pop(key, None)
+        return None
+
+    def admit_hook(self, hook_id: str, action: Action) -> bool:
+        if not _sheddable(action):
+            return True
+        if self.hook_depth[hook_id] >= self.hook_limit:
+            self.dropped_hook[hook_id] += 1
+            return False
+        self.hook_depth[hook_id] += 1
+        return True
+
+    def release_hook(self, hook_id: str, action: Action):
+        if not _sheddable(action):
+            return
+        self.hook_depth[hook_id] -= 1
+        if self.hook_depth[hook_id] <= 0:
+            del self.hook_depth[hook_id]
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            "server_depth": dict(self.server_depth),
+            "hook_depth": dict(self.hook_depth),
+            "dropped_low_priority": dict(self.dropped_low_priority),
+            "dropped_server": dict(self.dropped_server),
+            "dropped_hook": dict(self.dropped_hook),
+            "coalesced": dict(self.coalesced),
+        }
+
+
+limiter = DispatchLimiter()
+
+
+def configure(config: Optional[dict] = None):
+    """
+    Reads the optional "dispatch" section of bot_config.json, e.g.
+    "dispatch": {"server_limit": 500, "hook_limit": 200, "low_priority": ["message_edit", "member_update"], "low_priority_ratio": 0.5}
+    Low priority types that have a window in the "coalesce" section aren't coalesced again by the limiter.
+    """
+    global limiter
+    config = config or {}
+
+    cfg = dict(config.get("dispatch", {}))
+    # The event types with a window in the "coalesce" section are already merged before they're dispatched
+    windowed = {
+        name for name, window in config.get("coalesce", {}).items() if window > 0
+    }
+    cfg.setdefault(
+        "coalesce",
+        tuple(
+            name
+            for name in cfg.get("low_priority", LOW_PRIORITY)
+            if name not in windowed
+        ),
+    )
+    limiter = DispatchLimiter(**cfg)
+
+
+def _prometheus() -> str:
+    lines = []
+    for key, label, kind in (
+        ("server_depth", "server", "gauge"),
+        ("hook_depth", "hook", "gauge"),
+        ("dropped_low_priority", "event_type", "counter"),
+        ("dropped_server", "server", "counter"),
+        ("dropped_hook", "hook", "counter"),
+        ("coalesced", "event_type", "counter"),
+    ):
+        name = f"spanky_dispatch_{key}"
+        lines.append(f"# TYPE {name} {kind}")
+        for value, count in getattr(limiter, key).items():
+            lines.append(f'{name}{{{label}="{value}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+metrics.add_collector(_prometheus)
@@ -0,0 +1,313 @@
+# Execution classes for sync hooklets.
+# Every sync hooklet runs in one of these:
+# - inline: directly on the event loop, for functions that finish in well under a millisecond
+# - thread: a bounded thread pool, for functions that block on I/O
+# - process: a process pool, for CPU heavy functions. The function and its arguments must be picklable,
+#   otherwise the call falls back to the thread pool.
+# Hooklets declare their class with `executor=...` (e.g. `@hook.command(executor="process")`), hooklets that
+# don't declare one run in the thread pool.
+# `executor="auto"` is an opt-in for functions known not to block: they start in the thread pool and are moved
+# inline if they turn out to be fast. A function that was fast while warm but blocks on I/O once in a while
+# would block the event loop, so this is never done on its own.
+from __future__ import annotations
+
+import asyncio
+import enum
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from spanky.hook2 import metrics
+
+
+class ExecClass(enum.Enum):
+    AUTO = "auto"
+    INLINE = "inline"
+    THREAD = "thread"
+    PROCESS = "process"
+
+
+class PoolOverloaded(Exception):
+    pass
+
+
+# Learning thresholds for hooklets without a declared class
+LEARN_SAMPLES = 20
+INLINE_MAX_SECONDS = 0.001
+INLINE_DEMOTE_SECONDS = 0.005
+
+
+def _timed_call(func, args):
+    """
+    Runs in the worker. Returns when the call started, how long it took and the result.
+    time.time() is used for the start so it is comparable across processes.
+    """
+    started = time.time()
+    t0 = time.perf_counter()
+    result = func(*args)
+    return started, time.perf_counter() - t0, result
+
+
+class ExecPool:
+    def __init__(
+        self,
+        exec_class: ExecClass,
+        max_workers: int,
+        queue_limit: int,
+        make_executor: Optional[Callable[[int], Executor]] = None,
+    ):
+        self.exec_class: ExecClass = exec_class
+        self.max_workers: int = max_workers
+        # How many calls can wait for a free worker before new ones are rejected
+        self.queue_limit: int = queue_limit
+        self._make_executor = make_executor
+        self._executor: Optional[Executor] = None
+        # The counters are updated from the event loop and from worker threads (see submit())
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.pending: int = 0
+        self.submitted: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.rejected: int = 0
+        self.busy_time: float = 0.0
+        self.wait_time: float = 0.0
+
+    @property
+    def executor(self) -> Optional[Executor]:
+        # Created on first use, so an unused process pool never forks
+        if self._executor is None and self._make_executor:
+            self._executor = self._make_executor(self.max_workers)
+        return self._executor
+
+    def _admit(self):
+        with self._lock:
+            if self.pending >= self.max_workers + self.queue_limit:
+                self.rejected += 1
+                raise PoolOverloaded(
+                    f"{self.exec_class.value} pool is full ({self.pending} pending)"
+                )
+            self.pending += 1
+            self.submitted += 1
+
+    def _release(self, failed: bool):
+        with self._lock:
+            self.pending -= 1
+            if failed:
+                self.failed += 1
+
+    def _account(self, submitted_at: float, started: float, elapsed: float):
+        with self._lock:
+            self.completed += 1
+            self.busy_time += elapsed
+            self.wait_time += max(0.0, started - submitted_at)
+
+    async def run(self, func, args) -> tuple[float, float, Any]:
+        """
+        Runs func(*args) in this pool.
+        Returns the time spent waiting for a worker, the time spent running and the result.
+        """
+        self._admit()
+        submitted_at = time.time()
+        try:
+            if self.executor is None:
+                started, elapsed, result = _timed_call(func, args)
+            else:
+                loop = asyncio.get_running_loop()
+                started, elapsed, result = await loop.run_in_executor(
+                    self.executor, _timed_call, func, args
+                )
+        except:
+            self._release(failed=True)
+            raise
+        self._release(failed=False)
+
+        self._account(submitted_at, started, elapsed)
+        return max(0.0, started - submitted_at), elapsed, result
+
+    def submit(self, func, *args) -> Future:
+        """
+        Blocking-world counterpart of run(), usable from worker threads (e.g. a thread hooklet offloading CPU work).
+        """
+        self._admit()
+        submitted_at = time.time()
+
+        if self.executor is None:
+            fut = Future()
+            try:
+                fut.set_result(_timed_call(func, args))
+            except Exception as e:
+                fut.set_exception(e)
+        else:
+            fut = self.executor.submit(_timed_call, func, args)
+
+        result_fut = Future()
+
+        def done(f: Future):
+            # Runs on the worker thread
+            self._release(failed=f.exception() is not None)
+            if f.exception() is not None:
+                result_fut.set_exception(f.exception())
+                return
+            started, elapsed, result = f.result()
+            self._account(submitted_at, started, elapsed)
+            result_fut.set_result(result)
+
+        fut.add_done_callback(done)
+        return result_fut
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "queue_limit": self.queue_limit,
+            "pending": self.pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "busy_time": self.busy_time,
+            "wait_time": self.wait_time,
+        }
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+pools: dict[ExecClass, ExecPool] = {}
+
+
+def _process_context():
+    # Forking the bot would copy its threads' locks in whatever state they are in, the workers start clean
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def configure(config: dict = {}):
+    """
+    (Re)creates the pools. Reads the optional "executors" section of bot_config.json, e.g.
+    "executors": {"thread": {"workers": 100, "queue_limit": 1000}, "process": {"workers": 4, "queue_limit": 50}}
+    """
+    for pool in pools.values():
+        pool.shutdown()
+
+    cfg = config.get("executors", {})
+    thread_cfg = cfg.get("thread", {})
+    process_cfg = cfg.get("process", {})
+
+    pools[ExecClass.INLINE] = ExecPool(ExecClass.INLINE, 1, 0)
+    pools[ExecClass.THREAD] = ExecPool(
+        ExecClass.THREAD,
+        thread_cfg.get("workers", 100),
+        thread_cfg.get("queue_limit", 1000),
+        lambda workers: ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="hooklet"
+        ),
+    )
+    pools[ExecClass.PROCESS] = ExecPool(
+        ExecClass.PROCESS,
+        process_cfg.get("workers", os.cpu_count() or 1),
+        process_cfg.get("queue_limit", 50),
+        lambda workers: ProcessPoolExecutor(
+            max_workers=workers, mp_context=_process_context()
+        ),
+    )
+
+
+configure()
+
+
+def stats() -> dict[str, dict[str, Any]]:
+    return {exec_class.value: pool.stats() for exec_class, pool in pools.items()}
+
+
+def _prometheus() -> str:
+    lines = []
+    for key in ("pending", "submitted", "completed", "failed", "rejected"):
+        name = f"spanky_executor_{key}"
+        lines.append(f"# TYPE {name} {'gauge' if key == 'pending' else 'counter'}")
+        for exec_class, pool in pools.items():
+            lines.append(f'{name}{{pool="{exec_class.value}"}} {getattr(pool, key)}')
+    return "\n".join(lines) + "\n"
+
+
+metrics.add_collector(_prometheus)
+
+
+def submit(exec_class: ExecClass | str, func, *args) -> Future:
+    """
+    Submits func(*args) to a pool from synchronous code and returns a concurrent.futures.Future.
+    """
+    return pools[ExecClass(exec_class)].submit(func, *args)
+
+
+async def run(exec_class: ExecClass | str, func, *args) -> Any:
+    """
+    Runs func(*args) in a pool from a coroutine and returns its result.
+    """
+    _, _, result = await pools[ExecClass(exec_class)].run(func, args)
+    return result
+
+
+def _pickled_call(payload: bytes):
+    # Runs in the worker, see ExecProfile.run()
+    func, args = pickle.loads(payload)
+    return func(*args)
+
+
+class ExecProfile:
+    """
+    Tracks which pool a hooklet runs in. Declared classes are fixed, AUTO ones (opt-in) are learned from
+    observed runtimes.
+    """
+
+    def __init__(self, hooklet_id: str, declared: ExecClass | str = ExecClass.THREAD):
+        self.hooklet_id: str = hooklet_id
+        self.declared: ExecClass = ExecClass(declared)
+        self.learning: bool = self.declared is ExecClass.AUTO
+        self.current: ExecClass = ExecClass.THREAD if self.learning else self.declared
+        self.samples: int = 0
+        self.max_seen: float = 0.0
+
+    def record(self, elapsed: float):
+        if not self.learning:
+            return
+
+        self.max_seen = max(self.max_seen, elapsed)
+        if self.current is ExecClass.THREAD:
+            self.samples += 1
+            if self.samples >= LEARN_SAMPLES:
+                if self.max_seen < INLINE_MAX_SECONDS:
+                    self.current = ExecClass.INLINE
+                else:
+                    # Slow or blocking, stays in the thread pool for good
+                    self.learning = False
+        elif elapsed > INLINE_DEMOTE_SECONDS:
+            print(
+                f"Hooklet {self.hooklet_id} took {elapsed * 1000:.1f}ms inline, moving it back to the thread pool"
+            )
+            self.current = ExecClass.THREAD
+            self.learning = False
+
+    async def run(self, func, args) -> tuple[float, float, Any]:
+        if self.current is ExecClass.PROCESS:
+            # Pickled here rather than by the pool, so a call that can't be sent is known before it's submitted
+            # and the call is only pickled once
+            try:
+                func, args = _pickled_call, (pickle.dumps((func, args)),)
+            except Exception:
+                print(
+                    f"Hooklet {self.hooklet_id} can't be sent to a process (arguments aren't picklable), using the thread pool"
+                )
+                self.current = ExecClass.THREAD
+
+        wait, elapsed, result = await pools[self.current].run(func, args)
+        self.record(elapsed)
+        return wait, elapsed, result
@@ -3,6 +3,7 @@ from __future__ import annotations
 from collections import deque
 
 from spanky.hook2 import storage
+from spanky.hook2 import dispatch
 from spanky.hook2.complex_cmd import ComplexCommand
 from .hooklet import (
     Command,
@@ -14,7 +15,9 @@ from .hooklet import (
     MiddlewareResult,
 )
 import asyncio
+import itertools
 import random
+import time
 from typing import Any, Callable, Optional, TYPE_CHECKING
 from .event import EventType
 from .actions import ActionPeriodic
@@ -25,7 +28,7 @@ if TYPE_CHECKING:
         ActionCommand,
         ActionEvent,
     )
-    from hooklet import Hooklet
+    from .hooklet import Hooklet
 
     MiddlewareFunc = Callable[[Action, Hooklet], Optional[MiddlewareResult]]
 
@@ -40,6 +43,20 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(messag
 ch.setFormatter(formatter)
 logger.addHandler(ch)
 
+# Middleware versions are unique across all trees, so a cached chain can't match a different root by accident
+_md_versions = itertools.count()
+
+# Dispatches of coalesced actions, kept until they finish so they aren't garbage collected
+_coalesced_tasks: set[asyncio.Task] = set()
+
+
+def _coalesced_done(task: asyncio.Task):
+    _coalesced_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(
+            "Dispatching a coalesced action failed", exc_info=task.exception()
+        )
+
 
 class Hook:
     hash = random.randint(0, 2**31)
@@ -66,17 +83,29 @@ class Hook:
         if storage_name != "":
             self.storage_name = storage_name
 
-        # Tree
-        self.parent_hook: Optional[Hook] = parent_hook
-        if self.parent_hook != None and not self.parent_hook.has_child(self):
-            self.parent_hook.add_child(self)
-
-        self.children: list[Hook] = []
+        # Name/alias -> commands index. Only the root of a tree keeps it up to date.
+        self._command_index: dict[str, list[Command]] = {}
+        # EventType -> subscribed Event hooklets. Only used on the root, built lazily.
+        self._event_index: Optional[dict[EventType, list[Event]]] = None
+        # Middleware version (only meaningful on the root) and this hook's compiled chain
+        self._md_version: int = next(_md_versions)
+        self._md_chain: list[Middleware] = []
+        self._md_chain_version: int = -1
+        # Set on the root by the PeriodicScheduler that runs this tree's periodics
+        self._periodic_scheduler = None
+        # Message id -> temporary/permanent reaction handlers. Only the root of a tree keeps it up to date.
+        self._react_index: dict[str, list[MessageReact]] = {}
 
         # Message event handler subcomponent
         self.rolling_handlers: deque[MessageReact] = deque(maxlen=handler_queue_limit)
         self.permanent_handlers: dict[str, MessageReact] = {}
 
+        # Tree
+        self.children: list[Hook] = []
+        self.parent_hook: Optional[Hook] = None
+        if parent_hook != None and not parent_hook.has_child(self):
+            parent_hook.add_child(self)
+
     # def __del__(self):
     #    self.unload()
 
@@ -105,12 +134,54 @@ class Hook:
 
     # add_child adds a new child hook to the tree, directly underneath the current Hook. It throws a TypeError if the child hook is already in the tree
     def add_child(self, child: Hook):
-        if not self.root.has_child(child):
+        root = self.root
+        if not root.has_child(child):
             self.children.append(child)
             child.parent_hook = self
+
+            # The child stops being a root, move its commands to our root index
+            child._command_index = {}
+            root._index_commands(child._subtree_commands())
+            child._react_index = {}
+            root._index_reacts(child._subtree_reacts())
+            child._event_index = None
+            root.invalidate_event_index()
+            root.invalidate_middleware()
+            root.invalidate_periodics()
         else:
             raise TypeError("Hook already in tree.")
 
+    # walk yields the current hook and all its descendants
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def _subtree_commands(self) -> list[Command]:
+        return [cmd for hook in self.walk() for cmd in hook.commands.values()]
+
+    def _index_commands(self, cmds: list[Command]):
+        for cmd in cmds:
+            for key in dict.fromkeys([cmd.name, *cmd.aliases]):
+                self._command_index.setdefault(key, []).append(cmd)
+
+    def _unindex_commands(self, cmds: list[Command]):
+        for cmd in cmds:
+            for key in dict.fromkeys([cmd.name, *cmd.aliases]):
+                indexed = [c for c in self._command_index.get(key, []) if c is not cmd]
+                if indexed:
+                    self._command_index[key] = indexed
+                else:
+                    self._command_index.pop(key, None)
+
+    # is_ancestor_of says if the given hook is the current hook or one of its descendants, by walking up from it
+    def is_ancestor_of(self, hook: Hook) -> bool:
+        while hook:
+            if hook is self:
+                return True
+            hook = hook.parent_hook
+        return False
+
     # TODO FOR ALL OF THESE PROPERTIES: CACHE AND INVALIDATION
 
     @property
@@ -132,12 +203,22 @@ class Hook:
         if cmd == None:
             return False
         self.commands.pop(cmd.name)
+        self.root._unindex_commands([cmd])
         return True
 
+    # find_commands returns all the commands in the subtree matching a name or an alias.
+    # Exact name matches come first.
+    def find_commands(self, name: str) -> list[Command]:
+        root = self.root
+        cmds = root._command_index.get(name, [])
+        if root is not self:
+            cmds = [cmd for cmd in cmds if self.is_ancestor_of(cmd.hook)]
+        return sorted(cmds, key=lambda cmd: cmd.name != name)
+
     def get_command(self, name: str) -> Optional[Command]:
-        for cmd in self.all_commands.values():
-            if cmd.name == name or name in cmd.aliases:
-                return cmd
+        cmds = self.find_commands(name)
+        if cmds:
+            return cmds[0]
         return None
 
     def get_local_command(self, name: str) -> Command:
@@ -146,6 +227,34 @@ class Hook:
                 return cmd
         return None
 
+    # invalidate_event_index drops the root's subscriber lists, they are rebuilt on the next event
+    def invalidate_event_index(self):
+        self.root._event_index = None
+
+    def _build_event_index(self) -> dict[EventType, list[Event]]:
+        index: dict[EventType, list[Event]] = {}
+        for hook in self.walk():
+            for event in hook.events.values():
+                for event_type in event.event_types:
+                    index.setdefault(event_type, []).append(event)
+        return index
+
+    # find_events returns the Event hooklets in the subtree that subscribe to an event type
+    def find_events(self, event_type: EventType) -> list[Event]:
+        root = self.root
+        if root._event_index is None:
+            root._event_index = root._build_event_index()
+        events = root._event_index.get(event_type, [])
+        if root is not self:
+            events = [event for event in events if self.is_ancestor_of(event.hook)]
+        return events
+
+    # invalidate_periodics tells the tree's scheduler (if any) to pick up added or removed periodics
+    def invalidate_periodics(self):
+        scheduler = self.root._periodic_scheduler
+        if scheduler:
+            scheduler.invalidate()
+
     @property
     def all_periodics(self) -> dict[str, Periodic]:
         periodics = self.periodics.copy()
@@ -179,24 +288,43 @@ class Hook:
             )
         )
 
+    # invalidate_middleware bumps the tree's middleware version, so every compiled chain gets rebuilt on next use
+    def invalidate_middleware(self):
+        self.root._md_version = next(_md_versions)
+
+    # middleware_chain is self.all_middleware compiled to a list, cached until the tree's middleware version changes
+    @property
+    def middleware_chain(self) -> list[Middleware]:
+        version = self.root._md_version
+        if self._md_chain_version != version:
+            self._md_chain = list(self.all_middleware.values())
+            self._md_chain_version = version
+        return self._md_chain
+
     async def run_middleware(self, act: ActionCommand, hooklet: Command):
         # copy action to avoid multiple usages
         action = act.copy()
 
-        mds = self.all_middleware
-        # print(mds.keys())
-        for md in mds.values():
-            rez, msg = await md.handle(action, hooklet)
-            if rez == MiddlewareResult.DENY and len(msg) > 1:
-                action.reply(msg, timeout=15)
-                return
-        # Run middleware for the subcommand
-        if isinstance(hooklet, ComplexCommand):
-            cmd, action = hooklet.get_cmd(action)
+        # The same chain is used for every level of a ComplexCommand
+        mds = self.middleware_chain
+        while True:
+            t0 = time.perf_counter()
+            for md in mds:
+                rez, msg = await md.handle(action, hooklet)
+                if rez == MiddlewareResult.DENY and len(msg) > 1:
+                    hooklet.metrics.middleware.observe(time.perf_counter() - t0)
+                    action.reply(msg, timeout=15)
+                    return
+            hooklet.metrics.middleware.observe(time.perf_counter() - t0)
 
-            await self.run_middleware(action, cmd)
-        else:
-            await hooklet.handle(action)
+            if not isinstance(hooklet, ComplexCommand):
+                break
+
+            # Run middleware for the subcommand
+            hooklet, action = hooklet.get_cmd(action)
+            action = action.copy()
+
+        await hooklet.handle(action)
 
     # has_child walks down the tree and says if the node has the specified hook as a descendant
     def has_child(self, hook: Hook) -> bool:
@@ -221,9 +349,28 @@ class Hook:
     # remove_child removes a child hook if it is directly underneath the current node.
     def remove_child(self, hook_id: str):
         try:
+            removed = [child for child in self.children if child.hook_id == hook_id]
             self.children = [
                 child for child in self.children if child.hook_id != hook_id
             ]
+
+            root = self.root
+            for child in removed:
+                child.parent_hook = None
+                # The removed subtree becomes its own tree with its own index
+                cmds = child._subtree_commands()
+                root._unindex_commands(cmds)
+                child._command_index = {}
+                child._index_commands(cmds)
+                reacts = child._subtree_reacts()
+                root._unindex_reacts(reacts)
+                child._react_index = {}
+                child._index_reacts(reacts)
+                child._event_index = None
+                child.invalidate_middleware()
+            root.invalidate_event_index()
+            root.invalidate_middleware()
+            root.invalidate_periodics()
         except Exception as e:
             print(e)
             pass
@@ -234,33 +381,60 @@ class Hook:
         # if self.hook_id == "bot_hook" and not isinstance(action, ActionPeriodic):
         #    print(self.hook_id, action)
 
+        # Take a slot in the server's dispatch queue, or get shed/coalesced
+        limiter = dispatch.limiter
+        if not limiter.admit(action):
+            return
+
+        try:
+            await self._dispatch(action, limiter)
+        finally:
+            coalesced = limiter.release(action)
+            if coalesced:
+                task = asyncio.create_task(self.dispatch_action(coalesced))
+                _coalesced_tasks.add(task)
+                task.add_done_callback(_coalesced_done)
+
+    async def _dispatch(self, action: Action, limiter: dispatch.DispatchLimiter):
         tasks = []
 
+        # spawn runs a hooklet coroutine if its hook's dispatch queue has room
+        def spawn(hooklet: Hooklet, make_coro, *args):
+            hook_id = hooklet.hook.hook_id
+            if not limiter.admit_hook(hook_id, action):
+                return
+
+            async def run():
+                try:
+                    await make_coro(*args)
+                finally:
+                    limiter.release_hook(hook_id, action)
+
+            tasks.append(asyncio.create_task(run()))
+
         if action.event_type is EventType.command:
-            # Command trigger
+            # Command trigger, resolved through the command index instead of asking every hook
             action: ActionCommand = action
-            hooklet = self.get_local_command(action.triggered_command)
-            if hooklet:
+            for hooklet in self.find_commands(action.triggered_command):
                 # Do with middleware
-                tasks.append(
-                    asyncio.create_task(self.run_middleware(action, hooklet), name="")
-                )
+                spawn(hooklet, hooklet.hook.run_middleware, action, hooklet)
+
         elif action.event_type is EventType.periodic:
             # Periodic trigger
             action: ActionPeriodic = action
-            for periodic in self.periodics.values():
-                if periodic.hooklet_id == action.target:
-                    tasks.append(asyncio.create_task(periodic.handle(action)))
+            if action.hooklet is not None:
+                if self.is_ancestor_of(action.hooklet.hook):
+                    spawn(action.hooklet, action.hooklet.handle, action)
+            else:
+                for hook in self.walk():
+                    for periodic in hook.periodics.values():
+                        if periodic.hooklet_id == action.target:
+                            spawn(periodic, periodic.handle, action)
         elif action.event_type is EventType.reaction_add and action.msg != None:
             action: ActionEvent = action
 
-            if action.msg.id in self.permanent_handlers.keys():
-                tasks.append(asyncio.create_task(
-                    self.permanent_handlers[action.msg.id].handle(action)))
-
-            for handler in self.rolling_handlers:
-                if handler.msg_id == action.msg.id:
-                    tasks.append(asyncio.create_task(handler.handle(action)))
+            for handler in self.find_msg_reacts(action.msg.id):
+                spawn(handler, handler.handle, action)
 
         # Gobble all matching event coroutines
         # If it's a message in a PM, don't register the event (compatibility with hook1)
@@ -269,13 +443,8 @@ class Hook:
             and action.event_type
             in [EventType.message, EventType.message_del, EventType.message_edit]
         ):
-            for event_hooklet in self.events.values():
-                if action.event_type in event_hooklet.event_types:
-                    tasks.append(asyncio.create_task(event_hooklet.handle(action)))
-
-        # Gobble children dispatch coroutines
-        for child in self.children:
-            tasks.append(asyncio.create_task(child.dispatch_action(action)))
+            for event_hooklet in self.find_events(action.event_type):
+                spawn(event_hooklet, event_hooklet.handle, action)
 
         # We use return_exceptions so that this function can't throw
         await asyncio.gather(*tasks, return_exceptions=False)
@@ -283,13 +452,19 @@ class Hook:
     # Normal hooks
 
     def add_command(self, cmd: Command):
+        root = self.root
+        if cmd.name in self.commands:
+            root._unindex_commands([self.commands[cmd.name]])
         self.commands[cmd.name] = cmd
+        root._index_commands([cmd])
 
-    def add_periodic(self, func, periodic: float):
-        self.periodics[func.__name__] = Periodic(self, func, periodic)
+    def add_periodic(self, func, periodic: float, **kwargs):
+        self.periodics[func.__name__] = Periodic(self, func, periodic, **kwargs)
+        self.invalidate_periodics()
 
     def add_event(self, func, event_type: EventType | list[EventType]):
         self.events[func.__name__] = Event(self, event_type, func)
+        self.invalidate_event_index()
 
     def add_middleware(
         self, func: MiddlewareFunc, priority: int, m_type: MiddlewareType
@@ -298,60 +473,97 @@ class Hook:
             self.local_md[func.__name__] = Middleware(self, func, m_type, priority)
         else:
             self.global_md[func.__name__] = Middleware(self, func, m_type, priority)
+        self.invalidate_middleware()
+
+    def _subtree_reacts(self) -> list[MessageReact]:
+        return [
+            handler
+            for hook in self.walk()
+            for handler in [*hook.permanent_handlers.values(), *hook.rolling_handlers]
+        ]
+
+    def _index_reacts(self, handlers: list[MessageReact]):
+        for handler in handlers:
+            self._react_index.setdefault(handler.msg_id, []).append(handler)
+
+    def _unindex_reacts(self, handlers: list[MessageReact]):
+        for handler in handlers:
+            indexed = [
+                h for h in self._react_index.get(handler.msg_id, []) if h is not handler
+            ]
+            if indexed:
+                self._react_index[handler.msg_id] = indexed
+            else:
+                self._react_index.pop(handler.msg_id, None)
+
+    # find_msg_reacts returns all the reaction handlers in the subtree registered for a message
+    def find_msg_reacts(self, msg_id: str) -> list[MessageReact]:
+        root = self.root
+        handlers = root._react_index.get(msg_id, [])
+        if root is not self:
+            handlers = [h for h in handlers if self.is_ancestor_of(h.hook)]
+        return handlers
 
     def add_temporary_msg_react(self, msg_id: str, func):
         print(f"make {msg_id} temp")
-        if msg_id in self.rolling_handlers:  # Delete duplicate message handler
-            self.rolling_handlers.remove(msg_id)
-        self.rolling_handlers.append(MessageReact(self, msg_id, func))
+        self.del_temporary_msg_react(msg_id)  # Delete duplicate message handler
+        if len(self.rolling_handlers) == self.rolling_handlers.maxlen:
+            # The oldest handler is about to be pushed out of the queue
+            self.root._unindex_reacts([self.rolling_handlers[0]])
+        handler = MessageReact(self, msg_id, func)
+        self.rolling_handlers.append(handler)
+        self.root._index_reacts([handler])
 
     def del_temporary_msg_react(self, msg_id: str):
-        if msg_id in self.rolling_handlers:
-            self.rolling_handlers.remove(msg_id)
+        for handler in self.rolling_handlers:
+            if handler.msg_id == msg_id:
+                self.rolling_handlers.remove(handler)
+                self.root._unindex_reacts([handler])
+                return
 
     def add_permanent_msg_react(self, msg_id: str, func):
         # temporary handlers might be "upgraded" to permanent ones
         # keep track of that to avoid duplication
-        # TODO: test
         print(f"make {msg_id} perm")
         self.del_temporary_msg_react(msg_id)
-        self.permanent_handlers[msg_id] = MessageReact(self, msg_id, func)
+        self.del_permanent_msg_react(msg_id)
+        handler = MessageReact(self, msg_id, func)
+        self.permanent_handlers[msg_id] = handler
+        self.root._index_reacts([handler])
 
     def del_permanent_msg_react(self, msg_id: str):
         if msg_id in self.permanent_handlers:
-            del self.permanent_handlers[msg_id]
+            self.root._unindex_reacts([self.permanent_handlers.pop(msg_id)])
 
+    # del_msg_react removes all the handlers for a message in the subtree
     def del_msg_react(self, msg_id: str):
-        self.del_temporary_msg_react(msg_id)
-        self.del_permanent_msg_react(msg_id)
-        for child in self.children:
-            child.del_msg_react(msg_id)
+        for handler in self.find_msg_reacts(msg_id):
+            handler.hook.del_temporary_msg_react(msg_id)
+            handler.hook.del_permanent_msg_react(msg_id)
 
     @property
     def temporary_msg_react_handlers(self) -> list[MessageReact]:
-        rez = self.rolling_handlers.copy()
-        for child in self.children:
-            rez.extend(child.temporary_msg_react_handlers)
-        return rez
+        return [
+            handler for hook in self.walk() for handler in hook.rolling_handlers
+        ]
 
     def find_temporary_msg_react(self, msg_id: str) -> Optional[MessageReact]:
-        # TODO: Test
-        handlers = self.temporary_msg_react_handlers
-        if msg_id in handlers:
-            return handlers[handlers.index(msg_id)]
+        for handler in self.find_msg_reacts(msg_id):
+            if handler.hook.permanent_handlers.get(msg_id) is not handler:
+                return handler
 
     @property
     def permanent_msg_react_handlers(self) -> list[MessageReact]:
-        rez = self.permanent_handlers.copy()
-        for child in self.children:
-            rez.extend(child.permanent_msg_react_handlers)
-        return rez
+        return [
+            handler
+            for hook in self.walk()
+            for handler in hook.permanent_handlers.values()
+        ]
 
     def find_permanent_msg_react(self, msg_id: str) -> Optional[MessageReact]:
-        # TODO: Test
-        handlers = self.permanent_msg_react_handlers
-        if msg_id in handlers:
-            return handlers[handlers.index(msg_id)]
+        for handler in self.find_msg_reacts(msg_id):
+            if handler.hook.permanent_handlers.get(msg_id) is handler:
+                return handler
 
     # Server Storage
     def server_storage(self, server_id: Optional[str]):
@@ -384,14 +596,14 @@ class Hook:
 
         return wrap
 
-    def periodic(self, period: float):
+    def periodic(self, period: float, **kwargs):
         if callable(period):
             raise TypeError(
                 "Hook.periodic must be used as a function that returns a decorator."
             )
 
         def wrap(func):
-            self.add_periodic(func, period)
+            self.add_periodic(func, period, **kwargs)
             return func
 
         return wrap
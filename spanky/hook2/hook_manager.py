@@ -12,6 +12,7 @@ from .hook2 import Hook
 from .actions import ActionEvent
 from .event import EventType
 from .hooklet import Hooklet
+from spanky.hook2 import storage
 from types import ModuleType
 from typing import TYPE_CHECKING
 
@@ -40,6 +41,7 @@ class HookManager:
         for d in self.directories.values():
             tasks.append(asyncio.create_task(d.load(), name="hook_mgr"))
         await asyncio.gather(*tasks)
+        self.hook.invalidate_event_index()
 
         await self.notify_backend_for_cmds()
 
@@ -171,6 +173,9 @@ class Plugin:
         if not self.loaded:
             return
         # print(f"Unloading plugin {self.name}")
+        # Write out and forget the plugin's cached storage, a reload reads it back from disk
+        for hook in self.hooks:
+            storage.invalidate_hook_cache(hook.storage_name)
         self.plugin_hook.unload()
         if self.legacy_hook:
             self.legacy_hook.unload()
@@ -250,6 +255,9 @@ class PluginDirectory:
             if path in self.plugins:
                 self.plugins[path].unload()
                 self.plugins.pop(path)
+                self.mgr.hook.invalidate_event_index()
+                self.mgr.hook.invalidate_middleware()
+                self.mgr.hook.invalidate_periodics()
             else:
                 print("Unloading unknown plugin")
 
@@ -275,6 +283,9 @@ class PluginDirectory:
                     await self.plugins[path].reload()
                 else:
                     await self._load_file(path)
+                self.mgr.hook.invalidate_event_index()
+                self.mgr.hook.invalidate_middleware()
+                self.mgr.hook.invalidate_periodics()
 
                 await self.mgr.notify_backend_for_cmds()
 
@@ -15,21 +15,33 @@ if TYPE_CHECKING:
     from typing import Optional, Any
 from enum import Enum
 from spanky.hook2 import storage
+from spanky.hook2 import executors
+from spanky.hook2 import metrics
+from .executors import ExecClass, ExecProfile, PoolOverloaded
 from . import arg_parser
 
 import asyncio
 import inspect
-from concurrent.futures import ThreadPoolExecutor
 
-executor = ThreadPoolExecutor(max_workers=100)
 
-
-async def schedule_func(func, /, *args):
-    loop = asyncio.get_running_loop()
+async def run_func(
+    func, args, profile: Optional[ExecProfile] = None
+) -> tuple[float, float, Any]:
+    """
+    Runs a hooklet function and returns the time it waited for a worker, the time it ran and its result.
+    """
     if inspect.iscoroutinefunction(func):
-        return await func(*args)
-    else:
-        return await loop.run_in_executor(executor, func, *args)
+        t0 = time.perf_counter()
+        rez = await func(*args)
+        return 0.0, time.perf_counter() - t0, rez
+    if profile is None:
+        return await executors.pools[ExecClass.THREAD].run(func, args)
+    return await profile.run(func, args)
+
+
+async def schedule_func(func, /, *args, profile: Optional[ExecProfile] = None):
+    _, _, rez = await run_func(func, args, profile)
+    return rez
 
 
 def required_args(func) -> list[str]:
@@ -39,72 +51,117 @@ def required_args(func) -> list[str]:
     return [arg for arg in args if not arg.startswith("_")]
 
 
+_MISSING = object()
+
+
+class _CancelExecution(Exception):
+    """Raised by an argument resolver when the hooklet can't run for the given action"""
+
+
+def _action_attr_resolver(hooklet_id: str, arg: str):
+    """
+    Returns a resolver that looks the argument up on the action, then on the raw event, then in the action context.
+    """
+
+    def resolve(action: Action):
+        val = getattr(action, arg, _MISSING)
+        if val is _MISSING:
+            val = getattr(action._raw, arg, _MISSING)
+        if val is _MISSING:
+            val = getattr(action, "context", {}).get(arg, _MISSING)
+        if val is _MISSING:
+            raise _CancelExecution(
+                f"Hooklet {hooklet_id} asked for invalid argument '{arg}', cancelling execution"
+            )
+        return val
+
+    return resolve
+
+
 class Hooklet:
     def __init__(self, hook: Hook, hooklet_id: str, func):
         self.hook: Hook = hook
         self.hooklet_id: str = hooklet_id
         self.func = func
         self.slash_args = []
+        self.exec_profile: ExecProfile = ExecProfile(hooklet_id)
+        self.metrics: metrics.HookletMetrics = metrics.get(hooklet_id)
+
+        # Compile the argument injection plan once, instead of inspecting the function on every call
+        self.arg_names: list[str] = required_args(func)
+        self._arg_plan = [
+            self.__arg_resolver(arg) for arg in self.arg_names if arg != "self"
+        ]
 
     def __storage_getter(self, server_id: str, storage_name: Optional[str] = None):
         if storage_name == None:
             storage_name = self.hook.storage_name
         return storage.server_storage(server_id, storage_name)
 
-    def __get_args(self, action: Action) -> Optional[list[Any]]:
-        args = []
-        for arg in required_args(self.func):
-            if hasattr(action, arg):
-                val = getattr(action, arg)
-                args.append(val)
-            elif hasattr(action._raw, arg):
-                val = getattr(action._raw, arg)
-                args.append(val)
-            elif hasattr(action, "context") and arg in getattr(action, "context"):
-                val = getattr(action, "context")[arg]
-                args.append(val)
-            elif arg == "storage":
-                if not action.server_id:
-                    print(
-                        f"Hooklet {self.hooklet_id} asked for storage with an action with no server, cancelling execution. This might be a bug!"
-                    )
-                    return None
-                storage = self.hook.server_storage(action.server_id)
-                args.append(storage)
-            elif arg == "storage_loc":
-                if not action.server_id:
-                    print(
-                        f"Hooklet {self.hooklet_id} asked for storage_loc with an action with no server, cancelling execution. This might be a bug!"
-                    )
-                    return None
-                storage_loc = self.hook.data_location(action.server_id)
-                args.append(storage_loc)
-            elif arg == "unique_storage":
-                args.append(self.hook.hook_storage)
-            elif arg == "storage_getter":
-                args.append(self.__storage_getter)
-            elif arg == "action":
-                args.append(action)
-            elif arg == "event":
-                args.append(action._raw)
-            elif arg == "hook":
-                args.append(self.hook)
-            elif arg == "self":
-                continue
-            else:
-                print(
-                    f"Hooklet {self.hooklet_id} asked for invalid argument '{arg}', cancelling execution"
+    def __server_id(self, action: Action, arg: str) -> str:
+        if not action.server_id:
+            raise _CancelExecution(
+                f"Hooklet {self.hooklet_id} asked for {arg} with an action with no server, cancelling execution. This might be a bug!"
+            )
+        return action.server_id
+
+    def __arg_resolver(self, arg: str):
+        # Arguments that are never found on the action itself get a direct resolver
+        match arg:
+            case "storage" if asyncio.iscoroutinefunction(self.func):
+                # Coroutines don't wait on disk reads, the storage is loaded off the event loop
+                return lambda action: storage.async_server_storage(
+                    self.__server_id(action, arg), self.hook.storage_name
                 )
-                return None
-        return args
+            case "storage":
+                return lambda action: self.hook.server_storage(
+                    self.__server_id(action, arg)
+                )
+            case "storage_loc":
+                return lambda action: self.hook.data_location(
+                    self.__server_id(action, arg)
+                )
+            case "unique_storage":
+                return lambda action: self.hook.hook_storage
+            case "storage_getter":
+                return lambda action: self.__storage_getter
+            case "action":
+                return lambda action: action
+            case "event":
+                return lambda action: action._raw
+            case "hook":
+                return lambda action: self.hook
+        return _action_attr_resolver(self.hooklet_id, arg)
+
+    async def __get_args(self, action: Action) -> Optional[list[Any]]:
+        try:
+            args = []
+            for resolve in self._arg_plan:
+                arg = resolve(action)
+                if inspect.isawaitable(arg):
+                    arg = await arg
+                args.append(arg)
+            return args
+        except _CancelExecution as e:
+            print(e)
+            return None
 
     async def handle(self, action: Action):
+        self.metrics.invoked()
         try:
-            args = self.__get_args(action)
+            args = await self.__get_args(action)
             if args is None:
                 return None
 
-            rez = await schedule_func(self.func, *args)
+            try:
+                wait, elapsed, rez = await run_func(self.func, args, self.exec_profile)
+            except PoolOverloaded:
+                raise
+            except:
+                self.metrics.errors += 1
+                raise
+            self.metrics.queue_wait.observe(wait)
+            self.metrics.handler.observe(elapsed)
 
             realRez = None
             if type(rez) is str:
@@ -130,6 +187,8 @@ class Hooklet:
                     replyFunc(rez)
                 else:
                     print(f"Missing reply function, but got output '{realRez!s}'")
+        except PoolOverloaded as e:
+            print(f"Hooklet {self.hooklet_id} dropped: {e!s}")
         except:
             import traceback
 
@@ -150,6 +209,9 @@ class Command(Hooklet):
         self.args: dict[str, Any] = kwargs
         self.name: str = self.args.pop("name", fname)
         self.aliases: list[str] = self.args.pop("aliases", [])
+        self.exec_profile = ExecProfile(
+            self.hooklet_id, self.args.get("executor", ExecClass.THREAD)
+        )
 
         # Add slash args, if empty or not
         self.slash_args = kwargs.get("slash_args", [])
@@ -163,7 +225,7 @@ class Command(Hooklet):
             # If no explicit docstring params:
             # If 'text' is requested and no explicit slash params are set, add a string argument
             if len(params) == 0:
-                if "text" in required_args(self.func):
+                if "text" in self.arg_names:
                     self.slash_args.append(SArg("text", str))
             else:
                 # If parameters are found, create SArg objects for each one
@@ -190,11 +252,32 @@ class Command(Hooklet):
 
 
 class Periodic(Hooklet):
-    def __init__(self, hook: Hook, func, interval: float):
+    # jitter is a random extra delay (in seconds) added to each run.
+    # catch_up is what happens to missed ticks: "skip" drops them, "all" runs them back to back.
+    def __init__(
+        self,
+        hook: Hook,
+        func,
+        interval: float,
+        *,
+        jitter: float = 0,
+        catch_up: str = "skip",
+    ):
         super().__init__(hook, f"{hook.hook_id}_{func.__name__}", func)
         self.interval: float = interval
         self.last_time = time.time()
 
+        if catch_up not in ("skip", "all"):
+            raise ValueError(f"Unknown catch_up policy '{catch_up}'")
+        self.jitter: float = jitter
+        self.catch_up: str = catch_up
+
+        # Scheduler state
+        self.running: bool = False
+        self.pending_runs: int = 0
+        self.missed_ticks: int = 0
+        self.overlaps_skipped: int = 0
+
 
 class Event(Hooklet):
     def __init__(self, hook: Hook, event_type: EventType | list[EventType], func):
@@ -212,6 +295,8 @@ class MessageReact(Hooklet):
             hook, f"{hook.hook_id}_msg_react_{msg_id}_{func.__name__}", func
         )
         self.msg_id: str = msg_id
+        # One metrics entry per handler function, not per message
+        self.metrics = metrics.get(f"{hook.hook_id}_msg_react_{func.__name__}")
 
     def __eq__(self, other) -> bool:
         if isinstance(other, MessageReact):
@@ -0,0 +1,229 @@
+# Per-hooklet runtime metrics.
+# For each hooklet id we keep histograms for the time spent in middleware, the time spent waiting for an
+# execution pool and the time spent in the handler itself, plus error and invocation counters.
+# They can be read with the `hooklet_stats` command or scraped in Prometheus text format from a localhost
+# endpoint, enabled by setting "metrics_port" in bot_config.json.
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from typing import Callable, Optional
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    math.inf,
+)
+
+# Time constant (seconds) for the invocation rate moving average
+RATE_WINDOW = 60.0
+
+
+class Histogram:
+    def __init__(self):
+        self.counts: list[int] = [0] * len(BUCKETS)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for idx, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[idx] += 1
+                return
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile as the upper bound of the bucket it falls into.
+        """
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for idx, bound in enumerate(BUCKETS):
+            seen += self.counts[idx]
+            if seen >= target:
+                return bound
+        return math.inf
+
+    @property
+    def mean(self) -> float:
+        if self.count == 0:
+            return 0.0
+        return self.sum / self.count
+
+
+class HookletMetrics:
+    def __init__(self, hooklet_id: str):
+        self.hooklet_id: str = hooklet_id
+        self.middleware: Histogram = Histogram()
+        self.queue_wait: Histogram = Histogram()
+        self.handler: Histogram = Histogram()
+        self.invocations: int = 0
+        self.errors: int = 0
+
+        self._rate: float = 0.0
+        self._rate_time: float = time.monotonic()
+
+    def _decay(self, now: float):
+        self._rate *= math.exp(-(now - self._rate_time) / RATE_WINDOW)
+        self._rate_time = now
+
+    def invoked(self):
+        self.invocations += 1
+        self._decay(time.monotonic())
+        self._rate += 1 / RATE_WINDOW
+
+    @property
+    def rate(self) -> float:
+        """
+        Invocations per second, averaged over about RATE_WINDOW seconds.
+        """
+        self._decay(time.monotonic())
+        return self._rate
+
+
+_registry: dict[str, HookletMetrics] = {}
+
+
+def get(hooklet_id: str) -> HookletMetrics:
+    if hooklet_id not in _registry:
+        _registry[hooklet_id] = HookletMetrics(hooklet_id)
+    return _registry[hooklet_id]
+
+
+def all_metrics() -> list[HookletMetrics]:
+    return list(_registry.values())
+
+
+def reset():
+    _registry.clear()
+
+
+# Extra Prometheus text producers (e.g. executor pools), called on every scrape
+_collectors: list[Callable[[], str]] = []
+
+
+def add_collector(func: Callable[[], str]):
+    _collectors.append(func)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _bound(bound: float) -> str:
+    return "+Inf" if bound == math.inf else repr(bound)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for name, attr, help_text in (
+        ("spanky_hooklet_middleware_seconds", "middleware", "Time spent in middleware"),
+        (
+            "spanky_hooklet_queue_wait_seconds",
+            "queue_wait",
+            "Time spent waiting for a worker",
+        ),
+        (
+            "spanky_hooklet_handler_seconds",
+            "handler",
+            "Time spent in the hooklet function",
+        ),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for hm in all_metrics():
+            hist: Histogram = getattr(hm, attr)
+            label = _label(hm.hooklet_id)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist.counts):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{hooklet="{label}",le="{_bound(bound)}"}} {cumulative}'
+                )
+            lines.append(f'{name}_sum{{hooklet="{label}"}} {hist.sum}')
+            lines.append(f'{name}_count{{hooklet="{label}"}} {hist.count}')
+
+    for name, help_text, kind, getter in (
+        (
+            "spanky_hooklet_invocations_total",
+            "Hooklet invocations",
+            "counter",
+            lambda hm: hm.invocations,
+        ),
+        (
+            "spanky_hooklet_errors_total",
+            "Hooklet invocations that raised",
+            "counter",
+            lambda hm: hm.errors,
+        ),
+        (
+            "spanky_hooklet_rate",
+            "Hooklet invocations per second",
+            "gauge",
+            lambda hm: hm.rate,
+        ),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for hm in all_metrics():
+            lines.append(f'{name}{{hooklet="{_label(hm.hooklet_id)}"}} {getter(hm)}')
+
+    text = "\n".join(lines) + "\n"
+    for collector in _collectors:
+        text += collector()
+    return text
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        # Only the request line matters, drain the headers
+        await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        body = render_prometheus().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {len(body)}\r\n".encode()
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        await writer.drain()
+    except:
+        import traceback
+
+        traceback.print_exc()
+    finally:
+        writer.close()
+
+
+_server: Optional[asyncio.AbstractServer] = None
+
+
+async def start_exporter(port: int, host: str = "127.0.0.1"):
+    """
+    Serves render_prometheus() over HTTP. Only listens on localhost by default.
+    """
+    global _server
+    if _server:
+        return
+    _server = await asyncio.start_server(_handle_scrape, host, port)
+    print(f"Metrics exporter listening on {host}:{port}")
@@ -0,0 +1,173 @@
+# Scheduler for Periodic hooklets.
+# Periodics are kept in a heap keyed on their next fire time, so the scheduler sleeps until exactly the next
+# one is due instead of polling every periodic every second.
+# The set of periodics is reconciled with the hook tree only when the tree changes (see Hook.invalidate_periodics).
+# - A periodic never overlaps with itself: if it's still running when it's due again, that tick is skipped
+#   (or queued, with the "all" catch-up policy).
+# - jitter adds a random delay of up to `jitter` seconds to every fire, without drifting the cadence.
+# - When ticks are missed (the loop was blocked, the bot was busy), the catch-up policy decides what happens:
+#   "skip" runs once and drops the missed ticks, "all" runs the missed ticks back to back (at most MAX_CATCH_UP).
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import time
+from typing import TYPE_CHECKING, Optional
+
+from .actions import ActionPeriodic
+
+if TYPE_CHECKING:
+    from spanky.bot import Bot
+    from .hook2 import Hook
+    from .hooklet import Periodic
+
+MAX_CATCH_UP = 10
+
+
+class PeriodicScheduler:
+    def __init__(self, bot: Bot, root: Hook):
+        self.bot: Bot = bot
+        self.root: Hook = root
+        root._periodic_scheduler = self
+
+        # Heap of (fire time, sequence, periodic, base time). The base time is the fire time without jitter.
+        self._heap: list[tuple[float, int, Periodic, float]] = []
+        self._seq = itertools.count()
+        # id(periodic) -> (periodic, sequence of its live heap entry). Entries not matching are stale and dropped.
+        self._active: dict[int, tuple[Periodic, int]] = {}
+
+        self._dirty: bool = True
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def invalidate(self):
+        self._dirty = True
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(), name="periodic_scheduler")
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _push(self, periodic: Periodic, base: float):
+        seq = next(self._seq)
+        fire_at = base
+        if periodic.jitter > 0:
+            fire_at += random.uniform(0, periodic.jitter)
+        self._active[id(periodic)] = (periodic, seq)
+        heapq.heappush(self._heap, (fire_at, seq, periodic, base))
+
+    def _reconcile(self):
+        self._dirty = False
+        current = {
+            id(periodic): periodic
+            for hook in self.root.walk()
+            for periodic in hook.periodics.values()
+        }
+
+        for key in list(self._active):
+            if current.get(key) is not self._active[key][0]:
+                del self._active[key]
+
+        for key, periodic in current.items():
+            if key not in self._active:
+                # First run happens one interval after the periodic was created
+                self._push(periodic, periodic.last_time + periodic.interval)
+
+        # Don't let stale entries pile up
+        if len(self._heap) > 2 * len(self._active) + 16:
+            self._heap = [
+                entry
+                for entry in self._heap
+                if self._active.get(id(entry[2]), (None, None))[1] == entry[1]
+            ]
+            heapq.heapify(self._heap)
+
+    def _fire(self, periodic: Periodic):
+        if periodic.running:
+            if periodic.catch_up == "all":
+                periodic.pending_runs = min(periodic.pending_runs + 1, MAX_CATCH_UP)
+            else:
+                periodic.overlaps_skipped += 1
+            return
+
+        periodic.running = True
+        asyncio.create_task(self._run_periodic(periodic))
+
+    async def _run_periodic(self, periodic: Periodic):
+        try:
+            while True:
+                periodic.last_time = time.time()
+                await self.bot.dispatch_action(
+                    ActionPeriodic(self.bot, periodic.hooklet_id, periodic)
+                )
+                if periodic.pending_runs == 0:
+                    break
+                periodic.pending_runs -= 1
+        finally:
+            periodic.running = False
+
+    def _due(self, now: float):
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, periodic, base = heapq.heappop(self._heap)
+            if self._active.get(id(periodic), (None, None))[1] != seq:
+                continue
+
+            missed = 0
+            if periodic.interval > 0:
+                missed = max(0, math.floor((now - base) / periodic.interval))
+            if missed:
+                periodic.missed_ticks += missed
+                if periodic.catch_up == "all":
+                    periodic.pending_runs = min(
+                        periodic.pending_runs + missed, MAX_CATCH_UP
+                    )
+
+            self._fire(periodic)
+            self._push(periodic, base + (missed + 1) * max(periodic.interval, 0.001))
+
+    async def run(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                if self._dirty:
+                    self._reconcile()
+
+                now = time.time()
+                self._due(now)
+
+                timeout = None
+                if self._heap:
+                    timeout = max(0, self._heap[0][0] - time.time())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except:
+                import traceback
+
+                traceback.print_exc()
+                await asyncio.sleep(1)
+
+    def stats(self) -> list[dict]:
+        rows = []
+        for periodic, _ in self._active.values():
+            rows.append(
+                {
+                    "hooklet_id": periodic.hooklet_id,
+                    "interval": periodic.interval,
+                    "running": periodic.running,
+                    "missed_ticks": periodic.missed_ticks,
+                    "overlaps_skipped": periodic.overlaps_skipped,
+                }
+            )
+        return rows
@@ -0,0 +1,186 @@
+# Incremental, content-addressed snapshots of the storage documents.
+# Each snapshot is a manifest mapping every document to the hash of its content. Contents are stored once per
+# distinct hash (compressed, under objects/), so a snapshot only writes the documents that changed since the
+# previous one. Documents whose file didn't change (same mtime and size) aren't even read again.
+# Old snapshots are pruned following a retention schedule, and objects no snapshot refers to are deleted.
+# A document can be restored as it was at any snapshotted point in time.
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Optional
+
+from spanky.hook2 import storage
+from spanky.hook2.storage_backends import _atomic_write
+from spanky.utils import codec
+
+# (period in seconds, how many periods): keep the newest snapshot of each of the last N periods
+DEFAULT_RETENTION = (
+    (3600, 24),
+    (24 * 3600, 30),
+    (7 * 24 * 3600, 52),
+)
+
+
+class SnapshotStore:
+    def __init__(self, root: Path, retention=DEFAULT_RETENTION):
+        self.root: Path = root
+        self.objects: Path = root / "objects"
+        self.manifests: Path = root / "manifests"
+        self.retention: tuple[tuple[int, int], ...] = retention
+
+        # location -> (signature, hash) of what was last snapshotted
+        self._known: dict[str, tuple[object, str]] = {}
+        self._lock = threading.Lock()
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest
+
+    def _put(self, content: bytes) -> tuple[str, bool]:
+        """
+        Stores content if it isn't stored yet. Returns its hash and whether it was written.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        if path.exists():
+            return digest, False
+
+        os.makedirs(path.parent, exist_ok=True)
+        _atomic_write(path, zlib.compress(content))
+        return digest, True
+
+    def _get(self, digest: str) -> dict:
+        with open(self._object_path(digest), "rb") as file:
+            return codec.decode(zlib.decompress(file.read()))
+
+    def take(self) -> dict:
+        """
+        Snapshots every document. Returns how many documents were snapshotted and how many had changed.
+        """
+        # Pending writes belong in the snapshot
+        storage.flush_all()
+
+        with self._lock:
+            os.makedirs(self.manifests, exist_ok=True)
+            documents = {}
+            changed = 0
+            for location, signature, load in storage._backend.documents():
+                known = self._known.get(location)
+                if signature is not None and known and known[0] == signature:
+                    documents[location] = known[1]
+                    continue
+
+                content = codec.dumps_json(load(), sort_keys=True).encode()
+                digest, written = self._put(content)
+                changed += written
+                documents[location] = digest
+                self._known[location] = (signature, digest)
+
+            now = time.time()
+            manifest = {"time": now, "documents": documents}
+            _atomic_write(
+                self.manifests / f"{int(now * 1000)}.manifest",
+                codec.dumps_json(manifest).encode(),
+            )
+
+            self._prune()
+
+        return {"documents": len(documents), "changed": changed}
+
+    def list(self) -> list[float]:
+        """
+        Returns the times of the snapshots, oldest first.
+        """
+        if not self.manifests.is_dir():
+            return []
+        return sorted(
+            int(path.stem) / 1000 for path in self.manifests.glob("*.manifest")
+        )
+
+    def _manifest(self, when: float) -> dict:
+        with open(self.manifests / f"{int(when * 1000)}.manifest", "rb") as file:
+            return codec.loads_json(file.read())
+
+    def _prune(self):
+        times = self.list()
+        if not times:
+            return
+
+        # Everything from the shortest period, then the newest snapshot of each retention period
+        now = time.time()
+        shortest = min((period for period, _ in self.retention), default=0)
+        keep = {when for when in times if now - when < shortest}
+        keep.add(times[-1])
+        for period, count in self.retention:
+            buckets = {}
+            for when in times:
+                bucket = int(when // period)
+                if bucket > (now // period) - count and when > buckets.get(bucket, 0):
+                    buckets[bucket] = when
+            keep |= set(buckets.values())
+
+        for when in times:
+            if when not in keep:
+                os.unlink(self.manifests / f"{int(when * 1000)}.manifest")
+
+        # Delete the objects that no snapshot refers to anymore
+        referenced = set()
+        for when in keep:
+            referenced |= set(self._manifest(when)["documents"].values())
+        for path in self.objects.glob("*/*"):
+            if path.name not in referenced:
+                os.unlink(path)
+
+    def find(self, location: str, when: Optional[float] = None) -> Optional[float]:
+        """
+        Returns the time of the newest snapshot taken at or before `when` that has the document.
+        """
+        for snapshot in reversed(self.list()):
+            if when is not None and snapshot > when:
+                continue
+            if location in self._manifest(snapshot)["documents"]:
+                return snapshot
+        return None
+
+    def restore(
+        self, server_id: str, hook_id: str, when: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        Restores a server's storage for a hook as it was at `when` (the latest snapshot if None).
+        Returns the time of the snapshot that was restored, or None if there is none.
+        """
+        if not hook_id.endswith(".json"):
+            hook_id += ".json"
+        location = f"{server_id}/{hook_id}"
+
+        with self._lock:
+            snapshot = self.find(location, when)
+            if snapshot is None:
+                return None
+            data = self._get(self._manifest(snapshot)["documents"][location])
+
+        doc = storage.server_storage(server_id, hook_id)
+        doc.replace(data)
+        doc.flush()
+        return snapshot
+
+
+store = SnapshotStore(storage.DS_LOC / ".snapshots")
+
+
+def configure(config: dict = {}):
+    """
+    Reads the optional "snapshots" section of bot_config.json, e.g.
+    "snapshots": {"path": "storage_data/.snapshots", "retention": [[3600, 24], [86400, 30], [604800, 52]]}
+    """
+    global store
+
+    cfg = config.get("snapshots", {})
+    store = SnapshotStore(
+        Path(cfg.get("path", storage.DS_LOC / ".snapshots")),
+        tuple(tuple(rule) for rule in cfg.get("retention", DEFAULT_RETENTION)),
+    )
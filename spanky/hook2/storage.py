@@ -1,11 +1,28 @@
 import os
-import json
+import asyncio
+import atexit
 import collections
+import contextlib
+import contextvars
+import copy
 import logging
-import platform
+import threading
+import time
+import weakref
 
 from pathlib import Path
 from shutil import copyfile
+from typing import Callable, Iterable, Optional
+
+from spanky.hook2 import metrics
+from spanky.hook2.executors import ExecClass, pools
+from spanky.hook2.storage_backends import (
+    JsonBackend,
+    ShardedBackend,
+    SqliteBackend,
+    migrate_json_to_sqlite,
+)
+from spanky.hook2.storage_index import CollectionIndex, IndexedList
 
 logger = logging.getLogger("storage")
 logger.setLevel(logging.DEBUG)
@@ -17,103 +34,964 @@ logger.addHandler(fh)
 DS_LOC = Path("storage_data/")
 
 
+class _WriteState:
+    """
+    A document's running batches and transactions in the current context. Every asyncio task and every thread
+    has its own, so a batch or a transaction doesn't defer or roll back what other coroutines and threads write
+    meanwhile. Tasks started inside the block share it.
+    """
+
+    def __init__(self):
+        self.batch_depth: int = 0
+        self.batch_pending: bool = False
+        # Key -> value before the running transaction touched it, see dsdict.transaction()
+        self.undo: Optional[dict] = None
+
+
+# Shared by the documents without a running batch or transaction, never changed
+_IDLE = _WriteState()
+
+# id(document) -> its _WriteState in the current context
+_write_states: contextvars.ContextVar[dict[int, _WriteState]] = contextvars.ContextVar(
+    "storage_writes", default={}
+)
+
+
 class dstype:
     def __init__(self, parent, name, *, loc: Path = DS_LOC):
         parent = Path(parent)
         logger.debug("Initializing %s, %s" % (parent, name))
-        os.system("mkdir -p %s" % loc / parent / "backup")
         if not name.endswith(".json"):
             name += ".json"
 
         self.loc: Path = loc
         self.location: Path = parent / name
         self.backup_name: Path = parent / "backup" / name
+        self.backend = _backend if loc == DS_LOC else JsonBackend(loc)
+
+        # Write-behind state, see Flusher
+        self._flush_lock = threading.Lock()
+        self.dirty_since: Optional[float] = None
+        self.last_sync: float = 0.0
+        # Approximate size on disk, kept up to date by the backend
+        self.size: int = 0
+        # Async writers, see async_sync() and batch()
+        self._writer: Optional[asyncio.Lock] = None
+        # Keys the backend didn't load yet -> function loading them, see dsdict
+        self._lazy: dict[str, Callable] = {}
 
         data_obj = self.get_obj(self.location)
         if data_obj:
             self.data = data_obj
 
-    def do_sync(self, obj, name, backup_name):
-        try:
-            logger.debug("Do sync on " + str(name))
+    @property
+    def _writes(self) -> _WriteState:
+        return _write_states.get().get(id(self), _IDLE)
 
-            # Check if the current file is valid
-            json.load(open(self.loc / name, "r"))
-            # If yes, do a backup
-            os.system("cp %s %s" % (self.loc / name, DS_LOC / backup_name))
-            logger.debug("Load/sync OK")
-        except:
-            print("File at %s is not valid" % (self.loc / name))
-            logger.debug("Sync error - file invalid")
+    def _begin_writes(self) -> tuple[_WriteState, Optional[contextvars.Token]]:
+        """
+        Starts a batch or a transaction in the current context, joining the running one if there is one.
+        """
+        states = _write_states.get()
+        state = states.get(id(self))
+        token = None
+        if state is None:
+            state = _WriteState()
+            token = _write_states.set({**states, id(self): state})
+        state.batch_depth += 1
+        return state, token
+
+    def _end_writes(
+        self, state: _WriteState, token: Optional[contextvars.Token]
+    ) -> bool:
+        """
+        Ends what _begin_writes() started. Returns whether the deferred sync is due.
+        """
+        state.batch_depth -= 1
+        if token is not None:
+            _write_states.reset(token)
+        if state.batch_pending and not state.batch_depth:
+            state.batch_pending = False
+            return True
+        return False
 
-        logger.debug("Open file")
-        file = open(self.loc / name, "w")
+    def sync(self):
+        """
+        Saves the data. In write-behind mode this only marks it dirty, the flusher writes it shortly after.
+        """
+        if self._writes.batch_depth:
+            # Written once when the batch ends
+            self._writes.batch_pending = True
+        elif _flusher.write_behind:
+            _flusher.mark_dirty(self)
+        else:
+            self.flush()
+
+    def flush(self):
+        self.backend.write([self])
+
+    @property
+    def writer(self) -> asyncio.Lock:
+        if self._writer is None:
+            self._writer = asyncio.Lock()
+        return self._writer
+
+    async def _flush_off_loop(self):
+        await pools[ExecClass.THREAD].run(self.flush, ())
+
+    async def async_sync(self):
+        """
+        Writes the data now, serializing and writing it off the event loop.
+        Concurrent async writers of the same document are serialized.
+        """
+        if self._writes.batch_depth:
+            self._writes.batch_pending = True
+            return
 
-        json.dump(obj, file, indent=4, sort_keys=True)
-        logger.debug("Sync finished")
+        async with self.writer:
+            await self._flush_off_loop()
 
-    def sync(self):
-        self.do_sync(self.data, self.location, self.backup_name)
+    @contextlib.asynccontextmanager
+    async def batch(self):
+        """
+        Groups mutations: sync() calls inside the block are deferred and the document is written once, off the
+        event loop, when the block ends. Other async writers of the document wait for the block to finish.
+            async with storage.batch():
+                ...
+        """
+        async with self.writer:
+            state, token = self._begin_writes()
+            try:
+                yield self
+            finally:
+                if self._end_writes(state, token):
+                    await self._flush_off_loop()
+
+    def take_changed(self) -> Optional[set]:
+        """
+        Returns the top-level keys that may have changed since the last call, None if that isn't known.
+        """
+        return None
 
     def get_obj(self, location):
         """
         Get an object from disk
         """
+        return self.backend.load(self)
 
-        file_loc = self.loc / location
-        backup_loc = self.loc / self.backup_name
+    def dump_indexes(self) -> Optional[dict]:
+        """
+        Returns the secondary indexes to save alongside the document, None if there are none.
+        """
+        return None
+
+
+class Flusher:
+    """
+    Writes dirty documents in the background, when write-behind is enabled ("write_behind" in the "storage"
+    config). Otherwise sync() writes the document before returning.
+    A document is written once it hasn't been synced for `interval` seconds, or at the latest `max_delay`
+    seconds after it first became dirty, so a burst of sync() calls results in a single write.
+    """
+
+    def __init__(
+        self, write_behind: bool = False, interval: float = 1.0, max_delay: float = 10.0
+    ):
+        self.write_behind: bool = write_behind
+        self.interval: float = interval
+        self.max_delay: float = max_delay
+
+        self._dirty: dict[int, dstype] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.flushes: int = 0
+        self.errors: int = 0
+        self.last_flush_lag: float = 0.0
+        self.max_flush_lag: float = 0.0
+
+    def mark_dirty(self, doc: dstype):
+        with self._cond:
+            now = time.monotonic()
+            if doc.dirty_since is None:
+                doc.dirty_since = now
+            doc.last_sync = now
+            self._dirty[id(doc)] = doc
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="storage_flusher", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def _due_at(self, doc: dstype) -> float:
+        return min(doc.last_sync + self.interval, doc.dirty_since + self.max_delay)
+
+    def _take_due(self) -> tuple[list[dstype], Optional[float]]:
+        """
+        Removes and returns the documents that are due, and how long to wait for the next one.
+        """
+        now = time.monotonic()
+        due = []
+        wait = None
+        for key, doc in list(self._dirty.items()):
+            if doc.dirty_since is None:
+                # Flushed directly in the meantime
+                del self._dirty[key]
+            elif self._due_at(doc) <= now:
+                due.append(self._dirty.pop(key))
+            else:
+                left = self._due_at(doc) - now
+                wait = left if wait is None else min(wait, left)
+        return due, wait
+
+    def _flush_docs(self, docs: list[dstype]):
+        # Documents sharing a backend are written as one batch
+        batches: dict[int, list[dstype]] = {}
+        for doc in docs:
+            batches.setdefault(id(doc.backend), []).append(doc)
+
+        for batch in batches.values():
+            oldest = min(
+                (doc.dirty_since for doc in batch if doc.dirty_since is not None),
+                default=None,
+            )
+            try:
+                batch[0].backend.write(batch)
+            except:
+                import traceback
+
+                traceback.print_exc()
+                self.errors += 1
+                # Try again later
+                for doc in batch:
+                    self.mark_dirty(doc)
+                continue
+
+            self.flushes += len(batch)
+            if oldest is not None:
+                self.last_flush_lag = time.monotonic() - oldest
+                self.max_flush_lag = max(self.max_flush_lag, self.last_flush_lag)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                due, wait = self._take_due()
+                while not due:
+                    self._cond.wait(wait)
+                    due, wait = self._take_due()
+            self._flush_docs(due)
+
+    def flush_all(self):
+        """
+        Writes every dirty document now. Called on shutdown.
+        """
+        with self._cond:
+            docs = list(self._dirty.values())
+            self._dirty.clear()
+        self._flush_docs([doc for doc in docs if doc.dirty_since is not None])
 
-        if not Path(file_loc).exists() and not Path(backup_loc).exists():
-            return {}
+    @property
+    def lag(self) -> float:
+        """
+        How long the oldest unwritten change has been waiting, in seconds.
+        """
+        with self._cond:
+            oldest = [
+                doc.dirty_since
+                for doc in self._dirty.values()
+                if doc.dirty_since is not None
+            ]
+        return time.monotonic() - min(oldest) if oldest else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "write_behind": self.write_behind,
+            "dirty": len(self._dirty),
+            "lag": self.lag,
+            "last_flush_lag": self.last_flush_lag,
+            "max_flush_lag": self.max_flush_lag,
+            "flushes": self.flushes,
+            "errors": self.errors,
+        }
+
+
+_flusher = Flusher()
+atexit.register(lambda: _flusher.flush_all())
+
+
+_backend = JsonBackend(DS_LOC)
+# The "storage" settings _backend was created from
+_BACKEND_KEYS = (
+    "backend",
+    "sqlite_path",
+    "journal",
+    "compact_ratio",
+    "compact_min",
+    "codec",
+    "lazy_min",
+)
+_backend_config: dict = dict.fromkeys(_BACKEND_KEYS)
+
+
+def configure(config: dict = {}):
+    """
+    Reads the optional "storage" section of bot_config.json, e.g.
+    "storage": {"backend": "sqlite", "sqlite_path": "storage_data/storage.db",
+                "write_behind": true, "flush_interval": 1.0, "max_flush_delay": 10.0,
+                "cache_entries": 1000, "cache_bytes": 134217728}
+    or, to journal changes to the JSON files and write them in a compact binary format:
+    "storage": {"backend": "json", "journal": true, "compact_ratio": 1.0, "compact_min": 65536,
+                "codec": "msgpack"}
+    or, to store every large top-level key in its own file and load it on first access:
+    "storage": {"backend": "sharded", "lazy_min": 4096}
+    (sqlite also loads values larger than lazy_min on first access)
+    """
+    global _backend, _backend_config
+
+    cfg = config.get("storage", {})
+    _flusher.flush_all()
+    # sync() writes before returning unless write-behind is asked for, a crash would lose the pending writes
+    _flusher.write_behind = cfg.get("write_behind", False)
+    _flusher.interval = cfg.get("flush_interval", 1.0)
+    _flusher.max_delay = cfg.get("max_flush_delay", 10.0)
+    _server_cache.max_entries = cfg.get("cache_entries", 1000)
+    _server_cache.max_bytes = cfg.get("cache_bytes", 128 * 1024 * 1024)
+
+    backend = cfg.get("backend", "json")
+    backend_config = {key: cfg.get(key) for key in _BACKEND_KEYS}
+    if backend_config == _backend_config:
+        return
+
+    if backend == "sqlite":
+        new_backend = SqliteBackend(
+            Path(cfg.get("sqlite_path", DS_LOC / "storage.db")),
+            cfg.get("lazy_min", 4096),
+        )
+        if new_backend.created:
+            migrate_json_to_sqlite(DS_LOC, new_backend)
+    elif backend == "json":
+        new_backend = JsonBackend(
+            DS_LOC,
+            cfg.get("journal", False),
+            cfg.get("compact_ratio", 1.0),
+            cfg.get("compact_min", 65536),
+            cfg.get("codec", "json"),
+        )
+    elif backend == "sharded":
+        new_backend = ShardedBackend(
+            DS_LOC, cfg.get("codec", "json"), cfg.get("lazy_min", 4096)
+        )
+    else:
+        raise ValueError(f"Unknown storage backend {backend}")
+
+    # Documents loaded so far belong to the old backend
+    _server_cache.clear()
+    _backend.close()
+    _backend = new_backend
+    _backend_config = backend_config
+
+
+def flush_all():
+    _flusher.flush_all()
+
+
+def _prometheus() -> str:
+    stats = _flusher.stats()
+    lines = []
+    for key, kind in (
+        ("dirty", "gauge"),
+        ("lag", "gauge"),
+        ("last_flush_lag", "gauge"),
+        ("max_flush_lag", "gauge"),
+        ("flushes", "counter"),
+        ("errors", "counter"),
+    ):
+        lines.append(f"# TYPE spanky_storage_{key} {kind}")
+        lines.append(f"spanky_storage_{key} {stats[key]}")
+
+    cache = _server_cache.stats()
+    for key, kind in (
+        ("entries", "gauge"),
+        ("bytes", "gauge"),
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+    ):
+        lines.append(f"# TYPE spanky_storage_cache_{key} {kind}")
+        lines.append(f"spanky_storage_cache_{key} {cache[key]}")
+    return "\n".join(lines) + "\n"
+
+
+metrics.add_collector(_prometheus)
+
+
+# Marks a key that didn't exist when a transaction started
+_ABSENT = object()
+
+# Values that can't be changed in place, a transaction only keeps a reference to them
+_IMMUTABLE = (str, int, float, bool, bytes, type(None))
+
+
+def _cow(value, undo: dict, doc: int):
+    """
+    Returns a copy-on-write copy of a list or dict read inside a transaction, value itself otherwise.
+    """
+    if isinstance(value, (_CowList, _CowDict)) and value._undo is undo:
+        return value
+    if isinstance(value, list):
+        return _CowList(value, undo, doc)
+    if isinstance(value, dict):
+        return _CowDict(value, undo, doc)
+    return value
+
+
+class _CowList(list):
+    """
+    A list read inside a transaction. It's a shallow copy of the stored list and takes its place, so the
+    transaction can put the stored one back untouched. Lists and dicts inside it are copied the same way
+    when they're reached, so only what the transaction reads is copied, one level at a time.
+    Once the transaction is over it behaves like a plain list.
+    """
+
+    def __init__(self, items, undo: dict, doc: int):
+        super().__init__(items)
+        self._undo: dict = undo
+        self._doc: int = doc
+
+    def _active(self) -> bool:
+        return _write_states.get().get(self._doc, _IDLE).undo is self._undo
+
+    def __getitem__(self, pos):
+        if not self._active():
+            return super().__getitem__(pos)
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self)))]
+
+        value = super().__getitem__(pos)
+        copied = _cow(value, self._undo, self._doc)
+        if copied is not value:
+            super().__setitem__(pos, copied)
+        return copied
+
+    def _iter_cow(self, reverse: bool = False):
+        pos = len(self) - 1 if reverse else 0
+        while 0 <= pos < len(self):
+            yield self[pos]
+            pos += -1 if reverse else 1
+
+    def __iter__(self):
+        if not self._active():
+            return super().__iter__()
+        return self._iter_cow()
+
+    def __reversed__(self):
+        if not self._active():
+            return super().__reversed__()
+        return self._iter_cow(reverse=True)
+
+    def pop(self, pos=-1):
+        value = super().pop(pos)
+        if not self._active():
+            return value
+        return _cow(value, self._undo, self._doc)
+
+    def copy(self):
+        return list(self)
+
+    __copy__ = copy
+
+    def __add__(self, other):
+        return list(self) + other
+
+    def __mul__(self, count):
+        return list(self) * count
+
+    __rmul__ = __mul__
 
-        try:
-            logger.info("Load file %s" % location)
-            return json.load(open(file_loc, "r"))
-        except:
-            logger.error("Trying backup %s" % location)
-            try:
-                # Try the backup
-                data = json.load(open(backup_loc, "r"))
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(list(list.__iter__(self)), memo)
 
-                logger.critical("Loaded backup for " + str(self.location))
-                return data
-            except:
-                logger.error("Could not load " + self.location)
-                return None
+    def __reduce__(self):
+        # Pickled and copied as a plain list
+        return (list, (list(list.__iter__(self)),))
+
+
+class _CowDict(dict):
+    """
+    A dict read inside a transaction, see _CowList.
+    """
+
+    def __init__(self, items, undo: dict, doc: int):
+        super().__init__(items)
+        self._undo: dict = undo
+        self._doc: int = doc
+
+    def _active(self) -> bool:
+        return _write_states.get().get(self._doc, _IDLE).undo is self._undo
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if not self._active():
+            return value
+
+        copied = _cow(value, self._undo, self._doc)
+        if copied is not value:
+            super().__setitem__(key, copied)
+        return copied
+
+    def __iter__(self):
+        # Defined so that dict(), update() and ** read the values through __getitem__
+        return super().__iter__()
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            super().__setitem__(key, default)
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self or not self._active():
+            return super().pop(key, *default)
+        return _cow(super().pop(key), self._undo, self._doc)
+
+    def popitem(self):
+        key, value = super().popitem()
+        if self._active():
+            value = _cow(value, self._undo, self._doc)
+        return key, value
+
+    def values(self):
+        if not self._active():
+            return super().values()
+        return [self[key] for key in list(super().__iter__())]
+
+    def items(self):
+        if not self._active():
+            return super().items()
+        return [(key, self[key]) for key in list(super().__iter__())]
+
+    def copy(self):
+        return dict(self)
+
+    __copy__ = copy
+
+    def __or__(self, other):
+        return dict(self) | other
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(dict.items(self)), memo)
+
+    def __reduce__(self):
+        # Pickled and copied as a plain dict
+        return (dict, (dict(dict.items(self)),))
 
 
 class dsdict(dstype, collections.UserDict):
     def __init__(self, parent, name):
         collections.UserDict.__init__(self)
+        # Secondary indexes: collection -> indexed keys, see index()
+        self._indexes: dict[str, set[str]] = {}
+        # Indexes saved alongside the document, read on the first index() call
+        self._saved_indexes: Optional[dict] = None
+        # Keys set or deleted since the last take_changed(), and keys ever read: their values may be changed in
+        # place, through references kept for as long as the plugin likes
+        self._changed: set = set()
+        self._read: set = set()
+        self._changed_lock = threading.Lock()
         dstype.__init__(self, parent, name)
 
+    def _load(self, key):
+        """
+        Loads a key the backend left for later.
+        """
+        loader = self._lazy.get(key)
+        if loader is None:
+            return
+
+        value = loader()
+        if key in self._indexes and isinstance(value, list):
+            value = self._indexed(key, value, stored=True)
+        # In the data before it's gone from _lazy, see the backends' write()
+        self.data[key] = value
+        self._lazy.pop(key, None)
+
+    def _mark_changed(self, keys: Iterable):
+        # After the change, so a write taking the keys meanwhile is followed by another one
+        with self._changed_lock:
+            self._changed.update(keys)
+
+    def take_changed(self) -> Optional[set]:
+        with self._changed_lock:
+            changed, self._changed = self._changed, set()
+            return changed | self._read
+
+    def load_all(self):
+        for key in list(self._lazy):
+            self._load(key)
+
+    def _touch(self, key, read: bool = False):
+        """
+        Keeps the key's value the first time the running transaction touches it. Nothing is copied when the
+        key is replaced or deleted. When it's read, it may be changed in place: lists and dicts are swapped for
+        copy-on-write versions (see _CowList), other mutable values are copied.
+        """
+        undo = self._writes.undo
+        if undo is None or key in undo:
+            return
+        self._load(key)
+        if key not in self.data:
+            undo[key] = _ABSENT
+            return
+
+        value = self.data[key]
+        undo[key] = value
+        if not read or isinstance(value, _IMMUTABLE):
+            return
+        if isinstance(value, IndexedList):
+            # The copy has to keep the indexes
+            undo[key] = copy.deepcopy(value)
+        elif isinstance(value, (list, dict)):
+            self.data[key] = _cow(value, undo, id(self))
+        else:
+            undo[key] = copy.deepcopy(value)
+
     def __getitem__(self, key):
+        # The value may be changed in place
+        self._touch(key, read=True)
+        self._load(key)
+        if key not in self._read:
+            with self._changed_lock:
+                self._read.add(key)
         return self.data.get(key, None)
 
     def __setitem__(self, key, value):
+        self._touch(key)
+        if key in self._indexes and isinstance(value, list):
+            value = self._indexed(key, value)
         collections.UserDict.__setitem__(self, key, value)
+        self._lazy.pop(key, None)
+        self._mark_changed([key])
         self.sync()
         return self.data
 
+    def __delitem__(self, key):
+        self._touch(key)
+        if self._lazy.pop(key, None) is not None and key not in self.data:
+            return
+        del self.data[key]
+        self._mark_changed([key])
+
+    def __contains__(self, key):
+        return key in self.data or key in self._lazy
+
+    def __iter__(self):
+        yield from list(self.data)
+        for key in list(self._lazy):
+            if key not in self.data:
+                yield key
+
+    def __len__(self):
+        unloaded = sum(1 for key in list(self._lazy) if key not in self.data)
+        return len(self.data) + unloaded
+
+    def clear(self):
+        keys = list(self)
+        for key in keys:
+            self._touch(key)
+        self._lazy.clear()
+        self.data.clear()
+        self._mark_changed(keys)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups mutations, all or nothing:
+            with storage.transaction():
+                ...
+        The first time a key is accessed inside the block, its value is kept. Lists and dicts the block reads
+        are copied on the way (see _CowList), so the kept value isn't changed in place. If the block raises,
+        every key it accessed gets its kept value back. sync() calls inside the block are deferred and the document is
+        synced once when the block ends. A transaction started inside another one joins it.
+        Only what the current thread or asyncio task does is part of the transaction.
+        """
+        state, token = self._begin_writes()
+        outer = state.undo is None
+        if outer:
+            state.undo = {}
+        try:
+            yield self
+        except BaseException:
+            if outer:
+                self._rollback(state)
+            raise
+        finally:
+            if outer:
+                state.undo = None
+            if self._end_writes(state, token):
+                self.sync()
+
+    def _rollback(self, state: _WriteState):
+        undo, state.undo = state.undo, None
+        for key, value in undo.items():
+            if value is _ABSENT:
+                self.data.pop(key, None)
+                continue
+            if key in self._indexes and isinstance(value, list):
+                value = self._indexed(key, value)
+            self.data[key] = value
+
+        # The flusher may have written some of the changes already
+        if undo:
+            self._mark_changed(undo)
+            state.batch_pending = True
+
+    def replace(self, data: dict):
+        """
+        Replaces the whole contents, without syncing.
+        """
+        self.clear()
+        self.data.update(data)
+        self._mark_changed(data)
+        self.reindex()
+
+    def _indexed(
+        self, collection: str, items: list, stored: bool = False
+    ) -> IndexedList:
+        """
+        Indexes a list of the document. Saved indexes are only used for a list that is as stored (stored=True),
+        and only if it didn't change since they were written, going by the backend's index_version().
+        """
+        if not isinstance(items, IndexedList):
+            items = IndexedList(items)
+
+        saved = {}
+        if stored:
+            if self._saved_indexes is None:
+                self._saved_indexes = self.backend.load_indexes(self) or {}
+            saved = self._saved_indexes.get(collection, {})
+        version = saved.get("version")
+        valid = (
+            version is not None
+            and version == self.backend.index_version(self, collection)
+            and saved.get("count") == len(items)
+        )
+
+        for key in self._indexes[collection]:
+            items.add_index(key, saved.get("keys", {}).get(key) if valid else None)
+        return items
+
+    def index(self, collection: str, key: str) -> CollectionIndex:
+        """
+        Returns an index of the dicts in the list storage[collection] by their `key` field, e.g.
+            storage.index("grabs", key="author_id").get(user_id)
+        The index is kept up to date as the list changes and saved alongside the document.
+        """
+        self._load(collection)
+        items = self.data.get(collection)
+        if items is not None and not isinstance(items, list):
+            raise TypeError(f"{collection} is not a list, it can't be indexed")
+
+        self._indexes.setdefault(collection, set()).add(key)
+        if items is None:
+            # Indexed once the list is set
+            return CollectionIndex(key)
+
+        if not isinstance(items, IndexedList) or key not in items.indexes:
+            # Unless it was changed, or read and maybe changed in place, it's still as stored
+            with self._changed_lock:
+                stored = (
+                    collection not in self._changed and collection not in self._read
+                )
+            # Same contents, no need to sync
+            self.data[collection] = self._indexed(collection, items, stored)
+        return self.data[collection].indexes[key]
+
+    def reindex(self):
+        """
+        Rebuilds the indexes, after the data was changed behind their back.
+        """
+        for collection in self._indexes:
+            items = self.data.get(collection)
+            if isinstance(items, IndexedList):
+                items.refresh()
+            elif isinstance(items, list):
+                self.data[collection] = self._indexed(collection, items)
+
+    def dump_indexes(self) -> Optional[dict]:
+        collections = {
+            name: items
+            for name, items in list(self.data.items())
+            if isinstance(items, IndexedList) and items.indexes
+        }
+        if not collections:
+            return None
+        return {
+            name: {
+                "count": len(items),
+                "keys": {
+                    key: index.dump(items) for key, index in list(items.indexes.items())
+                },
+            }
+            for name, items in collections.items()
+        }
+
+
+class StorageCache:
+    """
+    LRU cache of loaded documents, bounded by number of documents and by their approximate size.
+    Evicted documents are flushed first if dirty, and loaded again from disk on the next access.
+    A document evicted while something still holds a reference to it is reused instead of being loaded twice.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 128 * 1024 * 1024):
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+
+        self._entries: collections.OrderedDict[tuple[str, str], dsdict] = (
+            collections.OrderedDict()
+        )
+        self._live: weakref.WeakValueDictionary[tuple[str, str], dsdict] = (
+            weakref.WeakValueDictionary()
+        )
+        self._lock = threading.RLock()
+
+        # Metrics
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def bytes(self) -> int:
+        return sum(doc.size for doc in list(self._entries.values()))
+
+    def get(self, server_id: str, hook_id: str) -> dsdict:
+        key = (server_id, hook_id)
+        with self._lock:
+            doc = self._entries.get(key)
+            if doc is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return doc
+
+            doc = self._live.get(key)
+            if doc is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                doc = dsdict(server_id, hook_id)
+                self._live[key] = doc
+
+            self._entries[key] = doc
+            self._evict()
+            return doc
+
+    def cached(self, server_id: str, hook_id: str) -> bool:
+        return (server_id, hook_id) in self._live
+
+    def _evict(self):
+        if len(self._entries) <= self.max_entries and self.bytes <= self.max_bytes:
+            return
+
+        total = self.bytes
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or total > self.max_bytes
+        ):
+            _, doc = self._entries.popitem(last=False)
+            self._drop(doc)
+            self.evictions += 1
+            total -= doc.size
+
+    def _drop(self, doc: dsdict):
+        # Don't lose pending writes
+        if doc.dirty_since is not None:
+            try:
+                doc.flush()
+            except:
+                import traceback
+
+                traceback.print_exc()
+
+    def invalidate(self, predicate, forget: bool = False):
+        """
+        Flushes the documents whose (server_id, hook_id) key matches predicate and drops them from the cache.
+        A document something still holds a reference to (e.g. a plugin being reloaded, or another hook sharing
+        its storage) is reused by the next server_storage() call until it's collected, so there's never two
+        live copies of a file. With forget, even those are loaded again.
+        """
+        with self._lock:
+            for key in [key for key in self._live.keys() if predicate(key)]:
+                doc = self._live.pop(key, None) if forget else self._live.get(key)
+                self._entries.pop(key, None)
+                if doc is not None:
+                    self._drop(doc)
+
+    def clear(self):
+        """
+        Forgets every document, e.g. after switching to another backend.
+        """
+        self.invalidate(lambda key: True, forget=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def largest(self, count: int = 10) -> list[tuple[tuple[str, str], int]]:
+        with self._lock:
+            sizes = [(key, doc.size) for key, doc in self._entries.items()]
+        return sorted(sizes, key=lambda item: item[1], reverse=True)[:count]
+
 
-_server_cache = {}
+_server_cache = StorageCache()
 
 
 def server_storage(server_id: str, hook_id: str) -> dsdict:
     if not hook_id.endswith(".json"):
         hook_id += ".json"
 
-    if (server_id, hook_id) not in _server_cache:
-        _server_cache[(server_id, hook_id)] = dsdict(server_id, hook_id)
-    return _server_cache[(server_id, hook_id)]
+    return _server_cache.get(server_id, hook_id)
+
+
+async def async_server_storage(server_id: str, hook_id: str) -> dsdict:
+    """
+    server_storage for coroutines: a document that isn't cached yet is loaded off the event loop.
+    """
+    if not hook_id.endswith(".json"):
+        hook_id += ".json"
+
+    if _server_cache.cached(server_id, hook_id):
+        return _server_cache.get(server_id, hook_id)
+    _, _, doc = await pools[ExecClass.THREAD].run(
+        _server_cache.get, (server_id, hook_id)
+    )
+    return doc
 
 
 def invalidate_server_cache(server_id: str):
-    _server_cache = {k: v for k, v in _server_cache.items() if k[0] != server_id}
+    _server_cache.invalidate(lambda key: key[0] == server_id)
 
 
 def invalidate_hook_cache(hook_id: str):
-    _server_cache = {k: v for k, v in _server_cache.items() if k[1] != hook_id}
+    if not hook_id.endswith(".json"):
+        hook_id += ".json"
+
+    _server_cache.invalidate(lambda key: key[1] == hook_id)
 
 
 def hook_storage(hook_id: str) -> dsdict:
@@ -0,0 +1,783 @@
+# Storage backends for dsdict documents.
+# A document is identified by its location relative to the storage root (e.g. "<server_id>/<hook>.json").
+# - json: one file per document (the default, and the historical layout), optionally with an append-only journal
+#   of changes next to it. Files are pretty-printed JSON unless another codec is configured.
+# - sharded: one directory per document, with small keys inline in a manifest and one file per large key.
+#   Large keys are loaded on first access and only the keys that changed are written.
+# - sqlite: one row per top-level key in a single SQLite database, in WAL mode. Only keys whose value changed
+#   are written, and all the documents flushed together are written in one transaction. Large values are
+#   loaded on first access.
+# The backend is picked with "backend" in the "storage" section of bot_config.json.
+# The first time the SQLite database is created, the existing JSON tree is migrated into it. The migration
+# can also be run by hand:
+#   python -m spanky.hook2.storage_backends migrate [storage_data] [storage_data/storage.db]
+from __future__ import annotations
+
+import functools
+import hashlib
+import logging
+import os
+import platform
+import sqlite3
+import stat
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import quote
+
+from spanky.utils import codec
+
+if TYPE_CHECKING:
+    from .storage import dstype
+
+logger = logging.getLogger("storage")
+
+
+# Setting the umask is the only way to read it, do it once before there are other threads
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _file_mode(path: Path) -> int:
+    """
+    The permissions path has, or the ones open() would give a new file.
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def _atomic_write(path: Path, content: bytes):
+    """
+    Writes content to a temporary file next to path, fsyncs it and renames it over path, so readers only ever
+    see the old or the new version.
+    """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp, _file_mode(path))
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+    # Make the rename itself durable
+    if platform.system() != "Windows":
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def _retry(func, *args):
+    # The data may be changed by another thread while it's being serialized, retry a few times
+    for _ in range(4):
+        try:
+            return func(*args)
+        except RuntimeError:
+            pass
+    return func(*args)
+
+
+def _journal_path(path: Path) -> Path:
+    return path.with_name(path.name + ".journal")
+
+
+def _digest(encoded: str) -> bytes:
+    return hashlib.sha1(encoded.encode()).digest()
+
+
+def _shards_path(path: Path) -> Path:
+    return path.with_name(path.name + ".shards")
+
+
+def _shard_name(key: str) -> str:
+    name = quote(key, safe="")
+    if len(name) > 200:
+        name = hashlib.sha1(key.encode()).hexdigest()
+    return name + ".shard"
+
+
+def _index_path(path: Path) -> Path:
+    return path.with_name(path.name + ".idx")
+
+
+def _with_versions(indexes: dict, version) -> str:
+    # The version of each collection they were saved with (see index_version), they're only valid for it
+    for name, collection in indexes.items():
+        collection["version"] = version(name)
+    return _retry(codec.dumps_json, indexes)
+
+
+def _row_version(rows: dict, key: str) -> Optional[str]:
+    # The digest of a key's value as stored, for the backends that keep one row per key
+    row = rows.get(key)
+    return None if row is None else hashlib.sha1(row.encode()).hexdigest()
+
+
+def replay_journal(data: dict, path: Path, base: str, digest=None) -> int:
+    """
+    Applies the operations of a journal file to data. Returns the size of the valid part of the journal.
+    A torn last line (the bot died while appending) ends the replay.
+    The journal starts with the digest of the snapshot it was written on top of. If that isn't base, the digest
+    of the snapshot now (the bot died while compacting, after the new snapshot was written but before the
+    journal was deleted), the journal is already in it: nothing is applied and the valid part is empty.
+    The valid part is fed to the digest (a hashlib object), if given.
+    """
+    valid = 0
+    if not path.exists():
+        return valid
+
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                op = codec.loads_json(line)
+            except ValueError:
+                break
+
+            if "base" in op:
+                if op["base"] != base:
+                    return 0
+                valid += len(line)
+                if digest is not None:
+                    digest.update(line)
+                continue
+
+            key = op["k"]
+            if "v" in op:
+                data[key] = op["v"]
+            elif "a" in op:
+                data[key].extend(op["a"])
+            elif "d" in op:
+                data.pop(key, None)
+            valid += len(line)
+            if digest is not None:
+                digest.update(line)
+    return valid
+
+
+class JsonBackend:
+    """
+    Documents are written with the given codec (see spanky.utils.codec), and read with whatever codec they
+    were written with.
+    With journal=True, writes only append the top-level keys that changed to <document>.journal (a list that
+    grew only gets its new elements appended). Only the keys the document reports as possibly changed (see
+    dstype.take_changed) are encoded, and only a digest of each written key is kept to compare with.
+    Once the journal outgrows compact_ratio times the document, it is folded back into the document. Loading
+    reads the document and replays the journal on top of it, if it was written on top of that document.
+    """
+
+    name = "json"
+
+    def __init__(
+        self,
+        root: Path,
+        journal: bool = False,
+        compact_ratio: float = 1.0,
+        compact_min: int = 64 * 1024,
+        encoding: str = "json",
+    ):
+        self.root: Path = root
+        self.codec: codec.Codec = codec.get(encoding)
+        self.journal: bool = journal
+        self.compact_ratio: float = compact_ratio
+        self.compact_min: int = compact_min
+
+    def _load_file(self, doc: dstype) -> Optional[dict]:
+        file_loc = self.root / doc.location
+        # Written by older versions
+        backup_loc = self.root / doc.backup_name
+        os.makedirs(file_loc.parent, exist_ok=True)
+
+        # Of everything the document was read from, see index_version()
+        doc._digest = hashlib.sha1()
+        if not file_loc.exists() and not backup_loc.exists():
+            return {}
+
+        try:
+            logger.info("Load file %s" % doc.location)
+            with open(file_loc, "rb") as file:
+                content = file.read()
+            doc._digest.update(content)
+            return codec.decode(content)
+        except:
+            logger.error("Trying backup %s" % doc.location)
+            try:
+                # Try the backup
+                data = codec.load_file(backup_loc)
+
+                logger.critical("Loaded backup for " + str(doc.location))
+                return data
+            except:
+                logger.error("Could not load " + str(doc.location))
+                return None
+
+    def load(self, doc: dstype) -> Optional[dict]:
+        data = self._load_file(doc)
+        if data is None:
+            return None
+
+        path = self.root / doc.location
+        journal = _journal_path(path)
+        doc._snapshot_bytes = path.stat().st_size if path.exists() else 0
+        # The digest of the snapshot alone, a journal written on top of it starts with it
+        base = doc._digest.hexdigest()
+        doc._journal_bytes = replay_journal(data, journal, base, doc._digest)
+        doc.size = doc._snapshot_bytes + doc._journal_bytes
+        if not doc._journal_bytes and journal.exists():
+            logger.error("Dropping %s, none of it applies to the document" % journal)
+            os.unlink(journal)
+        elif journal.exists() and journal.stat().st_size != doc._journal_bytes:
+            logger.error("Dropping the torn end of %s" % journal)
+            os.truncate(journal, doc._journal_bytes)
+
+        if self.journal:
+            # Digests of what the journal already has, so the next write only appends what changed
+            doc._journal_rows = {}
+            for key, value in data.items():
+                doc._journal_rows[str(key)] = (
+                    _digest(_retry(codec.dumps_json, value, True)),
+                    len(value) if isinstance(value, list) else None,
+                )
+        return data
+
+    def _write_snapshot(self, doc: dstype):
+        logger.debug("Do sync on " + str(doc.location))
+        path = self.root / doc.location
+        content = _retry(codec.encode, doc.data, self.codec)
+        # History is kept by the snapshots (spanky.hook2.snapshots), not by a per-write backup
+        _atomic_write(path, content)
+        doc._snapshot_bytes = len(content)
+        doc._digest = hashlib.sha1(content)
+
+        # Everything in the journal is in the document now
+        if getattr(doc, "_journal_bytes", 0):
+            os.unlink(_journal_path(path))
+        doc._journal_bytes = 0
+        doc.size = doc._snapshot_bytes
+        logger.debug("Sync finished")
+
+    def _journal_ops(self, doc: dstype, changed: Optional[set]) -> list[dict]:
+        """
+        Returns the operations bringing the journal up to date for the keys in changed, every key if it's None.
+        """
+        written = doc._journal_rows
+        if changed is None:
+            changed = set(list(doc.data)) | set(written)
+
+        ops = []
+        present = set()
+        for key in changed:
+            if key not in doc.data:
+                continue
+            name = str(key)
+            present.add(name)
+            value = doc.data[key]
+            encoded = _retry(codec.dumps_json, value, True)
+            digest = _digest(encoded)
+            length = len(value) if isinstance(value, list) else None
+
+            prev, prev_length = written.get(name, (None, None))
+            if prev == digest:
+                continue
+            written[name] = (digest, length)
+            if (
+                prev_length is not None
+                and length is not None
+                and length > prev_length
+                and _digest(_retry(codec.dumps_json, value[:prev_length], True)) == prev
+            ):
+                # Only new elements at the end of a list
+                ops.append({"k": name, "a": value[prev_length:]})
+            else:
+                ops.append({"k": name, "v": value})
+
+        for name in {str(key) for key in changed} - present:
+            if name in written:
+                del written[name]
+                ops.append({"k": name, "d": 1})
+        return ops
+
+    def _append_journal(self, doc: dstype, changed: Optional[set]):
+        ops = self._journal_ops(doc, changed)
+        if not ops:
+            return
+
+        path = self.root / doc.location
+        content = "".join(_retry(codec.dumps_json, op) + "\n" for op in ops)
+        if not doc._journal_bytes:
+            # A new journal, on top of the snapshot as it is now (see replay_journal)
+            base = doc._digest.hexdigest()
+            content = codec.dumps_json({"base": base}) + "\n" + content
+        content = content.encode()
+        with open(_journal_path(path), "ab") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        doc._journal_bytes += len(content)
+        doc._digest.update(content)
+        doc.size = doc._snapshot_bytes + doc._journal_bytes
+
+        if doc._journal_bytes > max(
+            self.compact_min, self.compact_ratio * doc._snapshot_bytes
+        ):
+            self._write_snapshot(doc)
+
+    def load_indexes(self, doc: dstype) -> dict:
+        """
+        Returns the secondary indexes saved next to the document (see dsdict.index).
+        """
+        path = _index_path(self.root / doc.location)
+        if not path.exists():
+            return {}
+        try:
+            return codec.load_file(path)
+        except:
+            logger.error("Could not load the indexes of %s" % doc.location)
+            return {}
+
+    def index_version(self, doc: dstype, collection: str) -> Optional[str]:
+        """
+        Identifies what the document's collection is stored as, saved indexes are only used for the version
+        they were saved with. Here it's the digest of the whole document file and its journal, so editing the
+        file by hand invalidates them too.
+        """
+        digest = getattr(doc, "_digest", None)
+        return None if digest is None else digest.hexdigest()
+
+    def _write_indexes(self, doc: dstype):
+        indexes = doc.dump_indexes()
+        if indexes is not None:
+            _atomic_write(
+                _index_path(self.root / doc.location),
+                _with_versions(
+                    indexes, lambda name: self.index_version(doc, name)
+                ).encode(),
+            )
+
+    def documents(self):
+        """
+        Yields (location, signature, load) for every stored document. The signature changes whenever the
+        document does, load() reads it.
+        """
+        for location, path in json_documents(self.root):
+            shards = _shards_path(path)
+            files = [path, _journal_path(path)]
+            if shards.is_dir():
+                files += sorted(shards.iterdir())
+            signature = tuple(
+                (p.name, p.stat().st_mtime_ns, p.stat().st_size) if p.exists() else None
+                for p in files
+            )
+            yield location, signature, functools.partial(load_json_document, path)
+
+    def write(self, docs: list[dstype]):
+        for doc in docs:
+            with doc._flush_lock:
+                doc.dirty_since = None
+                changed = doc.take_changed()
+                if self.journal:
+                    self._append_journal(doc, changed)
+                else:
+                    self._write_snapshot(doc)
+                self._write_indexes(doc)
+
+    def close(self):
+        pass
+
+
+class ShardedBackend(JsonBackend):
+    """
+    Every document is a directory, <document>.shards/, holding a manifest and one file per large top-level key.
+    Keys whose encoded value is at most lazy_min bytes are kept inline in the manifest and loaded with it,
+    the others are only read when the key is first accessed. Writes only rewrite the shards that changed.
+    A document still in the JSON layout is read from its file, and converted on its first write.
+    """
+
+    name = "sharded"
+
+    def __init__(self, root: Path, encoding: str = "json", lazy_min: int = 4096):
+        super().__init__(root, encoding=encoding)
+        self.lazy_min: int = lazy_min
+
+    def _dir(self, doc: dstype) -> Path:
+        return _shards_path(self.root / doc.location)
+
+    def load(self, doc: dstype) -> Optional[dict]:
+        directory = self._dir(doc)
+        manifest = directory / "manifest.json"
+        if not manifest.exists():
+            data = super().load(doc)
+            # Written in full the first time
+            doc._shards = {}
+            doc._rows = {}
+            return data
+
+        try:
+            logger.info("Load manifest %s" % doc.location)
+            with open(manifest, "rb") as file:
+                content = file.read()
+            manifest = codec.loads_json(content)
+        except:
+            logger.error("Could not load " + str(doc.location))
+            return None
+
+        data = manifest["inline"]
+        doc._shards = {key: tuple(shard) for key, shard in manifest["shards"].items()}
+        doc._rows = {
+            key: _retry(codec.dumps_json, value, True) for key, value in data.items()
+        }
+        for key, (name, _) in doc._shards.items():
+            doc._lazy[key] = functools.partial(
+                self._load_shard, doc, key, directory / name
+            )
+        doc._manifest_bytes = len(content)
+        doc.size = len(content) + sum(size for _, size in doc._shards.values())
+        return data
+
+    def index_version(self, doc: dstype, collection: str) -> Optional[str]:
+        if not hasattr(doc, "_shards"):
+            # Still in the JSON layout
+            return super().index_version(doc, collection)
+        return _row_version(doc._rows, collection)
+
+    def _load_shard(self, doc: dstype, key: str, path: Path):
+        value = codec.load_file(path)
+        doc._rows[key] = _retry(codec.dumps_json, value, True)
+        return value
+
+    def _write_document(self, doc: dstype):
+        directory = self._dir(doc)
+        os.makedirs(directory, exist_ok=True)
+
+        # Keys that were never loaded didn't change. Taken before the data, a key being loaded meanwhile is
+        # in one or the other.
+        lazy = set(doc._lazy)
+        written_shards = getattr(doc, "_shards", {})
+        written = getattr(doc, "_rows", {})
+        rows = {
+            str(key): _retry(codec.dumps_json, value, True)
+            for key, value in list(doc.data.items())
+        }
+
+        inline = {}
+        shards = {
+            key: shard
+            for key, shard in written_shards.items()
+            if key in lazy and key not in rows
+        }
+        # Keys were deleted
+        changed = set(written_shards) != set(shards)
+        changed |= any(key not in rows for key in written if key not in written_shards)
+        for key, encoded in rows.items():
+            if len(encoded) <= self.lazy_min:
+                inline[key] = doc.data.get(key)
+                changed |= written.get(key) != encoded or key in written_shards
+                continue
+
+            shard = written_shards.get(key)
+            if shard is None or written.get(key) != encoded:
+                name = _shard_name(key)
+                content = _retry(codec.encode, doc.data.get(key), self.codec)
+                _atomic_write(directory / name, content)
+                shard = (name, len(content))
+                changed = True
+            shards[key] = shard
+
+        manifest = directory / "manifest.json"
+        if changed or not manifest.exists():
+            content = _retry(
+                codec.dumps_json, {"inline": inline, "shards": shards}
+            ).encode()
+            _atomic_write(manifest, content)
+            doc._manifest_bytes = len(content)
+
+        # Shards of deleted or inlined keys
+        names = {name for name, _ in shards.values()} | {"manifest.json"}
+        for path in directory.iterdir():
+            if path.name not in names and not path.name.endswith(".tmp"):
+                os.unlink(path)
+
+        # The document is converted, the JSON layout is gone
+        path = self.root / doc.location
+        for legacy in (path, _journal_path(path)):
+            if legacy.exists():
+                os.unlink(legacy)
+
+        doc._shards = shards
+        doc._rows = rows
+        doc.size = getattr(doc, "_manifest_bytes", 0) + sum(
+            size for _, size in shards.values()
+        )
+
+    def write(self, docs: list[dstype]):
+        for doc in docs:
+            with doc._flush_lock:
+                doc.dirty_since = None
+                self._write_document(doc)
+                self._write_indexes(doc)
+
+
+class SqliteBackend:
+    name = "sqlite"
+
+    def __init__(self, path: Path, lazy_min: int = 4096):
+        self.path: Path = path
+        self.lazy_min: int = lazy_min
+        os.makedirs(path.parent, exist_ok=True)
+        self.created: bool = not path.exists()
+
+        # One connection shared by the flusher and the event loop, guarded by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS storage ("
+            "doc TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (doc, key)) WITHOUT ROWID"
+        )
+        # Secondary indexes of the documents, see dsdict.index
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS storage_index ("
+            "doc TEXT NOT NULL PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def load(self, doc: dstype) -> Optional[dict]:
+        location = doc.location.as_posix()
+        with self._lock:
+            # Values above lazy_min are only read when the key is first accessed
+            rows = self._conn.execute(
+                "SELECT key, length(value), "
+                "CASE WHEN length(value) <= ? THEN value END "
+                "FROM storage WHERE doc = ?",
+                (self.lazy_min, location),
+            ).fetchall()
+
+        data = {}
+        # What is on disk, so the next write only touches the keys that changed
+        doc._rows = {}
+        doc._lazy_bytes = {}
+        for key, length, value in rows:
+            if value is None:
+                doc._lazy[key] = functools.partial(self._load_value, doc, key)
+                doc._lazy_bytes[key] = length
+                continue
+            try:
+                data[key] = codec.loads_json(value)
+                doc._rows[key] = value
+            except:
+                logger.error("Could not load %s from %s" % (key, doc.location))
+        doc.size = sum(length for _, length, _ in rows)
+        return data
+
+    def _load_value(self, doc: dstype, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM storage WHERE doc = ? AND key = ?",
+                (doc.location.as_posix(), key),
+            ).fetchone()
+        if row is None:
+            return None
+        doc._rows[key] = row[0]
+        return codec.loads_json(row[0])
+
+    def index_version(self, doc: dstype, collection: str) -> Optional[str]:
+        return _row_version(getattr(doc, "_rows", {}), collection)
+
+    def load_indexes(self, doc: dstype) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM storage_index WHERE doc = ?",
+                (doc.location.as_posix(),),
+            ).fetchone()
+        if row is None:
+            return {}
+        try:
+            return codec.loads_json(row[0])
+        except:
+            logger.error("Could not load the indexes of %s" % doc.location)
+            return {}
+
+    def write(self, docs: list[dstype]):
+        written_rows = []
+        with self._lock, self._conn:
+            for doc in docs:
+                with doc._flush_lock:
+                    doc.dirty_since = None
+                    location = doc.location.as_posix()
+                    # Keys that were never loaded didn't change. Taken before the data, a key being loaded
+                    # meanwhile is in one or the other.
+                    lazy = set(doc._lazy)
+                    rows = {
+                        str(key): _retry(codec.dumps_json, value, True)
+                        for key, value in list(doc.data.items())
+                    }
+                    written = getattr(doc, "_rows", {})
+                    written_lazy = getattr(doc, "_lazy_bytes", {})
+
+                    self._conn.executemany(
+                        "INSERT INTO storage (doc, key, value) VALUES (?, ?, ?) "
+                        "ON CONFLICT (doc, key) DO UPDATE SET value = excluded.value",
+                        [
+                            (location, key, value)
+                            for key, value in rows.items()
+                            if written.get(key) != value
+                        ],
+                    )
+                    self._conn.executemany(
+                        "DELETE FROM storage WHERE doc = ? AND key = ?",
+                        [
+                            (location, key)
+                            for key in set(written) | set(written_lazy)
+                            if key not in rows and key not in lazy
+                        ],
+                    )
+                    lazy_bytes = {
+                        key: length
+                        for key, length in written_lazy.items()
+                        if key in lazy and key not in rows
+                    }
+                    size = sum(len(value) for value in rows.values())
+                    size += sum(lazy_bytes.values())
+
+                    indexes = doc.dump_indexes()
+                    if indexes is not None:
+                        version = functools.partial(_row_version, rows)
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO storage_index (doc, value) VALUES (?, ?)",
+                            (location, _with_versions(indexes, version)),
+                        )
+                    written_rows.append((doc, rows, lazy_bytes, size))
+
+        # Only once the transaction is committed
+        for doc, rows, lazy_bytes, size in written_rows:
+            doc._rows = rows
+            doc._lazy_bytes = lazy_bytes
+            doc.size = size
+
+    def documents(self):
+        """
+        Yields (location, signature, load) for every stored document. There is no cheap signature for a
+        document in the database, so it's always None.
+        """
+        with self._lock:
+            locations = [
+                row[0] for row in self._conn.execute("SELECT DISTINCT doc FROM storage")
+            ]
+
+        for location in locations:
+
+            def load(location=location):
+                with self._lock:
+                    rows = self._conn.execute(
+                        "SELECT key, value FROM storage WHERE doc = ?", (location,)
+                    ).fetchall()
+                return {key: codec.loads_json(value) for key, value in rows}
+
+            yield location, None, load
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def json_documents(root: Path):
+    """
+    Yields (location, path) for every document in a JSON storage tree.
+    Only <root>/<server>/<name>.json files (or their journal or shards) are documents, backups, data and hidden
+    directories are skipped.
+    """
+    if not root.is_dir():
+        return
+    for server_dir in sorted(root.iterdir()):
+        if not server_dir.is_dir() or server_dir.name.startswith("."):
+            continue
+        # A journaled document may not have been compacted into a file yet
+        names = {path.name for path in server_dir.glob("*.json")}
+        names |= {
+            path.name[: -len(".journal")] for path in server_dir.glob("*.json.journal")
+        }
+        names |= {
+            path.name[: -len(".shards")] for path in server_dir.glob("*.json.shards")
+        }
+        for name in sorted(names):
+            yield f"{server_dir.name}/{name}", server_dir / name
+
+
+def load_json_document(path: Path) -> dict:
+    """
+    Reads a whole document from a JSON storage tree, whatever its layout.
+    """
+    shards = _shards_path(path)
+    if (shards / "manifest.json").exists():
+        with open(shards / "manifest.json", "rb") as file:
+            manifest = codec.loads_json(file.read())
+        data = manifest["inline"]
+        for key, (name, _) in manifest["shards"].items():
+            data[key] = codec.load_file(shards / name)
+        return data
+
+    data = codec.load_file(path) if path.exists() else {}
+    replay_journal(data, _journal_path(path), path)
+    return data
+
+
+def migrate_json_to_sqlite(root: Path, backend: SqliteBackend) -> int:
+    """
+    Copies every JSON document under root into the SQLite database, in a single transaction.
+    Documents already present in the database are left alone. Returns how many documents were copied.
+    """
+    migrated = 0
+    with backend._lock, backend._conn:
+        for location, path in json_documents(root):
+            exists = backend._conn.execute(
+                "SELECT 1 FROM storage WHERE doc = ? LIMIT 1", (location,)
+            ).fetchone()
+            if exists:
+                continue
+
+            try:
+                data = load_json_document(path)
+            except:
+                print(f"Skipping {path}, it can't be decoded")
+                continue
+            if not isinstance(data, dict):
+                print(f"Skipping {path}, it's not a storage document")
+                continue
+
+            backend._conn.executemany(
+                "INSERT INTO storage (doc, key, value) VALUES (?, ?, ?)",
+                [
+                    (location, str(key), codec.dumps_json(value, sort_keys=True))
+                    for key, value in data.items()
+                ],
+            )
+            migrated += 1
+
+    print(f"Migrated {migrated} storage documents from {root} to {backend.path}")
+    return migrated
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print(
+            "Usage: python -m spanky.hook2.storage_backends migrate [storage_root] [database]"
+        )
+        sys.exit(1)
+
+    root = Path(sys.argv[2] if len(sys.argv) > 2 else "storage_data")
+    database = Path(sys.argv[3] if len(sys.argv) > 3 else root / "storage.db")
+    migrate_json_to_sqlite(root, SqliteBackend(database))
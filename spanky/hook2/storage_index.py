@@ -0,0 +1,247 @@
+# Secondary indexes over storage collections (lists of dicts inside a storage document).
+# storage.index("grabs", key="author_id") turns storage["grabs"] into an IndexedList, which keeps its indexes
+# up to date as elements are added or removed, so lookups by a field don't have to scan the list.
+# Changing the indexed field of an element that is already in the list isn't seen by the index, call
+# refresh() after doing that.
+from __future__ import annotations
+
+import bisect
+from typing import Any, Iterable, Optional
+
+from spanky.utils import codec
+
+_MISSING = object()
+
+
+def _kind(value) -> str:
+    # Numbers compare with each other, anything else only with values of its own type
+    if isinstance(value, (int, float)):
+        return ""
+    return type(value).__name__
+
+
+def _sort_key(value) -> tuple:
+    # Values of different types don't compare, they're ordered by type first
+    return (_kind(value), value)
+
+
+class CollectionIndex:
+    def __init__(self, key: str):
+        self.key: str = key
+        # field value -> elements with that value, in list order
+        self._buckets: dict[Any, list] = {}
+        # Sorted distinct values (see _sort_key), built on the first range() query
+        self._sorted: Optional[list] = None
+
+    def _value(self, item):
+        if not isinstance(item, dict):
+            return _MISSING
+        value = item.get(self.key, _MISSING)
+        try:
+            hash(value)
+        except TypeError:
+            return _MISSING
+        return value
+
+    def add(self, item):
+        value = self._value(item)
+        if value is _MISSING:
+            return
+        if value not in self._buckets:
+            self._buckets[value] = []
+            if self._sorted is not None:
+                bisect.insort(self._sorted, value, key=_sort_key)
+        self._buckets[value].append(item)
+
+    def discard(self, item):
+        value = self._value(item)
+        bucket = self._buckets.get(value)
+        if not bucket:
+            return
+        for pos, elem in enumerate(bucket):
+            if elem is item:
+                del bucket[pos]
+                break
+        if not bucket:
+            del self._buckets[value]
+            if self._sorted is not None:
+                pos = bisect.bisect_left(self._sorted, _sort_key(value), key=_sort_key)
+                if pos < len(self._sorted) and self._sorted[pos] == value:
+                    del self._sorted[pos]
+
+    def replace(self, old, new) -> bool:
+        """
+        Puts new in the place of old, if they have the same value. Returns False if they don't.
+        """
+        value = self._value(old)
+        if value is not self._value(new) and value != self._value(new):
+            return False
+        for pos, elem in enumerate(self._buckets.get(value, [])):
+            if elem is old:
+                self._buckets[value][pos] = new
+                break
+        return True
+
+    def rebuild(self, items: Iterable):
+        self._buckets = {}
+        self._sorted = None
+        for item in items:
+            self.add(item)
+
+    def get(self, value) -> list:
+        """
+        Returns the elements whose field equals value.
+        """
+        return list(self._buckets.get(value, []))
+
+    def range(self, low=None, high=None) -> list:
+        """
+        Returns the elements whose field is in [low, high), ordered by it. None means unbounded.
+        Only values that compare with the bounds are returned, e.g. no strings for a range of numbers.
+        """
+        if self._sorted is None:
+            self._sorted = sorted(self._buckets, key=_sort_key)
+
+        start = (
+            0
+            if low is None
+            else bisect.bisect_left(self._sorted, _sort_key(low), key=_sort_key)
+        )
+        end = (
+            len(self._sorted)
+            if high is None
+            else bisect.bisect_left(self._sorted, _sort_key(high), key=_sort_key)
+        )
+        kinds = {_kind(bound) for bound in (low, high) if bound is not None}
+        return [
+            item
+            for value in self._sorted[start:end]
+            if not kinds or _kind(value) in kinds
+            for item in self._buckets[value]
+        ]
+
+    def dump(self, items: list) -> dict:
+        """
+        Returns the index as positions in items, to be saved alongside the document.
+        """
+        positions = {id(item): pos for pos, item in enumerate(items)}
+        return {
+            codec.dumps_json(value): [
+                positions[id(item)] for item in bucket if id(item) in positions
+            ]
+            for value, bucket in list(self._buckets.items())
+        }
+
+    def restore(self, items: list, dumped: dict) -> bool:
+        """
+        Loads an index saved by dump(). The caller checks that it was saved for these elements, this only
+        checks that it's consistent. Returns False if it isn't.
+        """
+        buckets = {}
+        try:
+            for value, bucket in dumped.items():
+                buckets[codec.loads_json(value)] = [items[pos] for pos in bucket]
+        except (IndexError, TypeError, ValueError):
+            return False
+        if any(not bucket for bucket in buckets.values()):
+            return False
+
+        self._buckets = buckets
+        self._sorted = None
+        return True
+
+
+class IndexedList(list):
+    """
+    A list that keeps CollectionIndexes over its elements. It's stored like any other list.
+    """
+
+    def __init__(self, items: Iterable = (), keys: Iterable[str] = ()):
+        super().__init__(items)
+        self.indexes: dict[str, CollectionIndex] = {}
+        for key in keys:
+            self.add_index(key)
+
+    def add_index(self, key: str, dumped: Optional[dict] = None) -> CollectionIndex:
+        if key not in self.indexes:
+            index = CollectionIndex(key)
+            if dumped is None or not index.restore(self, dumped):
+                index.rebuild(self)
+            self.indexes[key] = index
+        return self.indexes[key]
+
+    def refresh(self):
+        for index in self.indexes.values():
+            index.rebuild(self)
+
+    def _added(self, items: Iterable):
+        for index in self.indexes.values():
+            for item in items:
+                index.add(item)
+
+    def _removed(self, items: Iterable):
+        for index in self.indexes.values():
+            for item in items:
+                index.discard(item)
+
+    def append(self, item):
+        super().append(item)
+        self._added([item])
+
+    def extend(self, items: Iterable):
+        items = list(items)
+        super().extend(items)
+        self._added(items)
+
+    def __iadd__(self, items: Iterable):
+        self.extend(items)
+        return self
+
+    def insert(self, pos, item):
+        super().insert(pos, item)
+        # Buckets keep list order
+        self.refresh()
+
+    def remove(self, item):
+        removed = self[self.index(item)]
+        super().remove(item)
+        self._removed([removed])
+
+    def pop(self, pos=-1):
+        item = super().pop(pos)
+        self._removed([item])
+        return item
+
+    def clear(self):
+        super().clear()
+        self.refresh()
+
+    def __setitem__(self, pos, value):
+        if isinstance(pos, slice):
+            super().__setitem__(pos, value)
+            # Buckets keep list order
+            self.refresh()
+            return
+
+        old = self[pos]
+        super().__setitem__(pos, value)
+        for index in self.indexes.values():
+            if not index.replace(old, value):
+                index.rebuild(self)
+
+    def __delitem__(self, pos):
+        old = self[pos] if isinstance(pos, slice) else [self[pos]]
+        super().__delitem__(pos)
+        self._removed(old)
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.refresh()
+
+    def reverse(self):
+        super().reverse()
+        self.refresh()
+
+    def __reduce__(self):
+        # Copies (and deep copies) rebuild their indexes
+        return (IndexedList, (list(self), list(self.indexes)))
@@ -7,11 +7,16 @@ import inspect
 import traceback
 import random
 import collections
-import requests
+import concurrent.futures
+import functools
+import threading
 import abc
 from spanky.utils.image import Image
 from spanky.utils import time_utils
 from spanky.utils import discord_utils as dutils
+from spanky.utils.url_resolver import UrlResolver
+from spanky.utils.send_queue import SendQueue
+from spanky.utils import send_queue as sq
 
 from nextcord.interactions import Interaction
 import nextcord.application_command as ac
@@ -43,7 +48,308 @@ bot: "Bot" = None
 bot_replies = {}
 to_delete = {}
 emojis = res.load_json("twemoji_800x800")
-raw_msg_cache = {}  # message cache that we use to map msg_id to msg
+url_resolver = UrlResolver(emojis)
+
+
+class MessageCache:
+    """
+    Messages by ID, for the reactions to messages nextcord doesn't have cached anymore.
+    At most max_size messages are kept, each for at most max_age seconds since it was last used, least
+    recently used first out. Pinned messages (the ones behind permanent selectors and polls) are never evicted.
+    """
+
+    def __init__(self, max_size: int = 5000, max_age: float = 24 * 3600):
+        self.max_size: int = max_size
+        self.max_age: float = max_age
+
+        # Message ID -> (message, last used), least recently used first
+        self._entries: collections.OrderedDict[str, tuple["Message", float]] = (
+            collections.OrderedDict()
+        )
+        self._pinned: dict[str, "Message"] = {}
+        # Message ID -> fetch in progress, so a burst of reactions fetches the message once
+        self._fetching: dict[str, asyncio.Future] = {}
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, msg_id) -> Optional["Message"]:
+        msg_id = str(msg_id)
+        if msg_id in self._pinned:
+            self.hits += 1
+            return self._pinned[msg_id]
+
+        entry = self._entries.get(msg_id)
+        if entry is None or time_utils.tnow() - entry[1] > self.max_age:
+            self.misses += 1
+            return None
+
+        self._entries[msg_id] = (entry[0], time_utils.tnow())
+        self._entries.move_to_end(msg_id)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, msg: "Message", pinned: bool = False):
+        if pinned:
+            self.pin(msg)
+            return
+        if msg.id in self._pinned:
+            self._pinned[msg.id] = msg
+            return
+
+        self._entries[msg.id] = (msg, time_utils.tnow())
+        self._entries.move_to_end(msg.id)
+        self._evict()
+
+    def pin(self, msg: "Message"):
+        self._entries.pop(msg.id, None)
+        self._pinned[msg.id] = msg
+
+    def unpin(self, msg_id):
+        msg = self._pinned.pop(str(msg_id), None)
+        if msg:
+            self.put(msg)
+
+    def _evict(self):
+        now = time_utils.tnow()
+        while self._entries:
+            msg_id, (_, used) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_size and now - used <= self.max_age:
+                break
+            del self._entries[msg_id]
+            self.evictions += 1
+
+    async def fetch(self, msg_id, fetch) -> "Message":
+        """
+        Returns the cached message, or awaits fetch() for it. Concurrent fetches of a message are shared.
+        """
+        msg_id = str(msg_id)
+        msg = self.get(msg_id)
+        if msg:
+            return msg
+
+        if msg_id not in self._fetching:
+            self._fetching[msg_id] = asyncio.ensure_future(fetch())
+        try:
+            msg = await asyncio.shield(self._fetching[msg_id])
+        finally:
+            done = self._fetching.get(msg_id)
+            if done is not None and done.done():
+                del self._fetching[msg_id]
+
+        self.put(msg)
+        return msg
+
+    def __contains__(self, msg_id):
+        return self.get(msg_id) is not None
+
+    def stats(self) -> dict:
+        self._evict()
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "pinned": len(self._pinned),
+            "bytes": sum(
+                len(msg.text or "")
+                for msg, _ in list(self._entries.values())
+                + [(msg, 0) for msg in self._pinned.values()]
+            ),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+message_cache = MessageCache()
+send_queue = SendQueue()
+
+
+def _prometheus() -> str:
+    stats = message_cache.stats()
+    lines = []
+    for key, kind in (
+        ("entries", "gauge"),
+        ("pinned", "gauge"),
+        ("bytes", "gauge"),
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+        ("hit_rate", "gauge"),
+    ):
+        lines.append(f"# TYPE spanky_message_cache_{key} {kind}")
+        lines.append(f"spanky_message_cache_{key} {stats[key]}")
+    lines.append("# TYPE spanky_wrappers gauge")
+    lines.append(f"spanky_wrappers {len(wrappers)}")
+    for key in ("hits", "refreshes", "misses"):
+        lines.append(f"# TYPE spanky_wrappers_{key} counter")
+        lines.append(f"spanky_wrappers_{key} {getattr(wrappers, key)}")
+    return "\n".join(lines) + "\n" + sq.prometheus(send_queue)
+
+
+class WrapperRegistry:
+    """
+    Wrappers of nextcord objects by snowflake, so that events don't wrap the same user, server, channel or
+    role over and over. nextcord builds some objects anew for every event (e.g. the Member of a message), the
+    wrapper of the snowflake is then refreshed from the new object instead of building another one.
+    nextcord updates the objects it caches in place, so the gateway update events invalidate the wrappers of
+    what changed.
+    Each wrapper keeps the last nextcord object it wrapped alive, hence the bound on their number.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size: int = max_size
+        # snowflake -> (wrapper class, guild id) -> wrapper, least recently used first
+        self._wrappers: collections.OrderedDict[int, dict[tuple, object]] = (
+            collections.OrderedDict()
+        )
+        # Wrappers are also created from the hooklet threads
+        self._lock = threading.Lock()
+
+        self.hits: int = 0
+        self.refreshes: int = 0
+        self.misses: int = 0
+
+    def wrap(self, cls, obj, create):
+        snowflake = getattr(obj, "id", None)
+        if snowflake is None:
+            return create()
+        key = (cls, getattr(getattr(obj, "guild", None), "id", None))
+
+        with self._lock:
+            wrapper = self._wrappers.get(snowflake, {}).get(key)
+            if wrapper is not None:
+                self._wrappers.move_to_end(snowflake)
+                if wrapper._raw is obj:
+                    self.hits += 1
+                    return wrapper
+                self.refreshes += 1
+
+        if wrapper is not None:
+            # Outside the lock, wrapping a channel wraps its server
+            wrapper.__init__(obj)
+            return wrapper
+
+        wrapper = create()
+        with self._lock:
+            self.misses += 1
+            self._wrappers.setdefault(snowflake, {})[key] = wrapper
+            self._wrappers.move_to_end(snowflake)
+            while len(self._wrappers) > self.max_size:
+                self._wrappers.popitem(last=False)
+        return wrapper
+
+    def invalidate(self, snowflake):
+        with self._lock:
+            self._wrappers.pop(int(snowflake), None)
+
+    def invalidate_guild(self, guild_id):
+        """
+        Drops the server and everything that belongs to it.
+        """
+        guild_id = int(guild_id)
+        with self._lock:
+            self._wrappers.pop(guild_id, None)
+            for snowflake, entry in list(self._wrappers.items()):
+                for key in [key for key in entry if key[1] == guild_id]:
+                    del entry[key]
+                if not entry:
+                    del self._wrappers[snowflake]
+
+    def __len__(self):
+        return len(self._wrappers)
+
+
+wrappers = WrapperRegistry()
+
+
+class NameIndex:
+    """
+    Name -> IDs, for the names that aren't unique. IDs are kept in the order they were added.
+    """
+
+    def __init__(self):
+        self._ids: dict[str, dict[int, None]] = {}
+        self._names: dict[int, str] = {}
+
+    def add(self, snowflake: int, name: str):
+        self.discard(snowflake)
+        self._names[snowflake] = name
+        self._ids.setdefault(name, {})[snowflake] = None
+
+    def discard(self, snowflake: int):
+        name = self._names.pop(snowflake, None)
+        if name is None:
+            return
+        ids = self._ids[name]
+        ids.pop(snowflake, None)
+        if not ids:
+            del self._ids[name]
+
+    def get(self, name: str) -> list[int]:
+        return list(self._ids.get(name, ()))
+
+
+class GuildIndex:
+    """
+    Members, roles and channels of a guild by name, kept up to date from the gateway events.
+    Lookups by ID go through nextcord's own caches, which are already dicts.
+    """
+
+    def __init__(self, guild: nextcord.Guild):
+        self.members = NameIndex()
+        self.roles = NameIndex()
+        self.channels = NameIndex()
+
+        for member in guild.members:
+            self.members.add(member.id, member.name)
+        for role in guild.roles:
+            self.roles.add(role.id, role.name)
+        for chan in guild.channels:
+            self.channels.add(chan.id, chan.name)
+
+
+class GuildIndexes:
+    def __init__(self):
+        self._indexes: dict[int, GuildIndex] = {}
+        self._lock = threading.Lock()
+
+    def get(self, guild: nextcord.Guild) -> GuildIndex:
+        """
+        Returns the guild's index, built the first time it's needed.
+        """
+        index = self._indexes.get(guild.id)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(guild.id)
+                if index is None:
+                    index = self._indexes[guild.id] = GuildIndex(guild)
+        return index
+
+    def indexed(self, guild_id) -> Optional[GuildIndex]:
+        """
+        Returns the guild's index, or None if nothing needed it yet.
+        """
+        return self._indexes.get(guild_id)
+
+    def drop(self, guild_id):
+        self._indexes.pop(int(guild_id), None)
+
+    def rename_user(self, user):
+        # A user has the same name in every guild
+        for index in list(self._indexes.values()):
+            if user.id in index.members._names:
+                index.members.add(user.id, user.name)
+
+
+guild_indexes = GuildIndexes()
+
+
+class Wrapped(type):
+    # Wrapper(obj) returns the registered wrapper of obj if there is one
+    def __call__(cls, obj):
+        return wrappers.wrap(cls, obj, lambda: super(Wrapped, cls).__call__(obj))
 
 
 slash_logger = logging.getLogger("slash_commands")
@@ -62,13 +368,33 @@ slash_logger.addHandler(slash_log_handler)
 # 2. Handle slash message timeouts
 
 
+def _on_loop(loop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
 class Init:
     def __init__(self, bot_inst):
         global client
         global bot
+        global message_cache
+        global send_queue
+
+        # Imported here, spanky.hook2 imports this module
+        from spanky.hook2 import metrics
 
         self.client = client
 
+        # "message_cache": {"max_size": 5000, "max_age": 86400} in bot_config.json
+        message_cache = MessageCache(**bot_inst.config.get("message_cache", {}))
+        # "wrappers": {"max_size": 10000}
+        wrappers.max_size = bot_inst.config.get("wrappers", {}).get("max_size", 10000)
+        # "send_queue": {"count": 5, "period": 5.0} paces each channel to 5 messages every 5 seconds
+        send_queue = SendQueue(**bot_inst.config.get("send_queue", {}))
+        metrics.add_collector(_prometheus)
+
         # Server ID -> Hook list
         # Maps what slash commands are mapped a server
         self._slash_cmds: dict[str, dict[str, ac.ApplicationCommand]] = {}
@@ -100,16 +426,30 @@ class Init:
 
         return rlist
 
-    def add_msg_to_cache(self, msg):
-        raw_msg_cache[msg.id] = msg
+    def add_msg_to_cache(self, msg, pinned=False):
+        """
+        Caches the message behind a selector. Pinned messages are never evicted, only the permanent
+        selectors pin theirs (see Selector.register_selector).
+        """
+        message_cache.put(msg, pinned)
+
+    def release_msg_from_cache(self, msg_id):
+        """
+        Lets a message cached with add_msg_to_cache be evicted.
+        """
+        message_cache.unpin(msg_id)
 
     def get_server_by_id(self, server_id: str) -> Optional["Server"]:
         """
         Gets a server by given ID.
         """
-        for server in self.get_servers():
-            if server.id == str(server_id):
-                return server
+        try:
+            server = client.get_guild(int(server_id))
+        except ValueError:
+            return None
+        if server:
+            return Server(server)
+        return None
 
     async def do_register_slashes(self):
         """
@@ -327,9 +667,7 @@ class DiscordUtils(abc.ABC):
         except ValueError:
             return id_str
 
-        role = nextcord.utils.find(
-            lambda m: m.id == iid_str, self.get_server()._raw.roles
-        )
+        role = self.get_server()._raw.get_role(iid_str)
         if not role:
             return id_str
         return role.name
@@ -341,9 +679,7 @@ class DiscordUtils(abc.ABC):
         except ValueError:
             return uid
 
-        user = nextcord.utils.find(
-            lambda m: m.id == iuid, self.get_server()._raw.members
-        )
+        user = self.get_server()._raw.get_member(iuid)
         if not user:
             return uid
         return user.name
@@ -355,9 +691,7 @@ class DiscordUtils(abc.ABC):
         except ValueError:
             return None
 
-        user = nextcord.utils.find(
-            lambda m: m.id == iuid, self.get_server()._raw.members
-        )
+        user = self.get_server()._raw.get_member(iuid)
         if user:
             return User(user)
         else:
@@ -387,23 +721,19 @@ class DiscordUtils(abc.ABC):
                 target = self.source.id
             elif target[0] == "#":
                 target = target[1:]
-                return nextcord.utils.find(
-                    lambda m: m.name == target, target_server.channels
-                )
+                for chan_id in guild_indexes.get(target_server).channels.get(target):
+                    chan = target_server.get_channel(chan_id)
+                    if chan:
+                        return chan
+                return None
 
         if not self.in_thread:
-            return nextcord.utils.find(
-                lambda m: m.id == int(target), target_server.channels
-            )
+            return target_server.get_channel(int(target))
         else:
-            return nextcord.utils.find(
-                lambda m: m.id == int(target), target_server.threads
-            )
+            return target_server.get_thread(int(target))
 
     def get_channel_name(self, chan_id):
-        chan = nextcord.utils.find(
-            lambda m: m.id == int(chan_id), self.get_server()._raw.channels
-        )
+        chan = self.get_server()._raw.get_channel(int(chan_id))
         return chan.name
 
     async def async_edit_message(self, msg, text=None, embed=None):
@@ -415,6 +745,18 @@ class DiscordUtils(abc.ABC):
         elif embed:
             await msg._raw.edit(embed=embed)
 
+    def _queue_channel(self, target=-1, server=None):
+        """
+        Returns the channel whose send queue a message goes through, or None if it isn't sent through one.
+        """
+        # Interaction responses aren't channel messages, they don't wait in the channel queue
+        if type(self) is EventSlash:
+            return None
+        try:
+            return self.get_channel(target, server)
+        except Exception:
+            return None
+
     async def async_send_message(
         self,
         text=None,
@@ -426,7 +768,42 @@ class DiscordUtils(abc.ABC):
         allowed_mentions=allowed_mentions,
         ephemeral=False,  # EventSlash only, no effect in other event types
         reply_to=None,
+        priority="default",  # "moderation", "default" or "bulk", see spanky.utils.send_queue
+    ):
+        async def send():
+            return await self._send_message(
+                text=text,
+                embed=embed,
+                target=target,
+                server=server,
+                timeout=timeout,
+                check_old=check_old,
+                allowed_mentions=allowed_mentions,
+                ephemeral=ephemeral,
+                reply_to=reply_to,
+            )
+
+        channel = self._queue_channel(target, server)
+        # Let _send_message report it
+        if not channel:
+            return await send()
+        return await send_queue.call(("channel", channel.id), send, priority)
+
+    async def _send_message(
+        self,
+        text=None,
+        embed=None,
+        target=-1,
+        server=None,
+        timeout=0,
+        check_old=True,
+        allowed_mentions=allowed_mentions,
+        ephemeral=False,
+        reply_to=None,
     ):
+        """
+        Sends the message right away, the queued sends call this.
+        """
         func_send_message = None
         channel = None
 
@@ -527,10 +904,11 @@ class DiscordUtils(abc.ABC):
         allowed_mentions=allowed_mentions,
         ephemeral=False,  # EventSlash only, no effect in other event types
         reply_to=None,
+        priority="default",  # "moderation", "default" or "bulk", see spanky.utils.send_queue
     ):
-        asyncio.run_coroutine_threadsafe(
-            self.async_send_message(
-                text=text,
+        async def send(merged=None):
+            return await self._send_message(
+                text=text if merged is None else merged,
                 target=target,
                 server=server,
                 timeout=timeout,
@@ -538,16 +916,37 @@ class DiscordUtils(abc.ABC):
                 allowed_mentions=allowed_mentions,
                 ephemeral=ephemeral,
                 reply_to=reply_to,
-            ),
+            )
+
+        channel = self._queue_channel(target, server)
+        # Let _send_message report it
+        if not channel:
+            asyncio.run_coroutine_threadsafe(send(), bot.loop)
+            return
+
+        # Only texts that aren't replies to a command can be merged
+        mergeable = not check_old and not timeout and reply_to is None
+        send_queue.submit(
             bot.loop,
+            ("channel", channel.id),
+            send,
+            text=text if mergeable and text else None,
+            merge_with=allowed_mentions,
+            priority=priority,
         )
 
-    async def async_send_pm(self, text, user):
-        await user._raw.send(text)
+    async def async_send_pm(self, text, user, priority="default"):
+        async def send():
+            await user._raw.send(text)
 
-    def send_pm(self, text, user):
-        asyncio.run_coroutine_threadsafe(
-            self.async_send_pm(text=text, user=user), bot.loop
+        await send_queue.call(("user", user.id), send, priority)
+
+    def send_pm(self, text, user, priority="default"):
+        async def send(merged=None):
+            await user._raw.send(text if merged is None else merged)
+
+        send_queue.submit(
+            bot.loop, ("user", user.id), send, text=text, priority=priority
         )
 
     def send_embed(
@@ -559,14 +958,21 @@ class DiscordUtils(abc.ABC):
         image_url=None,
         footer_txt=None,
         target=-1,
+        priority="default",
     ):
         em = dutils.prepare_embed(
             title, description, fields, inline_fields, image_url, footer_txt
         )
 
-        asyncio.run_coroutine_threadsafe(
-            self.async_send_message(embed=em, target=target), bot.loop
-        )
+        async def send(merged=None):
+            return await self._send_message(embed=em, target=target)
+
+        channel = self._queue_channel(target)
+        if not channel:
+            asyncio.run_coroutine_threadsafe(send(), bot.loop)
+            return
+
+        send_queue.submit(bot.loop, ("channel", channel.id), send, priority=priority)
 
     def reply(self, text, **kwargs):
         if not hasattr(self, "author"):
@@ -574,7 +980,7 @@ class DiscordUtils(abc.ABC):
             return
         self.send_message("(%s) %s" % (self.author.name, text), **kwargs)
 
-    def send_file(self, file_path, target=-1, server=None):
+    def send_file(self, file_path, target=-1, server=None, priority="default"):
         dfile = nextcord.File(file_path)
 
         async def send_file(channel, dfile):
@@ -598,15 +1004,31 @@ class DiscordUtils(abc.ABC):
             add_bot_reply(self.get_server().id, self.msg._raw, msg)
             return msg
 
-        asyncio.run_coroutine_threadsafe(
-            send_file(self.get_channel(target, server), dfile), bot.loop
+        channel = self.get_channel(target, server)
+        if not channel:
+            logger.error(f"Could not find target {target}")
+            return
+
+        send_queue.submit(
+            bot.loop,
+            ("channel", channel.id),
+            lambda: send_file(channel, dfile),
+            priority=priority,
         )
 
-    async def async_send_file(self, file, target=-1):
-        try:
-            return Message(await self.get_channel(target).send(file=file))
-        except:
-            print(traceback.format_exc())
+    async def async_send_file(self, file, target=-1, priority="default"):
+        channel = self.get_channel(target)
+        if not channel:
+            logger.error(f"Could not find target {target}")
+            return
+
+        async def send():
+            try:
+                return Message(await channel.send(file=file))
+            except:
+                print(traceback.format_exc())
+
+        return await send_queue.call(("channel", channel.id), send, priority)
 
     async def async_set_avatar(self, image):
         await client.user.edit(avatar=image)
@@ -746,70 +1168,33 @@ class EventMessage(DiscordUtils):
 
     @property
     def url(self):
-        def strip_url(text):
-            return text.replace("<", "").replace(">", "")
-
-        last_word = self.text.split()[-1]
-
-        stripped = self.str_to_id(last_word).split()[-1]
-
-        for att in self.attachments:
-            yield Attachment(att).url
-            return
-
-        for emb in self.embeds:
-            yield Embed(emb).url
-            return
-
-        if self.user_id_to_object(stripped) != None:
-            yield str(self.user_id_to_object(stripped).avatar_url)
-            return
-
-        elif len(stripped) == 1 and format(ord(stripped), "x") in emojis:
-            yield emojis[format(ord(stripped), "x")]
-            return
-
-        elif (
-            requests.get(
-                "https://cdn.discordapp.com/emojis/%s.gif" % stripped
-            ).status_code
-            == 200
-        ):
-            yield "https://cdn.discordapp.com/emojis/%s.gif" % stripped
-            return
-
-        elif (
-            requests.get(
-                "https://cdn.discordapp.com/emojis/%s.png" % stripped
-            ).status_code
-            == 200
-        ):
-            yield "https://cdn.discordapp.com/emojis/%s.png" % stripped
-            return
-
-        elif last_word.startswith("http"):
-            yield strip_url(last_word)
-            return
-
-        elif self.server.id in bot_replies:
-
-            for reply in bot_replies[self.server.id].bot_messages():
-                if self.channel.id != str(reply._raw.channel.id):
-                    continue
-
-                for att in reply._raw.attachments:
-                    print(att)
-                    yield Attachment(att).url
-                    return
-
-                for emb in reply._raw.embeds:
-                    print(emb)
-                    yield Embed(emb).url
-                    return
-
-                if strip_url(reply.text.split()[-1]).startswith("http"):
-                    yield strip_url(reply.text.split()[-1])
-                    return
+        """
+        Yields the URL of the image the message refers to, if any (see spanky.utils.url_resolver).
+        Blocks until it's found, coroutines should use async_url() instead. On the event loop, or if resolving
+        takes too long, the URLs that don't need a request (attachments, embeds, links...) are still found.
+        """
+        if bot.loop.is_running() and _on_loop(bot.loop):
+            url = url_resolver.resolve_nowait(self)
+        else:
+            future = asyncio.run_coroutine_threadsafe(
+                url_resolver.resolve(self), bot.loop
+            )
+            try:
+                url = future.result(timeout=url_resolver.wait_timeout)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                url = url_resolver.resolve_nowait(self)
+        if url:
+            yield url
+
+    async def async_url(self) -> Optional[str]:
+        return await url_resolver.resolve(self)
+
+    async def async_image(self) -> Optional[Image]:
+        url = await self.async_url()
+        if url:
+            return Image(url)
+        return None
 
 
 class EventSlash(DiscordUtils):
@@ -943,7 +1328,7 @@ class Message:
             await self._raw.edit(embed=embed)
 
 
-class User:
+class User(metaclass=Wrapped):
     def __init__(self, obj: nextcord.User | nextcord.Member):
         self.nick = obj.display_name
         self.name = obj.name
@@ -956,19 +1341,21 @@ class User:
         except Exception as e:
             print(e)
 
-        self.roles: list["Role"] = []
-        if hasattr(obj, "roles"):
-            for role in obj.roles:
+        self._raw = obj
+
+    @functools.cached_property
+    def roles(self) -> list["Role"]:
+        roles = []
+        if hasattr(self._raw, "roles"):
+            for role in self._raw.roles:
                 if role.name == "@everyone":
                     continue
-                self.roles.append(Role(role))
-
-        self.bot_owner: bool = False
-        global bot
-        if "bot_owners" in bot.config and self.id in bot.config["bot_owners"]:
-            self.bot_owner = True
+                roles.append(Role(role))
+        return roles
 
-        self._raw = obj
+    @functools.cached_property
+    def bot_owner(self) -> bool:
+        return "bot_owners" in bot.config and self.id in bot.config["bot_owners"]
 
     @property
     def timeout(self):
@@ -1053,14 +1440,16 @@ class User:
 
         asyncio.run_coroutine_threadsafe(do_unban(self._raw, server), bot.loop)
 
-    def send_pm(self, text):
-        async def async_send_pm(text):
-            await self._raw.send(text)
+    def send_pm(self, text, priority="default"):
+        async def async_send_pm(merged=None):
+            await self._raw.send(text if merged is None else merged)
 
-        asyncio.run_coroutine_threadsafe(async_send_pm(text=text), bot.loop)
+        send_queue.submit(
+            bot.loop, ("user", self.id), async_send_pm, text=text, priority=priority
+        )
 
 
-class Channel:
+class Channel(metaclass=Wrapped):
     def __init__(self, obj: nextcord.TextChannel | nextcord.threads.Thread):
         self.name = None
         if hasattr(obj, "name"):
@@ -1186,7 +1575,7 @@ class Category:
             yield Channel(chan)
 
 
-class Server:
+class Server(metaclass=Wrapped):
     def __init__(self, obj: nextcord.Guild):
         self.name = obj.name
         self.id = str(obj.id)
@@ -1237,6 +1626,30 @@ class Server:
             return User(user)
         return None
 
+    def get_user_by_name(self, name) -> Optional["User"]:
+        for user_id in guild_indexes.get(self._raw).members.get(name):
+            user = self._raw.get_member(user_id)
+            if user:
+                return User(user)
+        return None
+
+    def get_role_by_name(self, name) -> Optional["Role"]:
+        for role_id in guild_indexes.get(self._raw).roles.get(name):
+            role = self._raw.get_role(role_id)
+            if role:
+                return Role(role)
+        return None
+
+    def get_chan_by_name(self, name) -> Optional["Channel"]:
+        """
+        Text channels only, like get_chans().
+        """
+        for chan_id in guild_indexes.get(self._raw).channels.get(name):
+            chan = self._raw.get_channel(chan_id)
+            if isinstance(chan, nextcord.TextChannel):
+                return Channel(chan)
+        return None
+
     def get_chans(self) -> list["Channel"]:
         chans = []
 
@@ -1277,10 +1690,12 @@ class Server:
         return None
 
     def find_category_by_id(self, id):
-        for cat in self._raw.categories:
-            if str(cat.id) == str(id):
-                return Category(cat)
-
+        try:
+            cat = self._raw.get_channel(int(id))
+        except (TypeError, ValueError):
+            return None
+        if isinstance(cat, nextcord.CategoryChannel):
+            return Category(cat)
         return None
 
     async def create_text_channel(self, name, cat_id):
@@ -1301,10 +1716,7 @@ class Server:
             yield chan
 
     async def create_role(self, name, mentionable=False):
-        existing = None
-        for crtrole in self.get_roles():
-            if crtrole.name == name:
-                existing = crtrole
+        existing = self.get_role_by_name(name)
 
         created = None
         if not existing:
@@ -1316,19 +1728,18 @@ class Server:
         return Role(created)
 
     async def delete_role_by_name(self, role_name):
-        for role in self._raw.roles:
-            if role.name == role_name:
-                await role.delete()
-                return
+        role = self.get_role_by_name(role_name)
+        if role:
+            await role._raw.delete()
+            return
 
         print("Could not find role %s to delete" % role_name)
 
     async def delete_role_by_id(self, role_id):
-        role_id = int(role_id)
-        for role in self._raw.roles:
-            if role.id == role_id:
-                await role.delete()
-                return
+        role = self._raw.get_role(int(role_id))
+        if role:
+            await role.delete()
+            return
 
         print("Could not find role %s to delete" % role_id)
 
@@ -1362,7 +1773,7 @@ class Server:
         )
 
 
-class Role:
+class Role(metaclass=Wrapped):
     hash = random.randint(0, 2**31)
 
     def __hash__(self):
@@ -1374,14 +1785,24 @@ class Role:
         return False
 
     def __init__(self, obj: nextcord.Role):
-        self.name = obj.name
         self.id = str(obj.id)
-        self.position = obj.position
-        self.booster = False
-        if hasattr(obj, "is_premium_subscriber"):
-            self.booster = obj.is_premium_subscriber()
         self._raw = obj
 
+    # Read from the role, so the users holding it see it renamed or moved
+    @property
+    def name(self):
+        return self._raw.name
+
+    @property
+    def position(self):
+        return self._raw.position
+
+    @property
+    def booster(self):
+        if hasattr(self._raw, "is_premium_subscriber"):
+            return self._raw.is_premium_subscriber()
+        return False
+
     @property
     def members(self) -> list["User"]:
         users = []
@@ -1475,8 +1896,9 @@ class DictQueue:
             if elem[1].id == message.id:
                 return elem[1]
 
-        if message.id in raw_msg_cache:
-            return raw_msg_cache[message.id]
+        cached = message_cache.get(message.id)
+        if cached:
+            return cached
 
         return None
 
@@ -1556,19 +1978,33 @@ async def on_message(message):
 ### Members
 @client.event
 async def on_member_join(member):
+    index = guild_indexes.indexed(member.guild.id)
+    if index:
+        index.members.add(member.id, member.name)
     await call_func(bot.on_member_join, member)
 
 
 @client.event
 async def on_member_remove(member):
+    wrappers.invalidate(member.id)
+    index = guild_indexes.indexed(member.guild.id)
+    if index:
+        index.members.discard(member.id)
     await call_func(bot.on_member_remove, member)
 
 
 @client.event
 async def on_member_update(before, after):
+    wrappers.invalidate(after.id)
     await call_func(bot.on_member_update, before, after)
 
 
+@client.event
+async def on_user_update(before, after):
+    wrappers.invalidate(after.id)
+    guild_indexes.rename_user(after)
+
+
 @client.event
 async def on_member_ban(server, member):
     await call_func(bot.on_member_ban, server, member)
@@ -1604,15 +2040,14 @@ async def on_raw_reaction_add(reaction):
         print("raw react", str(reaction.member.id))
 
         # Fetch the message
-        msg_id = str(reaction.message_id)
-        if msg_id not in raw_msg_cache:
+        async def fetch():
             channel = client.get_channel(reaction.channel_id)
-            msg = await channel.fetch_message(reaction.message_id)
+            return Message(await channel.fetch_message(reaction.message_id))
 
-            raw_msg_cache[msg_id] = Message(msg)
+        msg = await message_cache.fetch(reaction.message_id, fetch)
 
-        reaction.message = raw_msg_cache[msg_id]._raw
-        reaction.channel = raw_msg_cache[msg_id]._raw.channel
+        reaction.message = msg._raw
+        reaction.channel = msg._raw.channel
 
         await call_func(bot.on_reaction_add, reaction, reaction.member)
     except:
@@ -1629,10 +2064,68 @@ async def on_server_join(server):
     await call_func(bot.on_server_join, server)
 
 
-async def on_server_remove(server):
+@client.event
+async def on_guild_remove(server):
+    wrappers.invalidate_guild(server.id)
+    guild_indexes.drop(server.id)
     await call_func(bot.on_server_leave, server)
 
 
+@client.event
+async def on_guild_update(before, after):
+    wrappers.invalidate(after.id)
+
+
+@client.event
+async def on_guild_channel_create(channel):
+    index = guild_indexes.indexed(channel.guild.id)
+    if index:
+        index.channels.add(channel.id, channel.name)
+
+
+@client.event
+async def on_guild_channel_update(before, after):
+    wrappers.invalidate(after.id)
+    index = guild_indexes.indexed(after.guild.id)
+    if index:
+        index.channels.add(after.id, after.name)
+
+
+@client.event
+async def on_guild_channel_delete(channel):
+    wrappers.invalidate(channel.id)
+    index = guild_indexes.indexed(channel.guild.id)
+    if index:
+        index.channels.discard(channel.id)
+
+
+@client.event
+async def on_thread_update(before, after):
+    wrappers.invalidate(after.id)
+
+
+@client.event
+async def on_guild_role_create(role):
+    index = guild_indexes.indexed(role.guild.id)
+    if index:
+        index.roles.add(role.id, role.name)
+
+
+@client.event
+async def on_guild_role_update(before, after):
+    index = guild_indexes.indexed(after.guild.id)
+    if index:
+        index.roles.add(after.id, after.name)
+
+
+@client.event
+async def on_guild_role_delete(role):
+    wrappers.invalidate(role.id)
+    index = guild_indexes.indexed(role.guild.id)
+    if index:
+        index.roles.discard(role.id)
+
+
 ###
 
 
@@ -1641,7 +2134,6 @@ async def periodic_task():
 
     while not client.is_closed():
         try:
-            asyncio.create_task(bot.on_periodic())
             check_to_delete()
             await asyncio.sleep(1)
         except Exception:
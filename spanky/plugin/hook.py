@@ -27,12 +27,12 @@ def event(event_type: EventType):
     return do_func
 
 
-def periodic(period: float):
+def periodic(period: float, **kwargs):
     def do_func(func):
         func.__hk1_wrapped = True
         func.__hk1_list = "periodics"
         func.__hk1_key = func.__name__
-        func.__hk1_hooklet = lambda hook: Periodic(hook, func, period)
+        func.__hk1_hooklet = lambda hook: Periodic(hook, func, period, **kwargs)
         return func
 
     return do_func
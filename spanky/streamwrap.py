@@ -143,7 +143,13 @@ class StreamWrap():
         for server in bot.get_servers():
             if server_id == server.id:
                 for chunk in chunks:
-                    send_func(server=server, target=chan_id, text=chunk, check_old=False)
+                    send_func(
+                        server=server,
+                        target=chan_id,
+                        text=chunk,
+                        check_old=False,
+                        priority="bulk",
+                    )
 
     def get_channel(self):
         """
@@ -5,6 +5,7 @@ from typing import TYPE_CHECKING, Optional
 from spanky.utils import discord_utils as dutils
 from spanky.utils import time_utils as tutils
 
+from spanky.inputs import nextcord
 from spanky.inputs.nextcord import EventReact
 from spanky.hook2.event import EventType
 
@@ -261,6 +262,8 @@ class Selector:
         elif self.selector_type == SelectorType.PERMANENT:
             self.hook.add_permanent_msg_react(self.msg.id, self.handle_react)
             Selector._permanent_selectors[self.msg.id] = self
+            # Reactions to it shouldn't have to fetch it again
+            nextcord.message_cache.pin(self.msg)
 
         else:
             print("WARNING: Unknown selector type:", self.selector_type)
@@ -274,6 +277,7 @@ class Selector:
             return
         self.selector_type = SelectorType.PERMANENT
         self.hook.add_permanent_msg_react(self.msg.id, self.handle_react)
+        nextcord.message_cache.pin(self.msg)
 
     # serialize serializes the carousel-specific data.
     # Subclasses should call this and then add their specific info
@@ -334,7 +338,7 @@ class Selector:
             return None
         self.msg = msg
 
-        # Add message to backend cache
+        # Add message to backend cache, register_selector pins it if the selector is permanent
         bot.backend.add_msg_to_cache(msg)
 
         # Build the emoji lookup table
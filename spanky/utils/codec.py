@@ -0,0 +1,127 @@
+# Codecs for data files (storage documents, resources).
+# - json: pretty-printed JSON, human readable. This is what every file used to be.
+# - json-compact: JSON without whitespace
+# - msgpack: compact binary encoding (needs the msgpack package)
+# Binary files start with a header naming their codec, JSON files have none, so any file can be decoded without
+# knowing how it was written and old files keep loading.
+# JSON is parsed with orjson when it's installed, which is several times faster than the json module.
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# A JSON document can't start with a NUL byte
+MAGIC = b"\x00spanky-codec:"
+
+
+def loads_json(data: bytes | str):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_json(obj, sort_keys: bool = False) -> str:
+    """
+    Compact single-line JSON.
+    """
+    if orjson:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option).decode()
+    return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys)
+
+
+class Codec:
+    name: str = ""
+    binary: bool = False
+
+    def dumps(self, obj) -> bytes:
+        raise NotImplementedError()
+
+    def loads(self, data: bytes):
+        raise NotImplementedError()
+
+
+class PrettyJson(Codec):
+    name = "json"
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj, indent=4, sort_keys=True).encode()
+
+    def loads(self, data: bytes):
+        return loads_json(data)
+
+
+class CompactJson(Codec):
+    name = "json-compact"
+
+    def dumps(self, obj) -> bytes:
+        return dumps_json(obj, sort_keys=True).encode()
+
+    def loads(self, data: bytes):
+        return loads_json(data)
+
+
+def _str_keys(obj):
+    """
+    Turns dict keys into strings the way JSON does (1 -> "1", None -> "null"), so a document reads back the
+    same whatever codec it was written with.
+    """
+    if isinstance(obj, dict):
+        return {
+            key if isinstance(key, str) else json.dumps(key): _str_keys(value)
+            for key, value in obj.items()
+        }
+    if isinstance(obj, (list, tuple)):
+        return [_str_keys(value) for value in obj]
+    return obj
+
+
+class Msgpack(Codec):
+    name = "msgpack"
+    binary = True
+
+    def dumps(self, obj) -> bytes:
+        return msgpack.packb(_str_keys(obj))
+
+    def loads(self, data: bytes):
+        return msgpack.unpackb(data, strict_map_key=False)
+
+
+codecs: dict[str, Codec] = {
+    codec.name: codec for codec in (PrettyJson(), CompactJson(), Msgpack())
+}
+
+
+def get(name: str) -> Codec:
+    if name not in codecs:
+        raise ValueError(f"Unknown codec {name}, use one of {', '.join(codecs)}")
+    if name == "msgpack" and msgpack is None:
+        raise ValueError("The msgpack codec needs the msgpack package")
+    return codecs[name]
+
+
+def encode(obj, codec: Codec) -> bytes:
+    if codec.binary:
+        return MAGIC + codec.name.encode() + b"\n" + codec.dumps(obj)
+    return codec.dumps(obj)
+
+
+def decode(data: bytes):
+    if data.startswith(MAGIC):
+        header, _, body = data.partition(b"\n")
+        return get(header[len(MAGIC) :].decode()).loads(body)
+    return loads_json(data)
+
+
+def load_file(path):
+    with open(path, "rb") as file:
+        return decode(file.read())
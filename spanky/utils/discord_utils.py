@@ -14,10 +14,7 @@ def get_user_by_id(server: "Server", uid):
 
 
 def get_user_by_name(server: "Server", name: str):
-    for u in server.get_users():
-        if u.name == name:
-            return u
-    return None
+    return server.get_user_by_name(name)
 
 
 def get_user_by_id_or_name(server: "Server", uid_or_name):
@@ -33,11 +30,7 @@ def get_role_by_id(server: "Server", rid):
 
 
 def get_role_by_name(server: "Server", rname):
-    for r in server.get_roles():
-        if r.name == rname:
-            return r
-
-    return None
+    return server.get_role_by_name(rname)
 
 
 def get_role_by_id_or_name(server: "Server", rid_or_name):
@@ -52,10 +45,7 @@ def get_channel_by_id(server: "Server", cid):
 
 
 def get_channel_by_name(server: "Server", cname: str):
-    for chan in server.get_chans():
-        if chan.name == cname:
-            return chan
-    return None
+    return server.get_chan_by_name(cname)
 
 
 def get_channel_by_id_or_name(server: "Server", cid_or_name):
@@ -84,8 +74,9 @@ def code_block(msg):
 
 def get_roles_from_ids(ids: list[str], server: "Server"):
     roles = {}
-    for srole in server.get_roles():
-        if srole.id in ids:
+    for rid in ids:
+        srole = server.get_role(rid)
+        if srole:
             roles[srole.name] = srole
     return roles
 
@@ -1,5 +1,6 @@
 import wand
 import os
+import asyncio
 import string
 import random
 import requests
@@ -23,6 +24,65 @@ MAX_IMG_SIZE = 20 * 1024 * 1024
 MAX_RES_SIZE = 1024 * 1024 * 1024
 
 
+def _pil_frame_job(func, frame, args):
+    """
+    Runs func on a PIL frame in the process pool. Returns the result as PNG, or None if func didn't change it.
+    """
+    result = func(frame, **args)
+    if result is None:
+        return None
+
+    ibytes = io.BytesIO()
+    result.save(ibytes, "PNG")
+    return ibytes.getvalue()
+
+
+def _wand_frame_job(func, blob, args):
+    """
+    Runs func on a wand frame, sent as a PNG, in the process pool. Returns the resulting frames as a GIF or PNG.
+    """
+    with wand_image(blob=blob) as frame:
+        result = func(frame, **args)
+        if type(result) == list:
+            sequence = wand_image()
+            for single in result:
+                sequence.sequence.append(single)
+            result = sequence
+        return result.make_blob("gif" if len(result.sequence) > 1 else "png")
+
+
+async def _in_pool(exec_class, func, *args):
+    # Imported here, spanky.hook2 imports this module
+    from spanky.hook2 import executors
+
+    return await executors.run(exec_class, func, *args)
+
+
+async def _each_in_process(job, func, items, args):
+    """
+    Yields job(func, item, args) for each item, run in the process pool. Only as many items as the pool has
+    workers are submitted at once, so a long GIF doesn't overflow the pool's queue. When the caller stops early
+    (e.g. the image got too large) or a job fails, the rest isn't run.
+    """
+    from spanky.hook2 import executors
+
+    chunk = executors.pools[executors.ExecClass.PROCESS].max_workers
+    for start in range(0, len(items), chunk):
+        tasks = [
+            asyncio.ensure_future(_in_pool("process", job, func, item, args))
+            for item in items[start : start + chunk]
+        ]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        for result in results:
+            yield result
+
+
 class Image:
     def __init__(self, url=None, raw_data=None):
         """
@@ -336,6 +396,43 @@ class Image:
         self.clean_data()
         self.print_memusage("After finish")
 
+    async def async_proc_each_wand_frame(self, func, send_file, send_msg, args={}):
+        """
+        Like proc_each_wand_frame, for coroutines: the frames are processed in parallel in the process pool,
+        downloading and sending run in the thread pool. func must be a module level function.
+        """
+
+        def to_blobs():
+            blobs = []
+            for frame in self.wand().sequence:
+                with wand_image(image=frame) as single:
+                    blobs.append(single.make_blob("png"))
+            return blobs
+
+        new_img = Image()
+        try:
+            send_msg("Working...")
+            blobs = await _in_pool("thread", to_blobs)
+
+            idx = 0
+            async for result in _each_in_process(_wand_frame_job, func, blobs, args):
+                new_img.append_img(wand_image(blob=result))
+                idx += 1
+                # Check if we're not consuming too much memory
+                new_img.check_size(idx)
+
+            # Send the reply
+            await _in_pool("thread", new_img.send_img_reply, send_file)
+        except:
+            import traceback
+
+            traceback.print_exc()
+            send_msg("Something didn't work.")
+        finally:
+            new_img.clean_data()
+
+        self.clean_data()
+
     def proc_each_pil_frame(self, func, send_file, send_msg, args={}):
         new_img = Image()
         self.print_memusage("Before start")
@@ -376,3 +473,50 @@ class Image:
 
         self.clean_data()
         self.print_memusage("After finish")
+
+    async def async_proc_each_pil_frame(self, func, send_file, send_msg, args={}):
+        """
+        Like proc_each_pil_frame, for coroutines: the frames are processed in parallel in the process pool,
+        downloading and sending run in the thread pool. func must be a module level function.
+        """
+
+        def to_frames():
+            return [
+                frame.convert("RGBA")
+                for frame in pil_imagesequence.Iterator(self.pil())
+            ]
+
+        new_img = Image()
+        try:
+            send_msg("Working...")
+            frames = await _in_pool("thread", to_frames)
+
+            modified_frames = False
+            idx = 0
+            async for result in _each_in_process(_pil_frame_job, func, frames, args):
+                if result != None:
+                    modified_frames = True
+                else:
+                    ibytes = io.BytesIO()
+                    frames[idx].save(ibytes, "PNG")
+                    result = ibytes.getvalue()
+
+                new_img.append(wand_image(blob=result))
+                idx += 1
+
+                # Check if we're not consuming too much memory
+                new_img.check_size(idx)
+
+            if modified_frames:
+                await _in_pool("thread", new_img.send_img_reply, send_file)
+            else:
+                send_msg("No frames changed. Not returning anything")
+        except:
+            import traceback
+
+            traceback.print_exc()
+            send_msg("Something didn't work.")
+        finally:
+            new_img.clean_data()
+
+        self.clean_data()
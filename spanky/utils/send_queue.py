@@ -0,0 +1,256 @@
+# Outbound message queue, every message, embed and file the bot sends goes through it.
+# Every channel (and every user, for PMs) gets a FIFO of messages waiting to be sent, drained by one task on the
+# event loop, so bursts (log flushes, periodic announcements) reach Discord in order and one at a time.
+# - Messages have a priority class: "moderation" messages jump ahead of "default" ones, which jump ahead of
+#   "bulk" ones. Messages of the same class keep their order.
+# - Consecutive plain texts of the same class are merged into one message, up to the 2000 characters limit.
+# - Each queue is paced below Discord's per-channel limit (5 messages every 5 seconds), instead of waiting for
+#   429 answers from nextcord's rate limiter.
+from __future__ import annotations
+
+import asyncio
+import collections
+import heapq
+import itertools
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+MAX_MSG_LEN = 2000
+
+# Priority classes, lower is sent first
+PRIORITIES = {
+    "moderation": 0,
+    "default": 1,
+    "bulk": 2,
+}
+
+# Idle queues are dropped once there are more than this many
+MAX_IDLE_QUEUES = 1000
+
+
+class Outbound:
+    """
+    A message waiting to be sent. send() sends it, or send(merged) sends merged in its place when its text was
+    merged with the texts queued after it. text is None for messages that can't be merged, texts are only
+    merged with texts that have the same merge_with object.
+    """
+
+    __slots__ = ("priority", "seq", "send", "text", "merge_with")
+
+    def __init__(
+        self,
+        priority: int,
+        seq: int,
+        send: Callable[..., Awaitable[Any]],
+        text: Optional[str],
+        merge_with: Any,
+    ):
+        self.priority: int = priority
+        self.seq: int = seq
+        self.send = send
+        self.text: Optional[str] = text
+        self.merge_with: Any = merge_with
+
+    def __lt__(self, other: Outbound) -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Pacer:
+    """
+    Allows at most `count` sends every `period` seconds.
+    """
+
+    def __init__(self, count: int, period: float):
+        self.count: int = count
+        self.period: float = period
+        self._sent: collections.deque[float] = collections.deque()
+
+    def delay(self, now: float) -> float:
+        """
+        Returns how long to wait before the next send.
+        """
+        while self._sent and self._sent[0] <= now - self.period:
+            self._sent.popleft()
+        if len(self._sent) < self.count:
+            return 0.0
+        return self._sent[0] + self.period - now
+
+    def sent(self, now: float):
+        self._sent.append(now)
+
+    def idle(self, now: float) -> bool:
+        return not self._sent or self._sent[-1] <= now - self.period
+
+
+class ChannelQueue:
+    def __init__(self, pacer: Pacer):
+        self.heap: list[Outbound] = []
+        self.pacer: Pacer = pacer
+        self.worker: Optional[asyncio.Future] = None
+
+
+class SendQueue:
+    def __init__(
+        self,
+        count: int = 5,
+        period: float = 5.0,
+        max_len: int = MAX_MSG_LEN,
+    ):
+        self.count: int = count
+        self.period: float = period
+        self.max_len: int = max_len
+
+        # Channel or user key -> its queue, only touched from the event loop
+        self.queues: dict[Hashable, ChannelQueue] = {}
+        self._seq = itertools.count()
+
+        self.sent: int = 0
+        self.merged: int = 0
+        self.errors: int = 0
+
+    def submit(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        key: Hashable,
+        send: Callable[..., Awaitable[Any]],
+        text: Optional[str] = None,
+        merge_with: Any = None,
+        priority: str = "default",
+    ):
+        """
+        Queues send() for the channel or user identified by key. Can be called from any thread.
+        If text is given, it may be merged with the texts queued after it, and send(merged) is called instead.
+        """
+        if text is not None and len(text) > self.max_len:
+            text = None
+        item = Outbound(PRIORITIES[priority], next(self._seq), send, text, merge_with)
+        loop.call_soon_threadsafe(self._push, key, item)
+
+    async def call(
+        self,
+        key: Hashable,
+        send: Callable[[], Awaitable[Any]],
+        priority: str = "default",
+    ) -> Any:
+        """
+        Queues send() like submit(), from a coroutine on the event loop, and returns its result once it's sent.
+        Nothing is sent if the caller stops waiting before its turn.
+        """
+        result = asyncio.get_running_loop().create_future()
+
+        async def send_now():
+            if result.done():
+                return
+            try:
+                value = await send()
+            except Exception as e:
+                if not result.done():
+                    result.set_exception(e)
+                raise
+            if not result.done():
+                result.set_result(value)
+
+        self._push(
+            key, Outbound(PRIORITIES[priority], next(self._seq), send_now, None, None)
+        )
+        return await result
+
+    def _push(self, key: Hashable, item: Outbound):
+        queue = self.queues.get(key)
+        if queue is None:
+            if len(self.queues) > MAX_IDLE_QUEUES:
+                self._prune()
+            queue = self.queues[key] = ChannelQueue(Pacer(self.count, self.period))
+
+        heapq.heappush(queue.heap, item)
+        if queue.worker is None or queue.worker.done():
+            queue.worker = asyncio.ensure_future(self._drain(queue))
+
+    def _prune(self):
+        now = time.monotonic()
+        for key, queue in list(self.queues.items()):
+            if not queue.heap and queue.pacer.idle(now):
+                del self.queues[key]
+
+    def _take(self, queue: ChannelQueue) -> tuple[Callable, Optional[str]]:
+        """
+        Pops the next message, returns its send() and the merged text, or None if nothing was merged into it.
+        """
+        item = heapq.heappop(queue.heap)
+        if item.text is None:
+            return item.send, None
+
+        text = item.text
+        merged = False
+        while queue.heap:
+            following = queue.heap[0]
+            if (
+                following.text is None
+                or following.priority != item.priority
+                or following.merge_with is not item.merge_with
+                or len(text) + 1 + len(following.text) > self.max_len
+            ):
+                break
+            heapq.heappop(queue.heap)
+            text += "\n" + following.text
+            merged = True
+            self.merged += 1
+
+        return item.send, text if merged else None
+
+    async def _drain(self, queue: ChannelQueue):
+        while queue.heap:
+            delay = queue.pacer.delay(time.monotonic())
+            if delay > 0:
+                # Look at the queue again afterwards, more urgent messages may have arrived
+                await asyncio.sleep(delay)
+                continue
+
+            send, merged = self._take(queue)
+            queue.pacer.sent(time.monotonic())
+            try:
+                if merged is None:
+                    await send()
+                else:
+                    await send(merged)
+            except Exception:
+                self.errors += 1
+                traceback.print_exc()
+            self.sent += 1
+
+    def depth(self) -> dict[str, int]:
+        """
+        Returns how many messages are waiting, for each priority class.
+        """
+        names = {value: name for name, value in PRIORITIES.items()}
+        depth = {name: 0 for name in PRIORITIES}
+        for queue in list(self.queues.values()):
+            for item in list(queue.heap):
+                depth[names[item.priority]] += 1
+        return depth
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "channels": sum(1 for queue in list(self.queues.values()) if queue.heap),
+            "sent": self.sent,
+            "merged": self.merged,
+            "errors": self.errors,
+        }
+
+
+def prometheus(send_queue: SendQueue) -> str:
+    stats = send_queue.stats()
+    lines = ["# TYPE spanky_send_queue_depth gauge"]
+    for name, depth in stats["depth"].items():
+        lines.append(f'spanky_send_queue_depth{{priority="{name}"}} {depth}')
+    for key, kind in (
+        ("channels", "gauge"),
+        ("sent", "counter"),
+        ("merged", "counter"),
+        ("errors", "counter"),
+    ):
+        lines.append(f"# TYPE spanky_send_queue_{key} {kind}")
+        lines.append(f"spanky_send_queue_{key} {stats[key]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,270 @@
+# Finds the image URL a message refers to, for the image commands (EventMessage.url / EventMessage.image).
+# The resolvers are tried in order and the first URL found wins:
+#   attachment, embed, mentioned user's avatar, unicode emoji, custom emoji, link, latest bot reply
+# Custom emojis are checked against the Discord CDN with HEAD requests made from a shared aiohttp session, and
+# the answers (found or not) are cached, so the event loop and the hooklet threads never wait on requests.
+# The chain is a plain list of async functions taking (resolver, event) and returning a URL or None, plugins
+# can add their own with UrlResolver.add().
+# Callers that can't wait (the event loop thread, or a resolve that took too long) use resolve_nowait(), which
+# skips the resolvers that have to wait on a request.
+from __future__ import annotations
+
+import asyncio
+import collections
+import time
+import traceback
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+
+import aiohttp
+
+if TYPE_CHECKING:
+    from spanky.inputs.nextcord import EventMessage
+
+EMOJI_URL = "https://cdn.discordapp.com/emojis/%s.%s"
+
+
+def strip_url(text: str) -> str:
+    return text.replace("<", "").replace(">", "")
+
+
+class TTLCache:
+    """
+    Remembers answers for a while: positive ones for positive_ttl seconds, negative (None or False) ones for
+    negative_ttl seconds. At most max_size answers are kept, the least recently stored are dropped first.
+    """
+
+    def __init__(
+        self,
+        positive_ttl: float = 24 * 3600,
+        negative_ttl: float = 600,
+        max_size: int = 10000,
+    ):
+        self.positive_ttl: float = positive_ttl
+        self.negative_ttl: float = negative_ttl
+        self.max_size: int = max_size
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[0]
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] >= time.monotonic()
+
+    def set(self, key, value):
+        ttl = self.positive_ttl if value else self.negative_ttl
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+Resolver = Callable[["UrlResolver", "EventMessage"], Awaitable[Optional[str]]]
+
+
+async def from_attachment(resolver: UrlResolver, event: EventMessage):
+    for att in event.attachments:
+        return att.url
+
+
+async def from_embed(resolver: UrlResolver, event: EventMessage):
+    for emb in event.embeds:
+        return emb.url
+
+
+async def from_mention(resolver: UrlResolver, event: EventMessage):
+    stripped = resolver.last_id(event)
+    if not stripped.isdigit() or event.is_pm:
+        return None
+
+    key = (event.server.id, stripped)
+    if key in resolver.avatars:
+        return resolver.avatars.get(key)
+
+    user = event.user_id_to_object(stripped)
+    url = str(user.avatar_url) if user and hasattr(user, "avatar_url") else None
+    resolver.avatars.set(key, url)
+    return url
+
+
+async def from_unicode_emoji(resolver: UrlResolver, event: EventMessage):
+    stripped = resolver.last_id(event)
+    if len(stripped) == 1:
+        return resolver.emojis.get(format(ord(stripped), "x"))
+
+
+async def from_custom_emoji(resolver: UrlResolver, event: EventMessage):
+    stripped = resolver.last_id(event)
+    # Emoji IDs are snowflakes, anything else isn't worth a request
+    if not stripped.isdigit():
+        return None
+
+    for ext in ("gif", "png"):
+        url = EMOJI_URL % (stripped, ext)
+        if await resolver.exists(url):
+            return url
+
+
+async def from_link(resolver: UrlResolver, event: EventMessage):
+    words = event.text.split()
+    if words and words[-1].startswith("http"):
+        return strip_url(words[-1])
+
+
+async def from_bot_reply(resolver: UrlResolver, event: EventMessage):
+    if not event.server_replies:
+        return None
+
+    for reply in event.server_replies.bot_messages():
+        if event.channel.id != str(reply._raw.channel.id):
+            continue
+
+        for att in reply._raw.attachments:
+            return att.url
+
+        for emb in reply._raw.embeds:
+            return emb.url
+
+        words = reply.text.split()
+        if words and strip_url(words[-1]).startswith("http"):
+            return strip_url(words[-1])
+
+
+# Resolvers that may wait on a request, skipped by resolve_nowait()
+WAITING_RESOLVERS: set[Resolver] = {from_custom_emoji}
+
+DEFAULT_RESOLVERS: list[Resolver] = [
+    from_attachment,
+    from_embed,
+    from_mention,
+    from_unicode_emoji,
+    from_custom_emoji,
+    from_link,
+    from_bot_reply,
+]
+
+
+class UrlResolver:
+    def __init__(
+        self,
+        emojis: dict[str, str],
+        resolvers: Optional[list[Resolver]] = None,
+        timeout: float = 5.0,
+        connections: int = 20,
+        wait_timeout: float = 10.0,
+    ):
+        # Unicode codepoint (hex) -> twemoji URL
+        self.emojis: dict[str, str] = emojis
+        self.resolvers: list[Resolver] = list(
+            DEFAULT_RESOLVERS if resolvers is None else resolvers
+        )
+        self.timeout: float = timeout
+        self.connections: int = connections
+        # How long blocking callers wait on resolve() before falling back to resolve_nowait()
+        self.wait_timeout: float = wait_timeout
+        # Custom emoji URL -> whether it exists
+        self.cache = TTLCache()
+        # (server ID, user ID) -> avatar URL, avatars change more often
+        self.avatars = TTLCache(positive_ttl=300, negative_ttl=60)
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        # URL -> probe in progress
+        self._probing: dict[str, asyncio.Future] = {}
+
+    def add(self, resolver: Resolver, before: Optional[Resolver] = None):
+        """
+        Adds a resolver to the chain, at the end or before another one.
+        """
+        pos = self.resolvers.index(before) if before else len(self.resolvers)
+        self.resolvers.insert(pos, resolver)
+
+    @staticmethod
+    def last_id(event: EventMessage) -> str:
+        words = event.text.split()
+        if not words:
+            return ""
+        stripped = event.str_to_id(words[-1]).split()
+        return stripped[-1] if stripped else ""
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _probe(self, url: str) -> bool:
+        try:
+            async with self.session.head(url, allow_redirects=True) as resp:
+                return resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def exists(self, url: str) -> bool:
+        """
+        Checks whether the URL can be fetched. Answers are cached, and concurrent checks of a URL are shared.
+        """
+        if url in self.cache:
+            return self.cache.get(url)
+
+        if url not in self._probing:
+            self._probing[url] = asyncio.ensure_future(self._probe(url))
+        try:
+            found = await asyncio.shield(self._probing[url])
+        finally:
+            probe = self._probing.get(url)
+            if probe is not None and probe.done():
+                del self._probing[url]
+
+        self.cache.set(url, found)
+        return found
+
+    async def resolve(self, event: EventMessage) -> Optional[str]:
+        for resolver in self.resolvers:
+            try:
+                url = await resolver(self, event)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if url:
+                return url
+        return None
+
+    def resolve_nowait(self, event: EventMessage) -> Optional[str]:
+        """
+        Like resolve(), without waiting: the resolvers that would wait on a request are skipped, so custom emojis
+        aren't found. Any thread can call it.
+        """
+        for resolver in self.resolvers:
+            if resolver in WAITING_RESOLVERS:
+                continue
+
+            coro = resolver(self, event)
+            try:
+                coro.send(None)
+            except StopIteration as done:
+                url = done.value
+            except Exception:
+                traceback.print_exc()
+                continue
+            else:
+                # It had to wait after all
+                coro.close()
+                continue
+            if url:
+                return url
+        return None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,34 @@
+import pytest
+
+from spanky.utils import codec
+
+DOC = {"name": "spanky", "items": [1, 2.5, None], "nested": {"ok": True}}
+
+
+@pytest.mark.parametrize("name", ["json", "json-compact", "msgpack"])
+def test_roundtrip(name):
+    if name == "msgpack" and codec.msgpack is None:
+        pytest.skip("msgpack isn't installed")
+
+    data = codec.encode(DOC, codec.get(name))
+    assert data.startswith(codec.MAGIC) == codec.get(name).binary
+    assert codec.decode(data) == DOC
+
+
+@pytest.mark.parametrize("name", ["json", "json-compact", "msgpack"])
+def test_keys_become_strings(name):
+    if name == "msgpack" and codec.msgpack is None:
+        pytest.skip("msgpack isn't installed")
+
+    data = codec.encode({1: {None: [{True: 2}]}}, codec.get(name))
+    assert codec.decode(data) == {"1": {"null": [{"true": 2}]}}
+
+
+def test_plain_json_files():
+    # Files written before there were codecs
+    assert codec.decode(b'{\n    "key": [1, 2]\n}') == {"key": [1, 2]}
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        codec.get("yaml")
@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+from spanky.hook2 import dispatch
+from spanky.hook2.dispatch import DispatchLimiter
+from spanky.hook2.event import EventType
+
+
+def member_update(before, after, server_id="1", member_id="2"):
+    raw = SimpleNamespace(
+        member=SimpleNamespace(id=member_id, state=before),
+        before=before,
+        after=after,
+    )
+    return SimpleNamespace(
+        event_type=EventType.member_update, server_id=server_id, _raw=raw
+    )
+
+
+def test_coalesce_keeps_first_before():
+    limiter = DispatchLimiter()
+    first = member_update("a", "b")
+    assert limiter.admit(first)
+
+    # Both wait for the first one, and are merged
+    assert not limiter.admit(member_update("b", "c"))
+    assert not limiter.admit(member_update("c", "d"))
+
+    merged = limiter.release(first)
+    assert merged._raw.before == "b"
+    assert merged._raw.member.state == "b"
+    assert merged._raw.after == "d"
+    assert limiter.coalesced["member_update"] == 2
+
+    assert limiter.admit(merged)
+    assert limiter.release(merged) is None
+    assert limiter.server_depth == {}
+
+
+def test_other_entities_not_coalesced():
+    limiter = DispatchLimiter()
+    assert limiter.admit(member_update("a", "b", member_id="2"))
+    assert limiter.admit(member_update("a", "b", member_id="3"))
+    assert limiter.admit(member_update("a", "b", server_id="4"))
+
+
+def test_low_priority_shed():
+    limiter = DispatchLimiter(server_limit=4, low_priority_ratio=0.5)
+    assert limiter.admit(member_update("a", "b", member_id="1"))
+    assert limiter.admit(member_update("a", "b", member_id="2"))
+    assert not limiter.admit(member_update("a", "b", member_id="3"))
+    assert limiter.dropped_low_priority["member_update"] == 1
+
+
+def test_windowed_types_not_coalesced_twice():
+    dispatch.configure({"coalesce": {"member_update": 2.0, "message_edit": 0}})
+    assert dispatch.limiter.coalesce == {EventType.message_edit}
+
+    # Already merged by the bot, dispatched side by side
+    assert dispatch.limiter.admit(member_update("a", "b"))
+    assert dispatch.limiter.admit(member_update("b", "c"))
+    dispatch.configure()
@@ -0,0 +1,60 @@
+import asyncio
+
+from spanky.hook2 import executors
+from spanky.hook2.executors import ExecClass, ExecProfile
+
+
+def test_undeclared_stays_in_thread_pool():
+    profile = ExecProfile("test_undeclared")
+    for _ in range(executors.LEARN_SAMPLES * 2):
+        profile.record(0.0)
+
+    assert profile.current is ExecClass.THREAD
+
+
+def test_auto_is_learned():
+    profile = ExecProfile("test_auto", "auto")
+    for _ in range(executors.LEARN_SAMPLES):
+        profile.record(0.0)
+    assert profile.current is ExecClass.INLINE
+
+    # Blocked the loop once, back to the thread pool for good
+    profile.record(1.0)
+    assert profile.current is ExecClass.THREAD
+    for _ in range(executors.LEARN_SAMPLES):
+        profile.record(0.0)
+    assert profile.current is ExecClass.THREAD
+
+
+def test_auto_slow_stays_in_thread_pool():
+    profile = ExecProfile("test_auto_slow", "auto")
+    for _ in range(executors.LEARN_SAMPLES - 1):
+        profile.record(0.0)
+    profile.record(0.1)
+
+    assert profile.current is ExecClass.THREAD
+
+
+def test_submit_pending_count():
+    pool = executors.ExecPool(
+        ExecClass.THREAD,
+        8,
+        1000,
+        lambda workers: executors.ThreadPoolExecutor(max_workers=workers),
+    )
+    futures = [pool.submit(sum, [i, 1]) for i in range(500)]
+
+    assert [fut.result(timeout=5) for fut in futures] == [i + 1 for i in range(500)]
+    assert pool.pending == 0
+    assert pool.completed == 500
+    pool.shutdown()
+
+
+def test_process_fallback():
+    profile = ExecProfile("test_process", "process")
+    assert asyncio.run(profile.run(sum, ([1, 2],)))[2] == 3
+    assert profile.current is ExecClass.PROCESS
+
+    # A lambda can't be sent to a process
+    assert asyncio.run(profile.run(lambda x: x + 1, (1,)))[2] == 2
+    assert profile.current is ExecClass.THREAD
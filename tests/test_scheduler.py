@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+from spanky.hook2.scheduler import MAX_CATCH_UP, PeriodicScheduler
+
+
+def periodic(catch_up="skip", running=True):
+    # Running, so that firing it only does the overlap accounting
+    return SimpleNamespace(
+        hooklet_id="test",
+        interval=10,
+        jitter=0,
+        last_time=0,
+        running=running,
+        catch_up=catch_up,
+        pending_runs=0,
+        missed_ticks=0,
+        overlaps_skipped=0,
+    )
+
+
+def scheduler(*periodics):
+    hook = SimpleNamespace(periodics={i: p for i, p in enumerate(periodics)})
+    root = SimpleNamespace(walk=lambda: [hook])
+    sched = PeriodicScheduler(None, root)
+    sched._reconcile()
+    return sched
+
+
+def test_not_due_yet():
+    skip = periodic()
+    sched = scheduler(skip)
+    sched._due(9.9)
+
+    assert skip.overlaps_skipped == 0
+    assert sched._heap[0][0] == 10
+
+
+def test_missed_ticks_skip():
+    skip = periodic()
+    sched = scheduler(skip)
+    sched._due(35)
+
+    assert skip.missed_ticks == 2
+    assert skip.overlaps_skipped == 1
+    assert skip.pending_runs == 0
+    # Keeps the cadence
+    assert sched._heap[0][0] == 40
+
+
+def test_missed_ticks_all():
+    catch_up = periodic("all")
+    sched = scheduler(catch_up)
+    sched._due(35)
+    assert catch_up.pending_runs == 3
+
+    sched._due(1000)
+    assert catch_up.pending_runs == MAX_CATCH_UP
+
+
+def test_removed_periodics_dropped():
+    removed = periodic()
+    sched = scheduler(removed)
+    sched.root.walk()[0].periodics.clear()
+    sched._reconcile()
+    sched._due(100)
+
+    assert removed.overlaps_skipped == 0
+    assert sched.stats() == []
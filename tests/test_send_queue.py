@@ -0,0 +1,115 @@
+import asyncio
+
+from spanky.utils.send_queue import SendQueue
+
+
+def run_queue(submits, count=5, period=5.0, wait=0.05):
+    """
+    Submits (key, text, mergeable, priority) messages from the event loop and returns what was sent, in order.
+    """
+    sent = []
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        queue = SendQueue(count=count, period=period)
+
+        def make_send(text):
+            async def send(merged=None):
+                sent.append(text if merged is None else merged)
+
+            return send
+
+        for key, text, mergeable, priority in submits:
+            queue.submit(
+                loop,
+                key,
+                make_send(text),
+                text=text if mergeable else None,
+                priority=priority,
+            )
+        await asyncio.sleep(wait)
+        return queue
+
+    queue = asyncio.run(main())
+    return sent, queue
+
+
+def test_unmerged_text_is_sent():
+    sent, _ = run_queue(
+        [
+            ("chan", "a reply", False, "default"),
+            ("chan", "log line", True, "default"),
+        ]
+    )
+
+    assert sent == ["a reply", "log line"]
+
+
+def test_merge():
+    sent, queue = run_queue([("chan", "line%d" % i, True, "bulk") for i in range(4)])
+
+    assert sent == ["line0\nline1\nline2\nline3"]
+    assert queue.merged == 3
+
+
+def test_merge_limit():
+    sent, _ = run_queue(
+        [
+            ("chan", "a" * 1999, True, "default"),
+            ("chan", "b", True, "default"),
+        ]
+    )
+
+    assert sent == ["a" * 1999, "b"]
+
+
+def test_priority():
+    sent, _ = run_queue(
+        [
+            ("chan", "first", False, "default"),
+            ("chan", "fun", False, "bulk"),
+            ("chan", "reply", False, "default"),
+            ("chan", "ban", False, "moderation"),
+        ]
+    )
+
+    assert sent == ["ban", "first", "reply", "fun"]
+
+
+def test_pacing():
+    submits = [("chan", str(i), False, "default") for i in range(4)]
+    submits.append(("other", "other", False, "default"))
+    sent, queue = run_queue(submits, count=2, period=10.0)
+
+    # Two per channel, the other channel isn't held back
+    assert sent == ["0", "1", "other"]
+    assert queue.depth()["default"] == 2
+
+
+def test_call():
+    sent = []
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        queue = SendQueue()
+
+        async def send_text():
+            sent.append("text")
+
+        async def send_file():
+            sent.append("file")
+            return "message"
+
+        async def fail():
+            raise ValueError()
+
+        queue.submit(loop, "chan", send_text)
+        # Waits for its turn behind the text
+        assert await queue.call("chan", send_file) == "message"
+        try:
+            await queue.call("chan", fail)
+        except ValueError:
+            sent.append("failed")
+
+    asyncio.run(main())
+    assert sent == ["text", "file", "failed"]
@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from spanky.hook2 import snapshots, storage
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "_flusher", storage.Flusher(write_behind=False))
+    return snapshots.SnapshotStore(tmp_path / "snapshots")
+
+
+def test_incremental(store):
+    first = storage.server_storage("1", "snap_first")
+    first["key"] = "value"
+    second = storage.server_storage("1", "snap_second")
+    second["key"] = "value"
+
+    assert store.take() == {"documents": 2, "changed": 1}
+
+    second["key"] = "changed"
+    assert store.take() == {"documents": 2, "changed": 1}
+    # Nothing changed
+    assert store.take() == {"documents": 2, "changed": 0}
+
+
+def test_restore(store):
+    doc = storage.server_storage("1", "snap_restore")
+    doc["key"] = "old"
+    store.take()
+    old = store.list()[-1]
+
+    # Snapshots are named after the millisecond they're taken in
+    time.sleep(0.01)
+    doc["key"] = "new"
+    store.take()
+
+    assert store.restore("1", "snap_restore", old) == old
+    assert storage.server_storage("1", "snap_restore")["key"] == "old"
+    assert store.restore("1", "missing") is None
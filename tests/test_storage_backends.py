@@ -0,0 +1,27 @@
+import os
+import stat
+
+from spanky.hook2 import storage_backends
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_atomic_write_new_file(tmp_path):
+    path = tmp_path / "doc.json"
+    storage_backends._atomic_write(path, b"{}")
+
+    assert path.read_bytes() == b"{}"
+    assert mode(path) == 0o666 & ~storage_backends._UMASK
+    assert os.listdir(tmp_path) == ["doc.json"]
+
+
+def test_atomic_write_keeps_mode(tmp_path):
+    path = tmp_path / "doc.json"
+    path.write_bytes(b"old")
+    os.chmod(path, 0o640)
+    storage_backends._atomic_write(path, b"new")
+
+    assert path.read_bytes() == b"new"
+    assert mode(path) == 0o640
@@ -0,0 +1,44 @@
+import gc
+
+import pytest
+
+from spanky.hook2 import storage
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "_flusher", storage.Flusher(write_behind=False))
+    return storage.StorageCache(max_entries=2)
+
+
+def test_eviction(cache):
+    first = cache.get("1", "first.json")
+    cache.get("1", "second.json")
+    cache.get("1", "third.json")
+
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    # Still referenced, not loaded twice
+    assert cache.get("1", "first.json") is first
+
+
+def test_invalidate_keeps_live_documents(cache):
+    doc = cache.get("1", "doc.json")
+    doc["key"] = "value"
+    cache.invalidate(lambda key: key[0] == "1")
+
+    assert len(cache) == 0
+    assert cache.get("1", "doc.json") is doc
+
+    cache.invalidate(lambda key: True)
+    del doc
+    gc.collect()
+    assert cache.get("1", "doc.json")["key"] == "value"
+
+
+def test_clear_forgets(cache):
+    doc = cache.get("1", "doc.json")
+    cache.clear()
+
+    assert cache.get("1", "doc.json") is not doc
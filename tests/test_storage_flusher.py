@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from spanky.hook2 import storage
+from spanky.hook2.storage_backends import load_json_document
+
+
+@pytest.fixture
+def flusher(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    flusher = storage.Flusher(write_behind=True, interval=0.05, max_delay=0.2)
+    monkeypatch.setattr(storage, "_flusher", flusher)
+    return flusher
+
+
+def doc_path(tmp_path, name):
+    return tmp_path / storage.DS_LOC / "server" / f"{name}.json"
+
+
+def wait_for(check, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_write_behind(tmp_path, flusher):
+    doc = storage.dsdict("server", "behind")
+    for i in range(10):
+        doc["key"] = i
+
+    # Written once, in the background
+    assert wait_for(lambda: flusher.flushes)
+    assert load_json_document(doc_path(tmp_path, "behind")) == {"key": 9}
+    time.sleep(0.1)
+    assert flusher.flushes == 1
+
+
+def test_flush_all(tmp_path, flusher):
+    flusher.interval = flusher.max_delay = 3600
+    doc = storage.dsdict("server", "flush_all")
+    doc["key"] = "value"
+    assert doc.dirty_since is not None
+
+    storage.flush_all()
+
+    assert doc.dirty_since is None
+    assert load_json_document(doc_path(tmp_path, "flush_all")) == {"key": "value"}
+
+
+def test_write_through(tmp_path, flusher):
+    flusher.write_behind = False
+    doc = storage.dsdict("server", "through")
+    doc["key"] = 1
+
+    assert load_json_document(doc_path(tmp_path, "through")) == {"key": 1}
+
+
+def test_write_behind_is_opt_in(flusher):
+    storage.configure({})
+    assert not flusher.write_behind
+
+    storage.configure({"storage": {"write_behind": True}})
+    assert flusher.write_behind
@@ -0,0 +1,176 @@
+import copy
+
+import pytest
+
+from spanky.hook2 import storage
+from spanky.hook2.storage_backends import JsonBackend, SqliteBackend
+from spanky.hook2.storage_index import CollectionIndex, IndexedList
+
+
+def grabs():
+    return [
+        {"author": "b", "time": 3},
+        {"author": "a", "time": 1},
+        {"author": "b", "time": 2},
+        {"text": "no author"},
+    ]
+
+
+def test_get():
+    items = IndexedList(grabs(), keys=["author"])
+    index = items.indexes["author"]
+
+    assert index.get("b") == [items[0], items[2]]
+    assert index.get("missing") == []
+
+
+def test_range():
+    items = IndexedList(grabs(), keys=["time"])
+    index = items.indexes["time"]
+
+    assert [item["time"] for item in index.range()] == [1, 2, 3]
+    assert [item["time"] for item in index.range(2)] == [2, 3]
+    assert [item["time"] for item in index.range(None, 3)] == [1, 2]
+
+    # Added after the values were sorted
+    items.append({"time": 2.5})
+    assert [item["time"] for item in index.range(2, 3)] == [2, 2.5]
+
+
+def test_range_mixed_types():
+    items = IndexedList(
+        [{"time": 2}, {"time": "later"}, {"time": None}, {"time": 1.5}],
+        keys=["time"],
+    )
+    index = items.indexes["time"]
+
+    assert [item["time"] for item in index.range(0)] == [1.5, 2]
+    assert [item["time"] for item in index.range("a", "z")] == ["later"]
+    assert len(index.range()) == 4
+
+    items.append({"time": "earlier"})
+    items.remove({"time": None})
+    assert [item["time"] for item in index.range("a")] == ["earlier", "later"]
+
+
+def test_mutations_keep_list_order():
+    items = IndexedList(grabs(), keys=["author"])
+    index = items.indexes["author"]
+
+    items.insert(0, {"author": "b", "time": 0})
+    assert index.get("b") == [items[0], items[1], items[3]]
+
+    # Replaced in place
+    items[1] = {"author": "b", "time": 4}
+    assert [item["time"] for item in index.get("b")] == [0, 4, 2]
+
+    # Moved to another bucket
+    items[3] = {"author": "a", "time": 5}
+    assert [item["time"] for item in index.get("a")] == [1, 5]
+    assert [item["time"] for item in index.get("b")] == [0, 4]
+
+    items[0:2] = [{"author": "a", "time": 6}]
+    assert [item["time"] for item in index.get("a")] == [6, 1, 5]
+    assert index.get("b") == []
+
+    del items[0]
+    items.pop()
+    assert [item["time"] for item in index.get("a")] == [1, 5]
+
+
+def test_dump_restore():
+    items = IndexedList(grabs(), keys=["author"])
+    dumped = items.indexes["author"].dump(items)
+
+    restored = CollectionIndex("author")
+    assert restored.restore(items, dumped)
+    assert restored.get("b") == [items[0], items[2]]
+
+    # Positions past the end of the list
+    assert not CollectionIndex("author").restore(items[:1], dumped)
+
+
+def test_copies_rebuild_indexes():
+    items = IndexedList(grabs(), keys=["author"])
+    copied = copy.deepcopy(items)
+
+    assert list(copied.indexes) == ["author"]
+    assert copied.indexes["author"].get("a") == [copied[1]]
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "_flusher", storage.Flusher(write_behind=False))
+    if request.param == "json":
+        backend = JsonBackend(storage.DS_LOC)
+    else:
+        backend = SqliteBackend(tmp_path / "storage.db")
+    monkeypatch.setattr(storage, "_backend", backend)
+    yield backend
+    backend.close()
+
+
+def edit_stored(backend, doc, edit):
+    # Changes the document behind the bot's back
+    if isinstance(backend, SqliteBackend):
+        location = doc.location.as_posix()
+        with backend._conn:
+            for key, value in backend._conn.execute(
+                "SELECT key, value FROM storage WHERE doc = ?", (location,)
+            ).fetchall():
+                backend._conn.execute(
+                    "UPDATE storage SET value = ? WHERE doc = ? AND key = ?",
+                    (edit(value), location, key),
+                )
+    else:
+        path = backend.root / doc.location
+        path.write_text(edit(path.read_text()))
+
+
+def saved_grabs(name):
+    doc = storage.dsdict("server", name)
+    doc["grabs"] = [{"time": "1700000000"}, {"time": "1700000001"}]
+    doc.index("grabs", "time")
+    doc.sync()
+    return doc
+
+
+def test_saved_index_reused(backend):
+    saved_grabs("reused")
+
+    doc = storage.dsdict("server", "reused")
+    assert doc.index("grabs", "time").get("1700000001") == [{"time": "1700000001"}]
+    saved = doc._saved_indexes["grabs"]
+    assert saved["version"] == backend.index_version(doc, "grabs")
+
+
+@pytest.mark.parametrize(
+    "edit",
+    [
+        # Same size, same count
+        lambda text: text.replace("1700000000", "1700000002"),
+        # Swapped
+        lambda text: text.replace("1700000000", "swap")
+        .replace("1700000001", "1700000000")
+        .replace("swap", "1700000001"),
+    ],
+)
+def test_saved_index_stale(backend, edit):
+    doc = saved_grabs("stale")
+    edit_stored(backend, doc, edit)
+
+    doc = storage.dsdict("server", "stale")
+    index = doc.index("grabs", "time")
+    for item in doc.data["grabs"]:
+        assert index.get(item["time"]) == [item]
+
+
+def test_saved_index_changed_in_memory(backend):
+    saved_grabs("memory")
+
+    doc = storage.dsdict("server", "memory")
+    doc["grabs"][0]["time"] = "1700000002"
+    index = doc.index("grabs", "time")
+    assert index.get("1700000002") == [{"time": "1700000002"}]
+    assert index.get("1700000000") == []
@@ -0,0 +1,74 @@
+import pytest
+
+from spanky.hook2 import storage, storage_backends
+from spanky.hook2.storage_backends import JsonBackend, _atomic_write, _journal_path
+from spanky.utils import codec
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "_flusher", storage.Flusher(write_behind=False))
+    backend = JsonBackend(storage.DS_LOC, journal=True, compact_min=1 << 20)
+    monkeypatch.setattr(storage, "_backend", backend)
+    return backend
+
+
+def journal(doc):
+    path = _journal_path(doc.backend.root / doc.location)
+    return [codec.loads_json(line) for line in path.read_bytes().splitlines()]
+
+
+def test_appends(backend):
+    doc = storage.dsdict("server", "appends")
+    doc["items"] = [1]
+    doc["items"].append(2)
+    doc.sync()
+
+    assert journal(doc)[1:] == [{"k": "items", "v": [1]}, {"k": "items", "a": [2]}]
+    assert dict(storage.dsdict("server", "appends")) == {"items": [1, 2]}
+
+
+def test_only_changed_keys_encoded(backend, monkeypatch):
+    doc = storage.dsdict("server", "changed")
+    doc["big"] = list(range(1000))
+    doc["small"] = 1
+    doc = storage.dsdict("server", "changed")
+
+    encoded = []
+    dumps_json = codec.dumps_json
+
+    def counting_dumps(obj, *args):
+        encoded.append(obj)
+        return dumps_json(obj, *args)
+
+    monkeypatch.setattr(storage_backends.codec, "dumps_json", counting_dumps)
+    doc["small"] = 2
+
+    assert all(obj != list(range(1000)) for obj in encoded)
+    assert journal(doc)[-1] == {"k": "small", "v": 2}
+
+
+def test_held_references(backend):
+    doc = storage.dsdict("server", "held")
+    doc["items"] = []
+    items = doc["items"]
+    for i in range(3):
+        items.append(i)
+        doc.sync()
+
+    assert dict(storage.dsdict("server", "held")) == {"items": [0, 1, 2]}
+
+
+def test_compaction_crash(backend):
+    doc = storage.dsdict("server", "crash")
+    doc["items"] = [1]
+    doc["items"].append(2)
+    doc.sync()
+
+    # Died after writing the snapshot, before deleting the journal
+    path = backend.root / doc.location
+    _atomic_write(path, codec.encode(doc.data, backend.codec))
+
+    assert dict(storage.dsdict("server", "crash")) == {"items": [1, 2]}
+    assert not _journal_path(path).exists()
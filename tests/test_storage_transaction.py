@@ -0,0 +1,176 @@
+import asyncio
+import threading
+
+import pytest
+
+from spanky.hook2 import storage
+
+
+@pytest.fixture
+def doc(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Write-through, so that every sync() is a write
+    monkeypatch.setattr(storage, "_flusher", storage.Flusher(write_behind=False))
+    doc = storage.dsdict("server", "transaction")
+    doc["items"] = [1, 2]
+    doc["name"] = "before"
+    return doc
+
+
+@pytest.fixture
+def writes(doc, monkeypatch):
+    writes = []
+    write = doc.backend.write
+
+    def counting_write(docs):
+        writes.extend(dict(d) for d in docs)
+        write(docs)
+
+    monkeypatch.setattr(doc.backend, "write", counting_write)
+    return writes
+
+
+def test_commit(doc, writes):
+    with doc.transaction():
+        doc["items"].append(3)
+        doc.sync()
+        doc["name"] = "after"
+        doc["new"] = True
+
+    assert writes == [{"items": [1, 2, 3], "name": "after", "new": True}]
+
+
+def test_rollback(doc, writes):
+    with pytest.raises(ValueError):
+        with doc.transaction():
+            doc["items"].append(3)
+            doc["name"] = "after"
+            doc["new"] = True
+            del doc["name"]
+            raise ValueError()
+
+    assert dict(doc) == {"items": [1, 2], "name": "before"}
+
+
+def test_nested(doc, writes):
+    with pytest.raises(ValueError):
+        with doc.transaction():
+            doc["name"] = "outer"
+            with doc.transaction():
+                doc["items"].append(3)
+            raise ValueError()
+
+    # The inner transaction joined the outer one
+    assert dict(doc) == {"items": [1, 2], "name": "before"}
+
+
+def test_other_threads(doc, writes):
+    entered = threading.Event()
+    written = threading.Event()
+
+    def other():
+        entered.wait()
+        doc["other"] = "kept"
+        written.set()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    with pytest.raises(ValueError):
+        with doc.transaction():
+            doc["name"] = "after"
+            entered.set()
+            written.wait()
+            # Not deferred by this thread's transaction
+            assert writes[-1]["other"] == "kept"
+            raise ValueError()
+    thread.join()
+
+    assert doc["other"] == "kept"
+    assert doc["name"] == "before"
+
+
+def test_other_tasks(doc, writes):
+    async def main():
+        entered = asyncio.Event()
+        written = asyncio.Event()
+
+        async def transaction():
+            with doc.transaction():
+                doc["name"] = "after"
+                entered.set()
+                await written.wait()
+                raise ValueError()
+
+        async def other():
+            await entered.wait()
+            doc["other"] = "kept"
+            written.set()
+
+        results = await asyncio.gather(transaction(), other(), return_exceptions=True)
+        assert isinstance(results[0], ValueError)
+
+    asyncio.run(main())
+    assert doc["other"] == "kept"
+    assert doc["name"] == "before"
+
+
+def test_batch_other_tasks(doc, writes):
+    async def main():
+        entered = asyncio.Event()
+        written = asyncio.Event()
+
+        async def batch():
+            async with doc.batch():
+                doc["name"] = "after"
+                entered.set()
+                await written.wait()
+                # Not deferred by this task's batch
+                assert writes[-1]["other"] == "kept"
+            assert len(writes) == 2
+
+        async def other():
+            await entered.wait()
+            doc["other"] = "kept"
+            written.set()
+
+        await asyncio.gather(batch(), other())
+
+    asyncio.run(main())
+
+
+def test_rollback_nested(doc, writes):
+    doc["roles"] = {"mute": [{"user": "1"}], "ban": [{"user": "2"}]}
+    with pytest.raises(ValueError):
+        with doc.transaction():
+            doc["roles"]["mute"][0]["user"] = "3"
+            doc["roles"]["mute"].append({"user": "4"})
+            doc["roles"].pop("ban")
+            raise ValueError()
+
+    assert doc["roles"] == {"mute": [{"user": "1"}], "ban": [{"user": "2"}]}
+
+
+def test_copy_on_write(doc, writes):
+    doc["roles"] = {"mute": [{"user": "1"}], "ban": [{"user": "2"}]}
+    ban = doc["roles"]["ban"]
+    items = doc["items"]
+
+    with doc.transaction():
+        mute = doc["roles"]["mute"]
+        mute.remove({"user": "1"})
+        doc.sync()
+        # Replaced, nothing to copy
+        doc["items"] = [3]
+
+    # What the transaction didn't reach wasn't copied
+    assert doc["roles"]["ban"] is ban
+    assert items == [1, 2]
+    assert writes[-1] == {
+        "items": [3],
+        "name": "before",
+        "roles": {"mute": [], "ban": ban},
+    }
+
+    # Still the stored list once the transaction is over
+    mute.append({"user": "5"})
+    assert doc["roles"]["mute"] == [{"user": "5"}]
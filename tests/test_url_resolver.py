@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+from spanky.utils import url_resolver
+from spanky.utils.url_resolver import TTLCache, UrlResolver
+
+
+def message(text, attachments=()):
+    return SimpleNamespace(
+        text=text,
+        attachments=[SimpleNamespace(url=url) for url in attachments],
+        embeds=[],
+        is_pm=True,
+        server_replies=None,
+        str_to_id=lambda word: word.strip("<>").replace(":", " "),
+    )
+
+
+def test_nowait_finds_what_needs_no_request():
+    resolver = UrlResolver({})
+    assert (
+        resolver.resolve_nowait(message("hi", ["https://a/b.png"])) == "https://a/b.png"
+    )
+    assert resolver.resolve_nowait(message("look https://c/d.gif")) == "https://c/d.gif"
+
+
+def test_nowait_skips_requests():
+    resolver = UrlResolver({})
+    probed = []
+
+    async def probe(url):
+        probed.append(url)
+        return True
+
+    resolver._probe = probe
+
+    assert resolver.resolve_nowait(message("<:emoji:1234>")) is None
+    assert probed == []
+    assert asyncio.run(
+        resolver.resolve(message("<:emoji:1234>"))
+    ) == url_resolver.EMOJI_URL % ("1234", "gif")
+
+
+def test_nowait_skips_resolvers_that_wait():
+    async def waits(resolver, event):
+        await asyncio.sleep(0)
+        return "https://waited"
+
+    resolver = UrlResolver({}, resolvers=[waits, url_resolver.from_link])
+    assert resolver.resolve_nowait(message("https://link")) == "https://link"
+
+
+def test_ttl_cache():
+    cache = TTLCache(positive_ttl=60, negative_ttl=0, max_size=2)
+    cache.set("found", True)
+    cache.set("missing", False)
+    assert cache.get("found") is True
+    assert "missing" not in cache
+
+    cache.set("other", True)
+    assert "found" not in cache
+    assert cache.get("other") is True